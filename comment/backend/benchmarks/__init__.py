@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from time import perf_counter
+
+BENCHMARKS = OrderedDict()
+
+
+def register(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def timed_ms(func, *args, **kwargs):
+    started = perf_counter()
+    func(*args, **kwargs)
+    return (perf_counter() - started) * 1000
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings):
+    return {
+        'runs': len(timings),
+        'min_ms': round(min(timings), 3),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+from . import ancestors, api, revisions, serialization  # noqa: E402,F401
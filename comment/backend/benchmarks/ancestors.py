@@ -0,0 +1,63 @@
+import json
+from random import randint
+
+from django.db import connection
+
+from . import register, summarize, timed_ms
+
+# Synthetic four-level forest: every row lives under a chain of ancestors
+# whose fan-out makes the deepest subtree about 100 rows, the shallowest
+# about 100k rows.
+CREATE_TABLE_SQL = '''
+CREATE TEMPORARY TABLE bench_ancestors AS
+SELECT g AS id,
+       ARRAY[g / 100000, 10000000 + g / 10000,
+             20000000 + g / 1000, 30000000 + g / 100]::integer[] AS ancestors
+FROM generate_series(1, %s) AS g
+'''
+SUBTREE_SQL = 'SELECT id FROM bench_ancestors WHERE ancestors @> ARRAY[%s]::integer[]'
+
+
+def _plan_node(cursor, parent):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + SUBTREE_SQL, [parent])
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Node Type']
+
+
+def _measure(cursor, parents):
+    def run(parent):
+        cursor.execute(SUBTREE_SQL, [parent])
+        cursor.fetchall()
+
+    timings = [timed_ms(run, parent) for parent in parents]
+    result = summarize(timings)
+    result['plan'] = _plan_node(cursor, parents[0])
+    return result
+
+
+@register('ancestors_index')
+def run(rows=1000000, repeat=20, **options):
+    """
+    Time `ancestors @> ARRAY[x]` subtree lookups without an index, with the
+    B-tree index the field used to declare, and with a GIN index.
+    """
+    parents = [30000000 + randint(0, rows // 100) for _ in range(repeat)]
+    results = {'rows': rows}
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS bench_ancestors')
+        cursor.execute(CREATE_TABLE_SQL, [rows])
+        cursor.execute('ANALYZE bench_ancestors')
+        results['seq_scan'] = _measure(cursor, parents)
+
+        cursor.execute('CREATE INDEX bench_ancestors_btree ON bench_ancestors (ancestors)')
+        cursor.execute('ANALYZE bench_ancestors')
+        results['btree'] = _measure(cursor, parents)
+        cursor.execute('DROP INDEX bench_ancestors_btree')
+
+        cursor.execute('CREATE INDEX bench_ancestors_gin ON bench_ancestors USING gin (ancestors)')
+        cursor.execute('ANALYZE bench_ancestors')
+        results['gin'] = _measure(cursor, parents)
+        cursor.execute('DROP TABLE bench_ancestors')
+    return results
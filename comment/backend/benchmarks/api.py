@@ -0,0 +1,165 @@
+import json
+import random
+import shutil
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+
+from backend.cache import invalidate_exports
+from backend.datasets import generate_dataset
+from backend.models import Comment, CommentSummary
+from . import register, summarize
+
+# Dataset shapes: bushy threads a few levels deep, or the 120 long reply
+# chains the old dummy data builder produced.
+SHAPES = {
+    'shallow': {'max_depth': 6, 'fan_out': 3.0, 'min_replies': 0},
+    'deep': {'max_depth': 120, 'fan_out': 0.2, 'min_replies': 1},
+}
+
+
+def _consume(response):
+    if response.streaming:
+        b''.join(response.streaming_content)
+    else:
+        response.content
+    if response.status_code >= 400:
+        raise RuntimeError('{0} {1}'.format(response.status_code, response.content[:200]))
+
+
+def _measure(make_request, repeat):
+    """
+    Time `repeat` requests, counting their queries, then replay one more
+    under tracemalloc for the peak Python memory, which tracing would
+    otherwise inflate the timings with.
+    """
+    timings = []
+    queries = []
+    for i in range(repeat):
+        request = make_request(i)
+        with CaptureQueriesContext(connection) as captured:
+            started = perf_counter()
+            _consume(request())
+            timings.append((perf_counter() - started) * 1000)
+        queries.append(len(captured))
+    request = make_request(repeat)
+    tracemalloc.start()
+    try:
+        _consume(request())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    result = summarize(timings)
+    result['queries'] = sorted(queries)[len(queries) // 2]
+    result['throughput_rps'] = round(len(timings) / (sum(timings) / 1000), 1)
+    result['peak_memory_kb'] = round(peak / 1024, 1)
+    return result
+
+
+def _sample(rng, values, count, unique=False):
+    values = sorted(values)
+    if not values or (unique and len(values) < count):
+        raise RuntimeError('The dataset is too small for this benchmark.')
+    if unique:
+        return rng.sample(values, count)
+    return [rng.choice(values) for _ in range(count)]
+
+
+def _comments(ids):
+    comments = Comment.objects.in_bulk(ids)
+    return [comments[comment_id] for comment_id in ids]
+
+
+def _operations(client, repeat, seeded_after):
+    # Targets come from the seeded rows only, not from data already present,
+    # and from a seeded generator, so that runs pick the same ones.
+    rng = random.Random(0)
+    count = repeat + 1
+    seeded = Comment.objects.filter(id__gt=seeded_after['comment'])
+    objects = _sample(rng, CommentSummary.objects.filter(id__gt=seeded_after['summary'])
+                      .values_list('object_id', flat=True), count)
+    roots = _comments(_sample(rng, seeded.filter(level=0, children_count__gt=0)
+                              .values_list('id', flat=True), count))
+    comments = _comments(_sample(rng, seeded.values_list('id', flat=True), count))
+    # Each leaf is deleted once, and none of them gets a reply from `create`.
+    leaves = _comments(_sample(rng, set(seeded.filter(children_count=0).values_list('id', flat=True)) -
+                               {comment.id for comment in comments}, count, unique=True))
+    list_url = reverse('comment-list')
+
+    def get(url, params=None):
+        return lambda: client.get(url, params or {})
+
+    def patch(comment):
+        return lambda: client.patch(reverse('comment-detail', args=(comment.id,)), json.dumps({
+            'user_id': comment.user_id,
+            'text': 'Benchmark update'
+        }), content_type='application/json')
+
+    def post(parent):
+        return lambda: client.post(list_url, {
+            'user': parent.user_id,
+            'text': 'Benchmark reply',
+            'object_id': parent.object_id,
+            'content_type': parent.content_type_id,
+            'parent': parent.id
+        })
+
+    def delete(comment):
+        return lambda: client.delete(reverse('comment-detail', args=(comment.id,)), json.dumps({
+            'user_id': comment.user_id
+        }), content_type='application/json')
+
+    def download(i):
+        # Every run exports instead of reusing the cached file.
+        invalidate_exports()
+        return client.get(reverse('comment-download'), {'object_id': objects[i]})
+
+    return [
+        ('list_level', lambda i: get(list_url, {'level': 0})),
+        ('list_level_cursor', lambda i: get(list_url, {'level': 0, 'pagination': 'cursor'})),
+        ('list_object', lambda i: get(list_url, {'object_id': objects[i]})),
+        ('list_parent', lambda i: get(list_url, {'parent': roots[i].id})),
+        ('tree', lambda i: get(reverse('comment-tree'), {'object_id': objects[i]})),
+        ('download', lambda i: lambda: download(i)),
+        ('history', lambda i: get(reverse('historicalcomment-list'), {'id': comments[i].id})),
+        ('create', lambda i: post(comments[i])),
+        ('update', lambda i: patch(comments[i])),
+        ('delete', lambda i: delete(leaves[i])),
+    ]
+
+
+@register('api')
+def run(rows=1000000, repeat=20, shape='shallow', **options):
+    """
+    Seed `rows` comments of the given shape and time the comment API
+    endpoints in process through the Django test client, with Celery
+    tasks run eagerly. Everything is rolled back afterwards.
+    """
+    results = {'rows': rows, 'shape': shape}
+    export_dir = tempfile.mkdtemp()
+    client = Client()
+    try:
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver'],
+                                                     CELERY_TASK_ALWAYS_EAGER=True,
+                                                     COMMENT_EXPORT_DIR=export_dir):
+            objects = max(1, rows // 200)
+            seeded_after = {
+                'comment': Comment.objects.aggregate(id=Max('id'))['id'] or 0,
+                'summary': CommentSummary.objects.aggregate(id=Max('id'))['id'] or 0,
+            }
+            started = perf_counter()
+            generate_dataset(max(1, rows // 100), objects // 2 + objects % 2, objects // 2,
+                             rows, history=True, seed=0, **SHAPES[shape])
+            results['seed_seconds'] = round(perf_counter() - started, 3)
+            for name, make_request in _operations(client, repeat, seeded_after):
+                results[name] = _measure(make_request, repeat)
+            transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    return results
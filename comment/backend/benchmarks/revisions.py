@@ -0,0 +1,86 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce, Length
+from django.utils.timezone import now
+
+from backend.models import Comment
+from backend.revisions import compact_history, restore_texts
+from . import register, summarize, timed_ms
+
+# Each comment gets EDITS revisions of a text of about TEXT_LENGTH
+# characters, every one changing a few words of the previous revision.
+EDITS = 50
+TEXT_LENGTH = 2000
+MAX_ROWS = 200000
+PAGE_SIZE = 100
+
+
+def _edit(rng, text):
+    words = text.split(' ')
+    for _ in range(rng.randint(1, 3)):
+        words[rng.randrange(len(words))] = 'edited{0}'.format(rng.randrange(1000))
+    return ' '.join(words)
+
+
+def _create_history(rows, rng):
+    history_model = Comment.history.model
+    user = get_user_model().objects.create(username='benchmark-revisions')
+    comments = rows // EDITS
+    ids = Comment.objects.allocate_ids(comments)
+    started = now()
+    words = ['word{0}'.format(i) for i in range(500)]
+    history = []
+    for comment_id in ids:
+        text = ' '.join(rng.choice(words) for _ in range(TEXT_LENGTH // 8))
+        for edit in range(EDITS):
+            history.append(history_model(id=comment_id, ancestors=[], text=text, history_user=user,
+                                         history_type='~' if edit else '+',
+                                         history_date=started + timedelta(seconds=edit)))
+            text = _edit(rng, text)
+    history_model.objects.bulk_create(history, batch_size=5000)
+    return ids
+
+
+def _text_chars(ids):
+    return Comment.history.filter(id__in=ids).aggregate(
+        size=Sum(Length('text') + Coalesce(Length('history_delta'), 0)))['size']
+
+
+def _read_page(ids):
+    page = Comment.history.filter(id__in=ids).order_by('-history_date', '-history_id')[:PAGE_SIZE]
+    return restore_texts(list(page))
+
+
+@register('history_revisions')
+def run(rows=1000000, repeat=20, **options):
+    """
+    Compare the text stored for heavily edited comments before and after
+    compaction into snapshots and deltas, and time reading a page of
+    their revisions either way. Runs in a transaction that is rolled back.
+    """
+    rows = max(min(rows, MAX_ROWS), EDITS)
+    rng = random.Random(0)
+    results = {'revisions': rows // EDITS * EDITS, 'edits_per_comment': EDITS}
+    with transaction.atomic():
+        ids = _create_history(rows, rng)
+        pages = [rng.sample(ids, min(len(ids), PAGE_SIZE // EDITS + 1)) for _ in range(repeat)]
+        full = [[r.text for r in _read_page(page)] for page in pages]
+        results['full'] = summarize([timed_ms(_read_page, page) for page in pages])
+        full_chars = _text_chars(ids)
+
+        results['compact_ms'] = round(timed_ms(compact_history, Comment.history.model, ids), 3)
+        results['compacted'] = summarize([timed_ms(_read_page, page) for page in pages])
+        compacted_chars = _text_chars(ids)
+        results['identical'] = [[r.text for r in _read_page(page)] for page in pages] == full
+
+        results['text_chars'] = {
+            'full': full_chars,
+            'compacted': compacted_chars,
+            'saved': round(1 - compacted_chars / full_chars, 3),
+        }
+        transaction.set_rollback(True)
+    return results
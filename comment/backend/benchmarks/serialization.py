@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from backend.models import Comment, Page
+from backend.serializers import CommentSerializer, serialize_comment_rows
+from . import register, summarize, timed_ms
+
+# Serializer path cost grows linearly and is slow, so larger --rows values
+# are capped to keep a default run within minutes.
+MAX_ROWS = 100000
+BATCH_SIZE = 5000
+
+
+def _create_comments(rows):
+    user = get_user_model().objects.create(username='benchmark-serialization')
+    page = Page.objects.create(user=user, title='benchmark')
+    content_type = ContentType.objects.get_for_model(Page)
+    ids = Comment.objects.allocate_ids(rows)
+    for start in range(0, rows, BATCH_SIZE):
+        Comment.objects.bulk_create(
+            Comment(id=pk, user=user, content_type=content_type, object_id=page.id,
+                    level=0, ancestors=[], text='Benchmark comment {0}'.format(pk))
+            for pk in ids[start:start + BATCH_SIZE])
+    return Comment.objects.filter(object_id=page.id, content_type=content_type)
+
+
+@register('comment_serialization')
+def run(rows=1000000, repeat=20, **options):
+    """
+    Time rendering a thread through `CommentSerializer(many=True)` against
+    the column-projected `serialize_comment_rows` used by `get_comments`.
+    The data is created in a transaction that is rolled back afterwards.
+    """
+    rows = min(rows, MAX_ROWS)
+    results = {'rows': rows}
+    with transaction.atomic():
+        queryset = _create_comments(rows)
+        results['serializer'] = summarize(
+            [timed_ms(lambda: CommentSerializer(queryset.all(), many=True).data)
+             for _ in range(repeat)])
+        results['values_list'] = summarize(
+            [timed_ms(serialize_comment_rows, queryset.all()) for _ in range(repeat)])
+        results['identical'] = serialize_comment_rows(queryset.all()) == \
+            CommentSerializer(queryset.all(), many=True).data
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import COUNTERS
+
+EXPORT_GENERATION_KEY = 'comment-export-generation'
+THREAD_VERSION_KEY = 'comment-thread-version-{0}-{1}'
+THREAD_CACHE_KEY = 'comment-thread-{0}'
+
+
+def _initial_generation():
+    # Seeding from the clock keeps generations fresh if the key is evicted.
+    return int(time() * 1000)
+
+
+def get_export_generation():
+    generation = cache.get(EXPORT_GENERATION_KEY)
+    if generation is None:
+        cache.add(EXPORT_GENERATION_KEY, _initial_generation(), None)
+        generation = cache.get(EXPORT_GENERATION_KEY)
+    return generation
+
+
+def _bump_generation(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_generation(), None)
+
+
+def invalidate_exports():
+    """
+    Any comment write may change the content of any export, so writes bump
+    a global generation that is part of every export cache key. As with
+    threads, a second bump after the commit retires exports started from
+    the old rows under the first one.
+    """
+    _bump_generation(EXPORT_GENERATION_KEY)
+    transaction.on_commit(lambda: _bump_generation(EXPORT_GENERATION_KEY))
+
+
+def get_export_cache_key(spec, format_suffix):
+    normalized = json.dumps(spec, sort_keys=True)
+    digest = hashlib.sha1('{0}:{1}'.format(format_suffix, normalized).encode()).hexdigest()
+    return 'comment-export-{0}-{1}'.format(get_export_generation(), digest)
+
+
+def get_thread_versions(threads):
+    keys = [THREAD_VERSION_KEY.format(content_type_id, object_id)
+            for content_type_id, object_id in threads]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_generation(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_thread(content_type_id, object_id):
+    """
+    Move the version of the comment thread of an object on, which retires
+    every cached listing of it. The second bump after the commit drops
+    what readers cached from the old rows under the first one meanwhile.
+    """
+    key = THREAD_VERSION_KEY.format(content_type_id, object_id)
+    _bump_generation(key)
+    transaction.on_commit(lambda: _bump_generation(key))
+
+
+class ThreadCache(object):
+    """
+    Rendered comment listings, compressed in the default cache with an
+    in-process LRU of at most COMMENT_THREAD_CACHE_LOCAL_BYTES in front.
+    Keys carry the versions of the threads a listing was read from, so
+    entries never need to be deleted, only to age out.
+    """
+
+    def __init__(self):
+        self.local = OrderedDict()
+        self.local_bytes = 0
+        self.lock = threading.Lock()
+
+    def get_key(self, params, threads):
+        if not settings.COMMENT_THREAD_CACHE_TTL:
+            return None
+        normalized = json.dumps([params, get_thread_versions(threads)], sort_keys=True)
+        return THREAD_CACHE_KEY.format(hashlib.sha1(normalized.encode()).hexdigest())
+
+    def get(self, key):
+        counter = COUNTERS['comment_thread_cache_lookups_total']
+        with self.lock:
+            payload = self.local.get(key)
+            if payload is not None:
+                self.local.move_to_end(key)
+                counter.inc('local_hit')
+                return payload
+        compressed = cache.get(key)
+        if compressed is None:
+            counter.inc('miss')
+            return None
+        counter.inc('hit')
+        payload = zlib.decompress(compressed)
+        self.set_local(key, payload)
+        return payload
+
+    def set(self, key, payload, local=True):
+        cache.set(key, zlib.compress(payload, 6), settings.COMMENT_THREAD_CACHE_TTL)
+        if local:
+            self.set_local(key, payload)
+
+    def set_local(self, key, payload):
+        limit = settings.COMMENT_THREAD_CACHE_LOCAL_BYTES
+        if len(payload) > limit // 4:
+            return
+        with self.lock:
+            if key in self.local:
+                return
+            self.local[key] = payload
+            self.local_bytes += len(payload)
+            while self.local_bytes > limit:
+                self.local_bytes -= len(self.local.popitem(last=False)[1])
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+            self.local_bytes = 0
+
+
+thread_cache = ThreadCache()
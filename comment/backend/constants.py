@@ -1,3 +1,8 @@
 COMMENT_CREATED_REASON = 'created'
 COMMENT_UPDATED_REASON = 'modified'
 COMMENT_DELETED_REASON = 'deleted'
+
+# Comment.path is built from zero-padded ids so that lexical order of the
+# path equals depth-first display order of the tree.
+COMMENT_PATH_SEGMENT_WIDTH = 10
+COMMENT_PATH_SEPARATOR = '.'
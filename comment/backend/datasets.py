@@ -0,0 +1,228 @@
+import math
+import random
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils.timezone import now
+from faker import Factory
+
+from .constants import COMMENT_PATH_SEPARATOR
+from .models import BlogArticle, Comment, CommentSummary, Page, make_path_segment
+from .partitions import create_history_partitions
+
+# Replies arrive up to this many days after their parent.
+REPLY_DELAY_DAYS = 3
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return '{' + ','.join(str(v) for v in value) + '}'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).translate(COPY_ESCAPES)
+
+
+class CopyWriter(object):
+    """
+    Buffers rows for one table and loads them with COPY FROM STDIN every
+    `chunk_size` rows.
+    """
+
+    def __init__(self, cursor, model, columns, chunk_size):
+        self.cursor = cursor
+        self.sql = 'COPY {0} ({1}) FROM STDIN'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(c) for c in columns))
+        self.chunk_size = chunk_size
+        self.buffer = StringIO()
+        self.pending = 0
+        self.written = 0
+
+    def write(self, row):
+        self.buffer.write('\t'.join(copy_value(v) for v in row))
+        self.buffer.write('\n')
+        self.pending += 1
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.buffer.seek(0)
+            self.cursor.copy_expert(self.sql, self.buffer)
+            self.written += self.pending
+            self.buffer = StringIO()
+            self.pending = 0
+
+
+def reserve_ids(cursor, model, count):
+    """
+    Move the id sequence of `model` past `count` values in one statement
+    and return the first reserved id. Meant for loading into an otherwise
+    idle database.
+    """
+    if not count:
+        return 0
+    cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                   "nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+                   [model._meta.db_table, model._meta.db_table, count])
+    return cursor.fetchone()[0] - count + 1
+
+
+def generate_thread(rng, first_id, budget, max_depth, fan_out, min_replies=0):
+    """
+    Shape a thread of at most `budget` comments as `(id, parent index,
+    level)` tuples in pre-order. Reply counts per comment are geometric
+    with mean `fan_out`, which gives the long tail of busy subthreads real
+    discussions have, and at least `min_replies` above `max_depth`.
+    """
+    # Rounding down an exponential draw of this rate is geometric with
+    # mean fan_out; with rate 1 / fan_out the mean would be half a reply short.
+    rate = math.log(1 + 1.0 / fan_out) if fan_out else None
+    nodes = []
+    stack = [(None, 0)]
+    while stack and len(nodes) < budget:
+        parent, level = stack.pop()
+        index = len(nodes)
+        nodes.append((first_id + index, parent, level))
+        if level < max_depth:
+            replies = int(rng.expovariate(rate)) if fan_out else 0
+            replies = max(replies, min_replies)
+            stack.extend([(index, level + 1)] * replies)
+    return nodes
+
+
+def generate_dataset(users, pages, articles, comments, max_depth=10, fan_out=2.0,
+                     min_replies=0, history=True, seed=None, chunk_size=50000):
+    """
+    Load `users`, `pages`, `articles` and about `comments` comments spread
+    over the pages and articles, streaming every table through COPY. Tree
+    columns, reply counts and object summaries are computed in memory.
+    """
+    rng = random.Random(seed)
+    fake = Factory.create()
+    fake.seed(rng.randint(0, 2 ** 31))
+    texts = [fake.text() for _ in range(500)]
+    titles = [fake.sentence() for _ in range(500)]
+    started = now()
+    user_model = get_user_model()
+    objects = [(ContentType.objects.get_for_model(Page).id, Page, pages),
+               (ContentType.objects.get_for_model(BlogArticle).id, BlogArticle, articles)]
+    total_objects = pages + articles
+    if total_objects and not users:
+        raise ValueError('Pages and articles need at least one user.')
+    if comments and not total_objects:
+        raise ValueError('Comments need at least one page or article.')
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        first_user = reserve_ids(cursor, user_model, users)
+        writer = CopyWriter(cursor, user_model,
+                            ['id', 'password', 'is_superuser', 'username', 'first_name',
+                             'last_name', 'email', 'is_staff', 'is_active', 'date_joined'],
+                            chunk_size)
+        for user_id in range(first_user, first_user + users):
+            writer.write([user_id, '!', False, 'dataset-{0}'.format(user_id), '', '', '',
+                          False, True, started])
+        writer.flush()
+
+        comment_writer = CopyWriter(cursor, Comment,
+                                    ['id', 'user_id', 'created', 'content_type_id', 'object_id',
+                                     'parent_id', 'level', 'ancestors', 'path', 'text',
+                                     'children_count', 'descendant_count'], chunk_size)
+        history_writer = CopyWriter(cursor, Comment.history.model,
+                                    ['id', 'ancestors', 'text', 'history_date',
+                                     'history_user_id', 'history_type'], chunk_size)
+        summary_writer = CopyWriter(cursor, CommentSummary,
+                                    ['content_type_id', 'object_id', 'comment_count',
+                                     'root_comment_count', 'last_comment_at'], chunk_size)
+        if history and comments:
+            # Route the back-dated history straight to its monthly partitions
+            # rather than the default one.
+            create_history_partitions(
+                started - timedelta(days=REPLY_DELAY_DAYS * max_depth + 367), started)
+        next_comment = reserve_ids(cursor, Comment, comments)
+        remaining = comments
+        created_objects = 0
+        for content_type_id, model, count in objects:
+            first_object = reserve_ids(cursor, model, count)
+            object_writer = CopyWriter(cursor, model, ['id', 'user_id', 'title'], chunk_size)
+            for object_id in range(first_object, first_object + count):
+                object_writer.write([object_id, first_user + rng.randrange(users), rng.choice(titles)])
+                created_objects += 1
+                # Spread what is left evenly over the objects still to come.
+                budget = remaining // (total_objects - created_objects + 1)
+                written, roots, last = 0, 0, None
+                while written < budget:
+                    thread = generate_thread(rng, next_comment, budget - written,
+                                             max_depth, fan_out, min_replies)
+                    latest = write_thread(rng, thread, content_type_id, object_id,
+                                          first_user, users, texts, started,
+                                          comment_writer, history_writer if history else None)
+                    last = max(last or latest, latest)
+                    next_comment += len(thread)
+                    written += len(thread)
+                    roots += 1
+                if written:
+                    summary_writer.write([content_type_id, object_id, written, roots, last])
+                remaining -= written
+            object_writer.flush()
+        comment_writer.flush()
+        history_writer.flush()
+        summary_writer.flush()
+    return {
+        'users': users,
+        'pages': pages,
+        'articles': articles,
+        'comments': comment_writer.written,
+        'history': history_writer.written,
+    }
+
+
+def write_thread(rng, thread, content_type_id, object_id, first_user, users, texts,
+                 started, comment_writer, history_writer):
+    """
+    Write the comments of a thread shaped by `generate_thread`, and their
+    creation history when `history_writer` is given. Returns the time of
+    the newest comment.
+    """
+    children = [0] * len(thread)
+    descendants = [0] * len(thread)
+    ancestors = []
+    for index, (_, parent, _) in enumerate(thread):
+        chain = ancestors[parent] + [parent] if parent is not None else []
+        ancestors.append(chain)
+        if parent is not None:
+            children[parent] += 1
+            for ancestor in chain:
+                descendants[ancestor] += 1
+
+    depth = max(level for _, _, level in thread)
+    created = []
+    paths = []
+    for index, (comment_id, parent, level) in enumerate(thread):
+        if parent is None:
+            # Old enough that the deepest chain of replies still ends in the past.
+            age = REPLY_DELAY_DAYS * depth + rng.randint(0, 365)
+            at = started - timedelta(days=age, seconds=rng.randint(0, 24 * 3600))
+            path = make_path_segment(comment_id)
+        else:
+            at = created[parent] + timedelta(seconds=rng.randint(1, REPLY_DELAY_DAYS * 24 * 3600))
+            path = COMMENT_PATH_SEPARATOR.join([paths[parent], make_path_segment(comment_id)])
+        created.append(at)
+        paths.append(path)
+        user_id = first_user + rng.randrange(users)
+        ancestor_ids = [thread[a][0] for a in ancestors[index]]
+        text = rng.choice(texts)
+        comment_writer.write([comment_id, user_id, at, content_type_id, object_id,
+                              thread[parent][0] if parent is not None else None, level,
+                              ancestor_ids, path, text, children[index], descendants[index]])
+        if history_writer is not None:
+            history_writer.write([comment_id, ancestor_ids, text, at, user_id, '+'])
+    return max(created)
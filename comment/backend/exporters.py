@@ -0,0 +1,155 @@
+import os
+import re
+from contextlib import contextmanager
+from time import time
+
+from django.db import connection
+from django.db.models.base import DEFERRED
+from django.utils.xmlutils import SimplerXMLGenerator
+from rest_framework.renderers import JSONRenderer
+from rest_framework_xml.renderers import XMLRenderer
+
+from .models import Comment
+
+
+class BaseStreamWriter(object):
+    """
+    Writes a list of serialized comments to `stream` chunk by chunk,
+    producing the same document as `renderer_class` would for the whole
+    list at once.
+    """
+    renderer_class = None
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.renderer = self.renderer_class()
+
+    @property
+    def media_type(self):
+        return self.renderer.media_type
+
+    def start(self):
+        pass
+
+    def write(self, items):
+        raise NotImplementedError('Stream writer class requires .write() to be implemented')
+
+    def finish(self):
+        pass
+
+
+class JSONStreamWriter(BaseStreamWriter):
+    renderer_class = JSONRenderer
+
+    def start(self):
+        self.stream.write('[')
+        self.separator = ''
+
+    def write(self, items):
+        # The compact rendering of a list is its items joined by commas.
+        if items:
+            self.stream.write(self.separator)
+            self.stream.write(self.renderer.render(items).decode()[1:-1])
+            self.separator = ','
+
+    def finish(self):
+        self.stream.write(']')
+
+
+class XMLStreamWriter(BaseStreamWriter):
+    renderer_class = XMLRenderer
+
+    def start(self):
+        self.xml = SimplerXMLGenerator(self.stream, self.renderer.charset)
+        self.xml.startDocument()
+        self.xml.startElement(self.renderer.root_tag_name, {})
+
+    def write(self, items):
+        self.renderer._to_xml(self.xml, items)
+
+    def finish(self):
+        self.xml.endElement(self.renderer.root_tag_name)
+        self.xml.endDocument()
+
+
+def get_stream_writer_class(format_suffix='xml'):
+    if format_suffix == 'xml':
+        return XMLStreamWriter
+    elif format_suffix == 'json':
+        return JSONStreamWriter
+    raise NotImplementedError('Unsupported export format: {0}'.format(format_suffix))
+
+
+def iter_comment_chunks(queryset, chunk_size):
+    """
+    Yield lists of at most `chunk_size` comments of `queryset`, reading
+    through a server-side cursor. Must run inside a transaction so the
+    cursor is not materialized on the server as a holdable one.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchmany(chunk_size)
+        # A named cursor only has a description after the first fetch.
+        columns = [column[0] for column in cursor.description or ()]
+        positions = [columns.index(f.attname) if f.attname in columns else None
+                     for f in Comment._meta.concrete_fields]
+        while rows:
+            yield [Comment.from_db(connection.alias, columns,
+                                   [DEFERRED if p is None else row[p] for p in positions])
+                   for row in rows]
+            rows = cursor.fetchmany(chunk_size)
+
+
+@contextmanager
+def temporary_export_path(path):
+    """
+    Yield a temporary path next to `path` to write an export to, and move
+    the file to `path` once the block succeeds, so that readers never see
+    a partial file under the final name. It is removed if the block fails.
+    """
+    temp_path = path + '.tmp'
+    try:
+        yield temp_path
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.replace(temp_path, path)
+
+
+# Also matches the temporary files of exports whose worker was killed.
+EXPORT_FILENAME_RE = re.compile(r'^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}\.(xml|json|json\.gz)(\.tmp)?$')
+
+
+def sweep_export_dir(directory, max_age, max_bytes):
+    """
+    Remove export files and spooled results older than `max_age` seconds,
+    then the oldest ones until the rest fit in `max_bytes`. Only files
+    named like `<task id>.<format>` are touched, as the directory may be
+    shared.
+    """
+    files = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if EXPORT_FILENAME_RE.match(name) and os.path.isfile(path):
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort(reverse=True)
+
+    removed = []
+    expires = time() - max_age
+    total = 0
+    for mtime, size, path in files:
+        if mtime < expires or total + size > max_bytes:
+            removed.append(path)
+        else:
+            total += size
+    for path in removed:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return len(removed)
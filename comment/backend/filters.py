@@ -1,8 +1,15 @@
 import django_filters
+from django.db import connection
 from rest_framework import filters
 
+from .constants import COMMENT_PATH_SEPARATOR
 from .models import Comment
 
+# Query parameters that select comments. A listing or an export is fully
+# described by these, so tasks receive them instead of compiled SQL.
+COMMENT_QUERY_SPEC_KEYS = ('level', 'user', 'created_gte', 'created_lte',
+                           'object_id', 'parent', 'ordering')
+
 
 class CommentFilter(filters.FilterSet):
     created_gte = django_filters.DateTimeFilter(name='created',
@@ -25,3 +32,84 @@ class CommentHistoryFilter(filters.FilterSet):
         model = Comment.history.model
         fields = ('id', 'from_date', 'to_date', 'history_type',
                   'history_user_id')
+
+
+def build_comment_query_spec(query_params):
+    return {key: query_params[key] for key in COMMENT_QUERY_SPEC_KEYS
+            if key in query_params}
+
+
+def filter_comment_tree(queryset, params):
+    if 'level' not in params:
+        if 'parent' in params:
+            try:
+                parent = int(params['parent'])
+            except ValueError:
+                return queryset.none()
+            parent_path = Comment.objects.filter(id=parent) \
+                .values_list('path', flat=True).first()
+            if parent_path is None:
+                return queryset.none()
+            if parent_path:
+                # Descendants share the parent's path prefix, which is a
+                # range scan on the path pattern index.
+                queryset = queryset.filter(path__startswith=parent_path + COMMENT_PATH_SEPARATOR)
+            else:
+                # Typed integer[] containment compiles to `ancestors @> ARRAY[..]`,
+                # which the GIN index on ancestors serves.
+                queryset = queryset.filter(ancestors__contains=[parent])
+        elif 'object_id' in params:
+            queryset = queryset.filter(object_id=params['object_id'])
+        if params.get('ordering') == 'path':
+            queryset = queryset.order_by('path')
+    return queryset
+
+
+# Up to a number of replies to each of a list of comments, in path order,
+# grouped in the order of the list. Served per comment by the parent_id
+# index, so long reply lists are cut in the database.
+TREE_REPLIES_SQL = '''
+SELECT {columns}
+FROM unnest(%s::integer[]) WITH ORDINALITY AS p (id, position)
+CROSS JOIN LATERAL (
+    SELECT * FROM {table} WHERE parent_id = p.id ORDER BY path, id LIMIT %s
+) AS c
+ORDER BY p.position, c.path, c.id
+'''
+
+
+def select_comment_tree(params, base_level, max_depth, max_children, fields):
+    """
+    Read the comment tree selected by `params` one level at a time, at
+    most `max_children` comments at the top and replies per comment, down
+    to `max_depth` levels below `base_level`, so that huge threads cost
+    no more than what is returned. Returns the rows of `fields`, parents
+    ahead of their replies, and the number of top comments left out.
+    """
+    top = filter_comment_tree(Comment.objects.all(), params).filter(level=base_level)
+    rows = list(top.order_by('path', 'id').values_list(*fields)[:max_children + 1])
+    more_replies = 0
+    if len(rows) > max_children:
+        rows = rows[:max_children]
+        more_replies = top.count() - max_children
+    id_index, children_index = fields.index('id'), fields.index('children_count')
+    sql = TREE_REPLIES_SQL.format(
+        columns=', '.join('c.' + connection.ops.quote_name(field) for field in fields),
+        table=connection.ops.quote_name(Comment._meta.db_table))
+    level_rows = rows
+    depth = 0
+    while max_depth is None or depth < max_depth:
+        parents = [row[id_index] for row in level_rows if row[children_index]]
+        if not parents:
+            break
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [parents, max_children])
+            level_rows = cursor.fetchall()
+        rows.extend(level_rows)
+        depth += 1
+    return rows, more_replies
+
+
+def get_comment_queryset(spec):
+    queryset = filter_comment_tree(Comment.objects.all(), spec)
+    return CommentFilter(spec, queryset=queryset).qs
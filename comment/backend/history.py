@@ -0,0 +1,198 @@
+import json
+import logging
+from datetime import datetime
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, models, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from redis.exceptions import LockError, RedisError
+from simple_history.models import HistoricalRecords
+
+from .websockets import get_redis
+
+HISTORY_QUEUE_KEY = 'comment-history'
+HISTORY_PROCESSING_KEY = 'comment-history-processing'
+HISTORY_LOCK_KEY = 'comment-history-lock'
+HISTORY_FAILED_KEY = 'comment-history-failed'
+
+# Errors of single records, as opposed to the database being unavailable.
+RECORD_ERRORS = (DataError, IntegrityError, ValidationError, FieldDoesNotExist, ValueError, TypeError)
+
+logger = logging.getLogger(__name__)
+
+# Moves a batch from the queue to the processing list in one step, so a
+# record is always in Redis until the rows written from it are committed.
+# Batches are unpacked onto the Lua stack, which keeps them below 8000.
+TAKE_HISTORY = """
+local records = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #records > 0 then
+    redis.call('ltrim', KEYS[1], #records, -1)
+    redis.call('rpush', KEYS[2], unpack(records))
+end
+return records
+"""
+
+
+class CommentHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords that, with COMMENT_DEFERRED_HISTORY, keeps the
+    change records of a transaction in memory and queues them once it
+    commits. `write_deferred_history` writes them in batches.
+
+    Historical rows also get `history_delta`, set when compaction stored
+    the text as a delta of an earlier revision (see backend.revisions).
+    """
+
+    def get_extra_fields(self, model, fields):
+        extra = super(CommentHistoricalRecords, self).get_extra_fields(model, fields)
+        extra['history_delta'] = models.TextField(null=True, editable=False)
+        return extra
+
+    def create_historical_record(self, instance, history_type):
+        if not settings.COMMENT_DEFERRED_HISTORY:
+            return super(CommentHistoricalRecords, self).create_historical_record(instance, history_type)
+        history_user = self.get_history_user(instance)
+        record = {field.attname: getattr(instance, field.attname)
+                  for field in self.fields_included(instance)}
+        record.update(history_date=getattr(instance, '_history_date', now()),
+                      history_type=history_type,
+                      history_user_id=history_user.pk if history_user is not None else None,
+                      history_change_reason=getattr(instance, 'changeReason', None))
+        history_model = getattr(instance, self.manager_name).model
+        transaction.on_commit(lambda: enqueue_history(history_model, [record]))
+
+
+class HistoryJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, which would reorder
+    # close revisions and break the dedupe of recovered batches.
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super(HistoryJSONEncoder, self).default(o)
+
+
+def encode_history(record):
+    return json.dumps(record, cls=HistoryJSONEncoder)
+
+
+def decode_history(history_model, record):
+    values = json.loads(record.decode())
+    return history_model(**{name: history_model._meta.get_field(name).to_python(value)
+                            for name, value in values.items()})
+
+
+def enqueue_history(history_model, records):
+    """
+    Queue committed change records. When Redis cannot take them they are
+    written right away instead, as history must not be lost.
+    """
+    try:
+        get_redis().rpush(HISTORY_QUEUE_KEY, *[encode_history(record) for record in records])
+    except RedisError as e:
+        logger.warning('Could not queue %d history records, writing them now: %s', len(records), e)
+        history_model.objects.bulk_create([history_model(**record) for record in records])
+
+
+def write_history(history_model, records, recovered=False):
+    """
+    Insert the history rows of encoded `records` with multi-row INSERTs.
+    Records `recovered` from an interrupted run may have been written
+    already, and are skipped when a row with the same comment, date and
+    type exists. Users deleted since a record was queued are left out of
+    it, as deleting them would have done to a written row.
+    """
+    rows = [decode_history(history_model, record) for record in records]
+    user_ids = {row.history_user_id for row in rows if row.history_user_id is not None}
+    if user_ids:
+        existing = set(get_user_model().objects.filter(id__in=user_ids).values_list('id', flat=True))
+        for row in rows:
+            if row.history_user_id not in existing:
+                row.history_user_id = None
+    if recovered and rows:
+        written = set(history_model.objects.filter(
+            id__in={row.id for row in rows},
+            history_date__in={row.history_date for row in rows},
+        ).values_list('id', 'history_date', 'history_type'))
+        rows = [row for row in rows if (row.id, row.history_date, row.history_type) not in written]
+    history_model.objects.bulk_create(rows, batch_size=settings.COMMENT_HISTORY_BATCH_SIZE)
+    return len(rows)
+
+
+def write_history_records(connection, history_model, records, recovered):
+    written = 0
+    for record in records:
+        try:
+            with transaction.atomic():
+                written += write_history(history_model, [record], recovered)
+        except RECORD_ERRORS:
+            logger.exception('Could not write history record %s, moved it to %s.', record, HISTORY_FAILED_KEY)
+            connection.rpush(HISTORY_FAILED_KEY, record)
+    return written
+
+
+def drain_history(history_model, batch_size):
+    """
+    Write queued history records in batches until the queue is empty or
+    half of COMMENT_HISTORY_LOCK_TIMEOUT has passed. Only one worker drains
+    at a time; records left in the processing list by a worker that died
+    are written first. A batch that cannot be written is retried a record
+    at a time, and records that still fail are moved to a dead-letter list
+    so that they do not hold up the queue. Returns the number of rows
+    written, or None when another worker holds the lock.
+    """
+    connection = get_redis()
+    take = connection.register_script(TAKE_HISTORY)
+    timeout = settings.COMMENT_HISTORY_LOCK_TIMEOUT
+    lock = connection.lock(HISTORY_LOCK_KEY, timeout=timeout)
+    if not lock.acquire(blocking=False):
+        return None
+    written = 0
+    started = monotonic()
+    try:
+        records = connection.lrange(HISTORY_PROCESSING_KEY, 0, -1)
+        recovered = bool(records)
+        if not recovered:
+            records = take(keys=[HISTORY_QUEUE_KEY, HISTORY_PROCESSING_KEY], args=[batch_size])
+        while records:
+            try:
+                with transaction.atomic():
+                    written += write_history(history_model, records, recovered)
+            except RECORD_ERRORS as e:
+                logger.warning('Could not write a batch of %d history records, retrying them one by one: %s',
+                               len(records), e)
+                written += write_history_records(connection, history_model, records, recovered)
+            connection.delete(HISTORY_PROCESSING_KEY)
+            if monotonic() - started > timeout / 2:
+                break
+            records = take(keys=[HISTORY_QUEUE_KEY, HISTORY_PROCESSING_KEY], args=[batch_size])
+            recovered = False
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning('History lock expired while draining; raise COMMENT_HISTORY_LOCK_TIMEOUT.')
+    return written
+
+
+def get_history_backlog():
+    """
+    Return the number of history records waiting to be written and the age
+    in seconds of the oldest one.
+    """
+    pipeline = get_redis().pipeline(transaction=False)
+    pipeline.llen(HISTORY_PROCESSING_KEY)
+    pipeline.llen(HISTORY_QUEUE_KEY)
+    pipeline.lindex(HISTORY_PROCESSING_KEY, 0)
+    pipeline.lindex(HISTORY_QUEUE_KEY, 0)
+    processing, queued, first_processing, first_queued = pipeline.execute()
+    oldest = first_processing or first_queued
+    lag = 0.0
+    if oldest is not None:
+        history_date = parse_datetime(json.loads(oldest.decode())['history_date'])
+        lag = max((now() - history_date).total_seconds(), 0.0)
+    return processing + queued, lag
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Fill Comment.path for comments created before the path column existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of ids updated per statement.')
+
+    def handle(self, *args, **options):
+        updated = Comment.objects.backfill_paths(batch_size=options['batch_size'])
+        self.stdout.write('Updated {0} comments.'.format(updated))
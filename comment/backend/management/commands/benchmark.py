@@ -0,0 +1,55 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run comment service benchmarks and print the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Benchmarks to run: {0}. Defaults to all.'.format(', '.join(BENCHMARKS)))
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Dataset size for benchmarks that build their own data.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of timed runs per measurement.')
+        parser.add_argument('--shape', choices=('shallow', 'deep'), default='shallow',
+                            help='Comment tree shape for benchmarks that seed comments.')
+        parser.add_argument('--output', help='Also write the results to this file.')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError('Unknown benchmarks: {0}'.format(', '.join(sorted(unknown))))
+
+        # Enough context to compare result files across commits and machines.
+        results = {'meta': {
+            'commit': self.get_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'rows': options['rows'],
+            'repeat': options['repeat'],
+            'shape': options['shape'],
+        }}
+        for name in names:
+            self.stderr.write('Running {0}...'.format(name))
+            results[name] = BENCHMARKS[name](**options)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def get_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
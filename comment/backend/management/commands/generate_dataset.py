@@ -0,0 +1,43 @@
+import json
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.datasets import generate_dataset
+
+
+class Command(BaseCommand):
+    help = ('Load a synthetic dataset of users, pages, articles and comment trees '
+            'with COPY. Run it against an otherwise idle database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--pages', type=int, default=1000)
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=100000,
+                            help='Total number of comments, spread over pages and articles.')
+        parser.add_argument('--max-depth', type=int, default=10,
+                            help='Deepest reply level.')
+        parser.add_argument('--fan-out', type=float, default=2.0,
+                            help='Mean number of replies per comment.')
+        parser.add_argument('--min-replies', type=int, default=0,
+                            help='Replies every comment above --max-depth gets at least; '
+                                 '1 builds reply chains --max-depth long.')
+        parser.add_argument('--no-history', action='store_false', dest='history',
+                            help='Do not write creation history rows.')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible datasets.')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Rows per COPY statement.')
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        try:
+            result = generate_dataset(options['users'], options['pages'], options['articles'],
+                                      options['comments'], max_depth=options['max_depth'],
+                                      fan_out=options['fan_out'],
+                                      min_replies=options['min_replies'], history=options['history'],
+                                      seed=options['seed'], chunk_size=options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        result['seconds'] = round(perf_counter() - started, 3)
+        self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
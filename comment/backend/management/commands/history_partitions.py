@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import now, utc
+
+from backend.partitions import create_history_partitions, drop_history_partitions, \
+    get_history_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = ('Create the monthly partitions of the comment history table ahead of time, '
+            'and detach or drop the ones past retention.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Also create partitions from the month of this date '
+                                            '(YYYY-MM-DD), e.g. before loading old history.')
+        parser.add_argument('--retain-months', type=int,
+                            help='Remove the partitions of history older than this many months.')
+        parser.add_argument('--detach-only', action='store_true',
+                            help='Keep removed partitions as standalone tables.')
+        parser.add_argument('--list', action='store_true', help='List the partitions.')
+
+    def handle(self, *args, **options):
+        start = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('--since takes a date as YYYY-MM-DD.')
+            start = datetime(since.year, since.month, 1, tzinfo=utc)
+        for name in create_history_partitions(start):
+            self.stdout.write('Created {0}.'.format(name))
+        if options['retain_months'] is not None:
+            before = month_start(now(), -options['retain_months'])
+            for name in drop_history_partitions(before, options['detach_only']):
+                self.stdout.write('{0} {1}.'.format('Detached' if options['detach_only'] else 'Dropped', name))
+        if options['list']:
+            for month, name in get_history_partitions():
+                self.stdout.write('{0:%Y-%m} {1}'.format(month, name))
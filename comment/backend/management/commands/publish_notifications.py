@@ -0,0 +1,60 @@
+import logging
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from redis.exceptions import RedisError
+
+from backend.websockets import NOTIFICATION_QUEUE_KEY, decode_notification, get_redis, \
+    publish_notifications, take_notifications
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after a Redis error, doubled on every further one.
+RETRY_DELAY = 1
+RETRY_DELAY_MAX = 30
+
+
+class Command(BaseCommand):
+    help = ('Publish queued comment notifications to websocket subscribers, coalescing '
+            'each burst into one message per thread.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.COMMENT_NOTIFICATION_INTERVAL,
+                            help='Milliseconds events are collected for after the first one.')
+        parser.add_argument('--batch', type=int, default=settings.COMMENT_NOTIFICATION_BATCH,
+                            help='Most events published at once.')
+        parser.add_argument('--once', action='store_true',
+                            help='Publish what is queued and exit.')
+
+    def handle(self, *args, **options):
+        connection = get_redis()
+        delay = RETRY_DELAY
+        while True:
+            if options['once']:
+                self.publish(connection, take_notifications(connection, options['batch']), options)
+                return
+            try:
+                # Block until there is something to publish, then let the
+                # burst it belongs to build up.
+                first = connection.blpop(NOTIFICATION_QUEUE_KEY, timeout=5)
+                if first is not None:
+                    sleep(options['interval'] / 1000.0)
+                    events = take_notifications(connection, options['batch'] - 1)
+                    events.insert(0, decode_notification(first[1]))
+                    self.publish(connection, events, options)
+            except RedisError:
+                # Events already taken are lost, like ones that could not be queued.
+                logger.exception('Could not publish notifications, retrying in %s seconds', delay)
+                sleep(delay)
+                delay = min(delay * 2, RETRY_DELAY_MAX)
+                continue
+            delay = RETRY_DELAY
+            # Long-running, like a request loop: drop stale database connections.
+            close_old_connections()
+
+    def publish(self, connection, events, options):
+        published = publish_notifications(connection, events) if events else 0
+        if options['verbosity'] > 1:
+            self.stdout.write('Published {0} messages for {1} events.'.format(published, len(events)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Recompute Comment.children_count and descendant_count from the comment tree.'
+
+    def handle(self, *args, **options):
+        repaired = Comment.objects.repair_reply_counts()
+        self.stdout.write('Repaired {0} comments.'.format(repaired))
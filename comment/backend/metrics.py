@@ -0,0 +1,476 @@
+import io
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter, time
+
+from celery.signals import after_task_publish, before_task_publish, task_success
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.utils import CursorWrapper
+from redis.exceptions import RedisError
+from rest_framework.serializers import BaseSerializer
+
+from .websockets import get_redis
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+class RequestStats(object):
+    __slots__ = ('queries', 'db', 'serializer', 'celery')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.celery = 0.0
+
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def finish_request():
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+class Histogram(object):
+    """
+    Prometheus histogram with a `view` label. Observations go to a single
+    bucket of a per-process buffer, which flush() adds to a Redis hash
+    shared by every worker; the cumulative counts are only built when
+    rendering that hash.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    @property
+    def key(self):
+        return METRICS_KEY.format(self.name)
+
+    def observe(self, view, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def flush(self, pipeline):
+        with self.lock:
+            series, self.series = self.series, {}
+        for view, (counts, total) in series.items():
+            for index, count in enumerate(counts):
+                if count:
+                    pipeline.hincrby(self.key, '{0}:{1}'.format(view, index), count)
+            pipeline.hincrbyfloat(self.key, '{0}:sum'.format(view), total)
+
+    def render(self, values):
+        """
+        Render the shared hash `values`, as returned by HGETALL.
+        """
+        series = {}
+        for field, value in values.items():
+            view, _, part = field.decode().rpartition(':')
+            counts = series.setdefault(view, [[0] * (len(self.buckets) + 1), 0.0])
+            if part == 'sum':
+                counts[1] = float(value)
+            else:
+                counts[0][int(part)] = int(value)
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text),
+                 '# TYPE {0} histogram'.format(self.name)]
+        for view, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float('inf')], counts):
+                cumulative += count
+                lines.append('{0}_bucket{{view="{1}",le="{2}"}} {3}'.format(
+                    self.name, view, '+Inf' if bound == float('inf') else bound, cumulative))
+            lines.append('{0}_sum{{view="{1}"}} {2}'.format(self.name, view, total))
+            lines.append('{0}_count{{view="{1}"}} {2}'.format(self.name, view, cumulative))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+
+
+class Counter(object):
+    """
+    Prometheus counter with a single label, buffered per process and
+    flushed to a shared Redis hash like Histogram.
+    """
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    @property
+    def key(self):
+        return METRICS_KEY.format(self.name)
+
+    def inc(self, value, amount=1):
+        with self.lock:
+            self.values[value] = self.values.get(value, 0) + amount
+
+    def flush(self, pipeline):
+        with self.lock:
+            values, self.values = self.values, {}
+        for value, count in values.items():
+            pipeline.hincrby(self.key, value, count)
+
+    def render(self, values):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text),
+                 '# TYPE {0} counter'.format(self.name)]
+        for value, count in sorted(values.items()):
+            lines.append('{0}{{{1}="{2}"}} {3}'.format(self.name, self.label, value.decode(), int(count)))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+METRICS_KEY = 'comment-metrics-{0}'
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+HISTOGRAMS = OrderedDict((h.name, h) for h in (
+    Histogram('comment_request_duration_seconds', 'Time spent handling the request.',
+              SECONDS_BUCKETS),
+    Histogram('comment_request_db_queries', 'SQL queries issued per request.',
+              [1, 2, 3, 5, 10, 20, 50, 100, 250]),
+    Histogram('comment_request_db_duration_seconds', 'Time spent in SQL queries per request.',
+              SECONDS_BUCKETS),
+    Histogram('comment_request_serializer_duration_seconds',
+              'Time spent rendering serializer data per request.', SECONDS_BUCKETS),
+    Histogram('comment_request_celery_dispatch_duration_seconds',
+              'Time spent publishing Celery tasks per request.', SECONDS_BUCKETS),
+))
+
+
+COUNTERS = OrderedDict((c.name, c) for c in (
+    Counter('comment_thread_cache_lookups_total',
+            'Comment thread cache lookups by result: local_hit, hit or miss.', 'result'),
+))
+
+
+def observe_request(view, duration, stats):
+    HISTOGRAMS['comment_request_duration_seconds'].observe(view, duration)
+    HISTOGRAMS['comment_request_db_queries'].observe(view, stats.queries)
+    HISTOGRAMS['comment_request_db_duration_seconds'].observe(view, stats.db)
+    HISTOGRAMS['comment_request_serializer_duration_seconds'].observe(view, stats.serializer)
+    HISTOGRAMS['comment_request_celery_dispatch_duration_seconds'].observe(view, stats.celery)
+
+
+def flush_metrics():
+    """
+    Add what this process observed since the last flush to the shared
+    hashes, in one round trip. Failures are only logged and drop the
+    observations, as metrics must not fail the request behind them.
+    """
+    pipeline = get_redis().pipeline(transaction=False)
+    for metric in list(HISTOGRAMS.values()) + list(COUNTERS.values()):
+        metric.flush(pipeline)
+    if not len(pipeline):
+        return
+    try:
+        pipeline.execute()
+    except RedisError:
+        logger.warning('Could not flush request metrics', exc_info=True)
+
+
+def render_metrics(gauges=()):
+    """
+    Render the histograms and counters summed over every process,
+    followed by `gauges`, `(name, help_text, value)` triples read at
+    scrape time.
+    """
+    flush_metrics()
+    metrics = list(HISTOGRAMS.values()) + list(COUNTERS.values())
+    pipeline = get_redis().pipeline(transaction=False)
+    for metric in metrics:
+        pipeline.hgetall(metric.key)
+    lines = []
+    for metric, values in zip(metrics, pipeline.execute()):
+        lines.extend(metric.render(values))
+    for name, help_text, value in gauges:
+        lines.extend(['# HELP {0} {1}'.format(name, help_text),
+                      '# TYPE {0} gauge'.format(name),
+                      '{0} {1}'.format(name, value)])
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(duration, stats):
+    return ', '.join([
+        'db;dur={0:.2f};desc="{1} queries"'.format(stats.db * 1000, stats.queries),
+        'serializer;dur={0:.2f}'.format(stats.serializer * 1000),
+        'celery;dur={0:.2f}'.format(stats.celery * 1000),
+        'total;dur={0:.2f}'.format(duration * 1000),
+    ])
+
+
+def _timed_query(execute):
+    @wraps(execute)
+    def wrapper(self, *args, **kwargs):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return execute(self, *args, **kwargs)
+        started = perf_counter()
+        try:
+            return execute(self, *args, **kwargs)
+        finally:
+            stats.queries += 1
+            stats.db += perf_counter() - started
+
+    return wrapper
+
+
+def _timed_serializer_data(data):
+    @wraps(data)
+    def wrapper(self):
+        stats = getattr(_local, 'stats', None)
+        if stats is None or hasattr(self, '_data'):
+            return data(self)
+        started = perf_counter()
+        try:
+            return data(self)
+        finally:
+            stats.serializer += perf_counter() - started
+
+    return wrapper
+
+
+def _publish_started(**kwargs):
+    _local.publish_started = perf_counter()
+
+
+def _publish_finished(**kwargs):
+    stats = getattr(_local, 'stats', None)
+    started = getattr(_local, 'publish_started', None)
+    if stats is not None and started is not None:
+        stats.celery += perf_counter() - started
+    _local.publish_started = None
+
+
+def _stamp_published_at(headers=None, **kwargs):
+    # Protocol 2 message headers end up as attributes of the task request.
+    if headers is not None:
+        headers.setdefault('comment_published_at', time())
+
+
+before_task_publish.connect(_stamp_published_at, weak=False)
+
+
+def install():
+    """
+    Hook query execution, serializer rendering and Celery publishing so
+    they are accounted to the request being measured on this thread. The
+    hooks only read a thread-local when no request is being measured.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        CursorWrapper.execute = _timed_query(CursorWrapper.execute)
+        CursorWrapper.executemany = _timed_query(CursorWrapper.executemany)
+        BaseSerializer.data = property(_timed_serializer_data(BaseSerializer.data.fget))
+        before_task_publish.connect(_publish_started, weak=False)
+        after_task_publish.connect(_publish_finished, weak=False)
+        _installed = True
+
+
+class MetricsViewMixin(object):
+    """
+    Names the request after the viewset action in the metrics, e.g.
+    `CommentViewSet.list`, instead of the URL name.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        request._request.metrics_view = '{0}.{1}'.format(
+            type(self).__name__, getattr(self, 'action', None) or request.method.lower())
+        super(MetricsViewMixin, self).initial(request, *args, **kwargs)
+
+
+# Phases are accumulated in seconds and reported in milliseconds; sizes are
+# plain counts (rows, characters written).
+TASK_STAT_PHASES = ('queue_wait', 'sql', 'serialization', 'rendering', 'file_write',
+                    'result_store')
+TASK_STAT_SIZES = ('rows', 'result_size')
+TASK_STAT_NAMES = ('get_comments', 'create_import_file')
+TASK_STATS_KEY = 'comment-task-stats-{0}-{1}-{2}'
+TASK_TIMINGS_KEY = 'comment-task-timings-{0}'
+TASK_TIMINGS_TTL = 60 * 60
+
+
+class TaskTimer(object):
+    """
+    Time spent in each phase of one task run, and the size of its result.
+    """
+
+    def __init__(self, name, task_id=None):
+        self.name = name
+        self.task_id = task_id
+        self.phases = OrderedDict()
+        self.sizes = OrderedDict()
+        self.finished = None
+
+    @classmethod
+    def start(cls, task, name):
+        """
+        Start timing `task`, counting the time since it was published as
+        its queue wait. Eager tasks are never published and have none.
+        """
+        timer = cls(name, task.request.id)
+        published = getattr(task.request, 'comment_published_at', None)
+        if published is not None:
+            timer.add('queue_wait', max(0.0, time() - published))
+        task.request.comment_task_timer = timer
+        return timer
+
+    @contextmanager
+    def phase(self, name):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self):
+        """
+        Return the timings, and when COMMENT_METRICS_ENABLED add them to the
+        task stats and keep them by task id for results that have no room
+        for them. Both go to the default cache, shared by every process.
+        """
+        timings = self.as_dict()
+        if settings.COMMENT_METRICS_ENABLED:
+            record_task_stats(self.name, self.phases, self.sizes)
+            if self.task_id is not None:
+                cache.set(TASK_TIMINGS_KEY.format(self.task_id), timings, TASK_TIMINGS_TTL)
+        # Taken last, so that result_store does not count this bookkeeping.
+        self.finished = perf_counter()
+        return timings
+
+    def as_dict(self):
+        timings = OrderedDict((name, round(self.phases[name] * 1000, 3))
+                              for name in TASK_STAT_PHASES if name in self.phases)
+        timings.update((name, self.sizes[name]) for name in TASK_STAT_SIZES if name in self.sizes)
+        return timings
+
+
+class TimedStream(io.TextIOBase):
+    """
+    Text stream accounting the time spent writing to `stream` as the
+    `file_write` phase of `timer` rather than the `rendering` phase the
+    writes are made from, and the characters written as its `result_size`.
+    """
+
+    def __init__(self, stream, timer):
+        super(TimedStream, self).__init__()
+        self.stream = stream
+        self.timer = timer
+        timer.sizes.setdefault('result_size', 0)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        started = perf_counter()
+        try:
+            return self.stream.write(data)
+        finally:
+            elapsed = perf_counter() - started
+            self.timer.add('file_write', elapsed)
+            self.timer.add('rendering', -elapsed)
+            self.timer.sizes['result_size'] += len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def record_task_stats(name, phases=None, sizes=None):
+    """
+    Add a task run to the totals kept in the default cache, which live in
+    Redis and are shared by every process.
+    """
+    values = dict(sizes or {})
+    for phase, seconds in (phases or {}).items():
+        values[phase] = int(round(seconds * 1000000))
+    for field, value in values.items():
+        _incr(TASK_STATS_KEY.format(name, field, 'count'), 1)
+        _incr(TASK_STATS_KEY.format(name, field, 'total'), value)
+
+
+def _task_stats_keys():
+    return [TASK_STATS_KEY.format(name, field, part)
+            for name in TASK_STAT_NAMES
+            for field in TASK_STAT_PHASES + TASK_STAT_SIZES
+            for part in ('count', 'total')]
+
+
+def get_task_stats():
+    values = cache.get_many(_task_stats_keys())
+    stats = OrderedDict()
+    for name in TASK_STAT_NAMES:
+        fields = stats[name] = OrderedDict()
+        for field in TASK_STAT_PHASES + TASK_STAT_SIZES:
+            count = values.get(TASK_STATS_KEY.format(name, field, 'count'))
+            if not count:
+                continue
+            total = values.get(TASK_STATS_KEY.format(name, field, 'total'), 0)
+            if field in TASK_STAT_PHASES:
+                total /= 1000.0
+            fields[field] = OrderedDict((
+                ('count', count),
+                ('total', round(total, 3)),
+                ('mean', round(total / count, 3)),
+            ))
+    return stats
+
+
+def clear_task_stats():
+    cache.delete_many(_task_stats_keys())
+
+
+def _record_result_store(sender=None, **kwargs):
+    # Sent after the result backend stored the return value of the task.
+    timer = getattr(sender.request, 'comment_task_timer', None)
+    if timer is not None and timer.finished is not None and settings.COMMENT_METRICS_ENABLED:
+        record_task_stats(timer.name, {'result_store': perf_counter() - timer.finished})
+
+
+task_success.connect(_record_result_store, weak=False)
+
+
+def get_task_timings(task_id):
+    return cache.get(TASK_TIMINGS_KEY.format(task_id))
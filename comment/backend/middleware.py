@@ -0,0 +1,38 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import finish_request, flush_metrics, install, observe_request, server_timing, \
+    start_request
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records query count, database, serializer and Celery dispatch time of
+    every request into the /metrics histograms, shared through Redis, and
+    reports them in a Server-Timing header. Enabled by COMMENT_METRICS_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.COMMENT_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = start_request()
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request()
+        duration = perf_counter() - started
+        view = getattr(request, 'metrics_view', None)
+        if view is None:
+            match = getattr(request, 'resolver_match', None)
+            view = match.url_name if match and match.url_name else 'unmatched'
+        observe_request(view, duration, stats)
+        flush_metrics()
+        response['Server-Timing'] = server_timing(duration, stats)
+        return response
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 20:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_auto_20170826_1242'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='level',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['level', '-created', '-id'], name='backend_comment_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 20:10
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_comment_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='ancestors',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), size=None),
+        ),
+        migrations.AlterField(
+            model_name='historicalcomment',
+            name='ancestors',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), size=None),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ancestors'], name='backend_comment_ancestors_gin'),
+        ),
+        # HistoricalComment is generated by simple_history and cannot declare
+        # Meta.indexes, so its GIN index is managed here directly.
+        migrations.RunSQL(
+            'CREATE INDEX backend_historicalcomment_ancestors_gin '
+            'ON backend_historicalcomment USING gin (ancestors)',
+            'DROP INDEX backend_historicalcomment_ancestors_gin',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 20:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_ancestors_gin_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False, verbose_name='Comment Tree Path'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 20:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_comment_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='children_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Direct Replies Count'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='descendant_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='All Replies Count'),
+        ),
+        # Existing comments start from their real counts; both columns are
+        # maintained by Comment.save/delete from here on.
+        migrations.RunSQL(
+            'UPDATE backend_comment c SET descendant_count = d.n '
+            'FROM (SELECT unnest(ancestors) AS id, count(*) AS n '
+            '      FROM backend_comment GROUP BY 1) d '
+            'WHERE c.id = d.id',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'UPDATE backend_comment c SET children_count = d.n '
+            'FROM (SELECT parent_id AS id, count(*) AS n FROM backend_comment '
+            '      WHERE parent_id IS NOT NULL GROUP BY 1) d '
+            'WHERE c.id = d.id',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 20:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('backend', '0006_comment_reply_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['content_type', 'object_id', '-created'], name='backend_comment_object_idx'),
+        ),
+        migrations.CreateModel(
+            name='CommentSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('comment_count', models.PositiveIntegerField(default=0, verbose_name='Comments Count')),
+                ('root_comment_count', models.PositiveIntegerField(default=0, verbose_name='Root Comments Count')),
+                ('last_comment_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Comment At')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='commentsummary',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunSQL(
+            'INSERT INTO backend_commentsummary (content_type_id, object_id, comment_count,'
+            '                                    root_comment_count, last_comment_at) '
+            'SELECT content_type_id, object_id, count(*), count(*) FILTER (WHERE level = 0),'
+            '       max(created) '
+            'FROM backend_comment GROUP BY content_type_id, object_id',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The history table becomes a range-partitioned table with one partition per
+# month of history_date and a default partition for rows outside of them.
+# Partitions for the months of existing rows and the next three months are
+# created here; backend.partitions keeps them ahead of time afterwards.
+#
+# Postgres requires the partition key in the primary key, which becomes
+# (history_id, history_date); Django still addresses rows by history_id,
+# which stays unique through its sequence. Index and constraint names are
+# the ones Django generated for the original table.
+PARTITION_HISTORY = """
+ALTER TABLE backend_historicalcomment RENAME TO backend_historicalcomment_unpartitioned;
+ALTER TABLE backend_historicalcomment_unpartitioned DROP CONSTRAINT backend_historicalcomment_pkey;
+DROP INDEX backend_historicalcomment_id_2d79829d;
+DROP INDEX backend_historicalcomment_history_user_id_56c9c06a;
+DROP INDEX backend_historicalcomment_ancestors_gin;
+
+CREATE TABLE backend_historicalcomment
+    (LIKE backend_historicalcomment_unpartitioned INCLUDING DEFAULTS)
+    PARTITION BY RANGE (history_date);
+ALTER SEQUENCE backend_historicalcomment_history_id_seq OWNED BY backend_historicalcomment.history_id;
+ALTER TABLE backend_historicalcomment
+    ADD CONSTRAINT backend_historicalcomment_pkey PRIMARY KEY (history_id, history_date);
+ALTER TABLE backend_historicalcomment
+    ADD CONSTRAINT backend_historicalco_history_user_id_56c9c06a_fk_auth_user
+    FOREIGN KEY (history_user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX backend_historicalcomment_id_2d79829d ON backend_historicalcomment (id);
+CREATE INDEX backend_historicalcomment_history_user_id_56c9c06a
+    ON backend_historicalcomment (history_user_id);
+CREATE INDEX backend_historicalcomment_ancestors_gin ON backend_historicalcomment USING gin (ancestors);
+CREATE INDEX backend_historicalcomment_history_date_brin
+    ON backend_historicalcomment USING brin (history_date);
+
+CREATE TABLE backend_historicalcomment_default PARTITION OF backend_historicalcomment DEFAULT;
+
+DO $$
+DECLARE
+    month timestamp;
+BEGIN
+    SELECT date_trunc('month', coalesce(min(history_date), now()) AT TIME ZONE 'UTC')
+        INTO month FROM backend_historicalcomment_unpartitioned;
+    WHILE month <= date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF backend_historicalcomment FOR VALUES FROM (%L) TO (%L)',
+            'backend_historicalcomment_' || to_char(month, 'YYYYMM'),
+            month::text || '+00', (month + interval '1 month')::text || '+00');
+        month := month + interval '1 month';
+    END LOOP;
+END
+$$;
+
+INSERT INTO backend_historicalcomment SELECT * FROM backend_historicalcomment_unpartitioned;
+DROP TABLE backend_historicalcomment_unpartitioned;
+"""
+
+UNPARTITION_HISTORY = """
+CREATE TABLE backend_historicalcomment_unpartitioned
+    (LIKE backend_historicalcomment INCLUDING DEFAULTS);
+INSERT INTO backend_historicalcomment_unpartitioned SELECT * FROM backend_historicalcomment;
+ALTER SEQUENCE backend_historicalcomment_history_id_seq
+    OWNED BY backend_historicalcomment_unpartitioned.history_id;
+DROP TABLE backend_historicalcomment;
+ALTER TABLE backend_historicalcomment_unpartitioned RENAME TO backend_historicalcomment;
+ALTER TABLE backend_historicalcomment
+    ADD CONSTRAINT backend_historicalcomment_pkey PRIMARY KEY (history_id);
+ALTER TABLE backend_historicalcomment
+    ADD CONSTRAINT backend_historicalco_history_user_id_56c9c06a_fk_auth_user
+    FOREIGN KEY (history_user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX backend_historicalcomment_id_2d79829d ON backend_historicalcomment (id);
+CREATE INDEX backend_historicalcomment_history_user_id_56c9c06a
+    ON backend_historicalcomment (history_user_id);
+CREATE INDEX backend_historicalcomment_ancestors_gin ON backend_historicalcomment USING gin (ancestors);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_comment_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_HISTORY, UNPARTITION_HISTORY),
+    ]
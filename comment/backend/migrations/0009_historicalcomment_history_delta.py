@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+from psycopg2.extras import execute_values
+
+# Existing history is stored in full; the daily `compact_comment_history`
+# task compacts it. Going back, deltas are expanded to full text again
+# before the column is dropped. The helpers are copied here so that the
+# migration does not depend on the current backend.revisions.
+
+EXPAND_UPDATE_SQL = '''
+UPDATE backend_historicalcomment AS h SET text = v.text, history_delta = NULL
+FROM (VALUES %s) AS v (history_id, history_date, text)
+WHERE h.history_id = v.history_id AND h.history_date = v.history_date
+'''
+
+
+def apply_delta(base, delta):
+    return ''.join(base[op[0]:op[1]] if isinstance(op, list) else op
+                   for op in json.loads(delta)[1:])
+
+
+def expand_history(apps, schema_editor):
+    HistoricalComment = apps.get_model('backend', 'HistoricalComment')
+    ids = list(HistoricalComment.objects.filter(history_delta__isnull=False)
+               .order_by('id').values_list('id', flat=True).distinct())
+    for start in range(0, len(ids), 1000):
+        rows = HistoricalComment.objects.filter(id__in=ids[start:start + 1000]) \
+            .order_by('id', 'history_date', 'history_id') \
+            .values_list('history_id', 'history_date', 'text', 'history_delta')
+        texts = {}
+        updates = []
+        for history_id, history_date, text, delta in rows:
+            if delta:
+                # Bases are earlier revisions of the same comment.
+                text = apply_delta(texts.get(json.loads(delta)[0], ''), delta)
+                updates.append((history_id, history_date, text))
+            texts[history_id] = text
+        with schema_editor.connection.cursor() as cursor:
+            execute_values(cursor.cursor, EXPAND_UPDATE_SQL, updates,
+                           template='(%s, %s::timestamptz, %s)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_history_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalcomment',
+            name='history_delta',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, expand_history),
+    ]
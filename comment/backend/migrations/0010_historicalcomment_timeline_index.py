@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Serves the revisions of one comment in date order, as read by
+# /comments/<id>/revisions/. It also covers every lookup of the index on
+# id alone, which is dropped to keep history writes from maintaining both.
+CREATE_TIMELINE_INDEX = """
+CREATE INDEX backend_historicalcomment_timeline
+    ON backend_historicalcomment (id, history_date, history_id);
+DROP INDEX backend_historicalcomment_id_2d79829d;
+"""
+
+DROP_TIMELINE_INDEX = """
+CREATE INDEX backend_historicalcomment_id_2d79829d ON backend_historicalcomment (id);
+DROP INDEX backend_historicalcomment_timeline;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_historicalcomment_history_delta'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TIMELINE_INDEX, DROP_TIMELINE_INDEX),
+    ]
@@ -1,14 +1,22 @@
+from collections import defaultdict
+
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models, connection, transaction
+from django.db.models import Case, F, When, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
-from simple_history.models import HistoricalRecords
 
+from backend.cache import invalidate_exports, invalidate_thread
 from backend.constants import COMMENT_UPDATED_REASON, \
-    COMMENT_CREATED_REASON, COMMENT_DELETED_REASON
+    COMMENT_CREATED_REASON, COMMENT_DELETED_REASON, \
+    COMMENT_PATH_SEGMENT_WIDTH, COMMENT_PATH_SEPARATOR
+from backend.history import CommentHistoricalRecords
+from backend.websockets import notify_on_commit
 
 
 class Page(models.Model):
@@ -31,9 +39,184 @@ class BlogArticle(models.Model):
         return self.title
 
 
+def make_path_segment(comment_id):
+    return str(comment_id).zfill(COMMENT_PATH_SEGMENT_WIDTH)
+
+
+class CommentManager(models.Manager):
+    def allocate_ids(self, count):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s)",
+                [self.model._meta.db_table, count])
+            return [row[0] for row in cursor.fetchall()]
+
+    def backfill_paths(self, batch_size=10000):
+        """
+        Fill `path` for rows created before it existed, in id-range batches.
+        The path is derived from `ancestors`, so batches are independent.
+        """
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        bounds = self.filter(path='').aggregate(models.Min('id'), models.Max('id'))
+        if bounds['id__min'] is None:
+            return 0
+        updated = 0
+        with connection.cursor() as cursor:
+            for start in range(bounds['id__min'], bounds['id__max'] + 1, batch_size):
+                cursor.execute(
+                    'UPDATE {0} SET path = ('
+                    '  SELECT string_agg(lpad(a::text, %s, \'0\'), %s ORDER BY n)'
+                    '  FROM unnest(ancestors || id) WITH ORDINALITY AS t(a, n)'
+                    ") WHERE path = '' AND id >= %s AND id < %s".format(table),
+                    [COMMENT_PATH_SEGMENT_WIDTH, COMMENT_PATH_SEPARATOR,
+                     start, start + batch_size])
+                updated += cursor.rowcount
+        return updated
+
+    def adjust_reply_counts(self, parent_id, ancestors, descendants):
+        """
+        Move `descendant_count` of every comment in `ancestors` by
+        `descendants` and `children_count` of `parent_id` by one in the same
+        direction, with a single UPDATE.
+        """
+        if not ancestors:
+            return 0
+        step = 1 if descendants > 0 else -1
+        return self.filter(id__in=ancestors).update(
+            descendant_count=F('descendant_count') + descendants,
+            children_count=Case(When(id=parent_id, then=F('children_count') + step),
+                                default=F('children_count')))
+
+    def bulk_create_tree(self, comments, batch_size=1000):
+        """
+        Insert unsaved `comments` with their history in a few statements.
+        A comment's parent is either an existing comment (`parent_id`) or an
+        earlier comment of the same batch assigned to `parent`. Level,
+        ancestors, path, reply counts and object summaries are computed in
+        memory instead of per-row queries.
+        """
+        if not comments:
+            return comments
+        for comment, comment_id in zip(comments, self.allocate_ids(len(comments))):
+            comment.id = comment_id
+        parents = self.in_bulk({c.parent_id for c in comments if c.parent_id is not None})
+        batch = {}
+        added_children = defaultdict(int)
+        added_descendants = defaultdict(int)
+        for comment in comments:
+            if comment.parent_id is not None:
+                parent = parents.get(comment.parent_id)
+                if parent is None:
+                    raise ValueError('Parent comment {0} does not exist.'.format(comment.parent_id))
+            else:
+                parent = comment.parent
+                if parent is not None:
+                    if batch.get(parent.id) is not parent:
+                        raise ValueError('Parents must precede their replies in the batch.')
+                    comment.parent = parent
+            if parent is not None:
+                comment.content_type_id = parent.content_type_id
+                comment.object_id = parent.object_id
+                comment.level = parent.level + 1
+                comment.ancestors = parent.ancestors + [parent.id]
+                if parent.path:
+                    comment.path = COMMENT_PATH_SEPARATOR.join(
+                        [parent.path, make_path_segment(comment.id)])
+                for ancestor_id in comment.ancestors:
+                    if ancestor_id in batch:
+                        batch[ancestor_id].descendant_count += 1
+                    else:
+                        added_descendants[ancestor_id] += 1
+                if parent.id in batch:
+                    parent.children_count += 1
+                else:
+                    added_children[parent.id] += 1
+            else:
+                if comment.content_type_id is None or comment.object_id is None:
+                    raise ValueError('Root comments need content_type and object_id.')
+                comment.level = 0
+                comment.ancestors = []
+                comment.path = make_path_segment(comment.id)
+            batch[comment.id] = comment
+
+        history_model = self.model.history.model
+        tracked = [f.attname for f in history_model._meta.fields
+                   if not f.name.startswith('history_')]
+        history_date = now()
+        with transaction.atomic():
+            self.bulk_create(comments, batch_size=batch_size)
+            history_model.objects.bulk_create(
+                [history_model(history_date=history_date, history_type='+',
+                               history_user_id=comment.user_id,
+                               **{name: getattr(comment, name) for name in tracked})
+                 for comment in comments], batch_size=batch_size)
+            self._add_reply_counts(added_children, added_descendants)
+            CommentSummary.objects.record_created_many(comments)
+        invalidate_exports()
+        for content_type_id, object_id in {(c.content_type_id, c.object_id) for c in comments}:
+            invalidate_thread(content_type_id, object_id)
+        notify_on_commit([(c.content_type_id, c.object_id, c.id, COMMENT_CREATED_REASON)
+                          for c in comments])
+        return comments
+
+    def _add_reply_counts(self, added_children, added_descendants):
+        ids = set(added_children) | set(added_descendants)
+        if not ids:
+            return
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        params = []
+        for comment_id in ids:
+            params += [comment_id, added_children.get(comment_id, 0),
+                       added_descendants.get(comment_id, 0)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {0} c SET children_count = c.children_count + v.children,'
+                '                 descendant_count = c.descendant_count + v.descendants '
+                'FROM (VALUES {1}) AS v(id, children, descendants) '
+                'WHERE c.id = v.id'.format(table, ', '.join(['(%s, %s, %s)'] * len(ids))),
+                params)
+
+    def repair_reply_counts(self):
+        """
+        Recompute `children_count` and `descendant_count` of every comment
+        from `parent` and `ancestors`, and fix the rows that drifted.
+        """
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH descendants AS ('
+                '  SELECT unnest(ancestors) AS id, count(*) AS n FROM {0} GROUP BY 1'
+                '), children AS ('
+                '  SELECT parent_id AS id, count(*) AS n FROM {0}'
+                '  WHERE parent_id IS NOT NULL GROUP BY 1'
+                '), counts AS ('
+                '  SELECT c.id, coalesce(children.n, 0) AS children_count,'
+                '         coalesce(descendants.n, 0) AS descendant_count'
+                '  FROM {0} c'
+                '  LEFT JOIN children ON children.id = c.id'
+                '  LEFT JOIN descendants ON descendants.id = c.id'
+                ') '
+                'UPDATE {0} t SET children_count = counts.children_count,'
+                '                 descendant_count = counts.descendant_count '
+                'FROM counts WHERE t.id = counts.id'
+                ' AND (t.children_count, t.descendant_count)'
+                '     IS DISTINCT FROM (counts.children_count, counts.descendant_count)'.format(table))
+            return cursor.rowcount
+
+
 class Comment(models.Model):
     class Meta:
         ordering = ('level', '-created')
+        indexes = [
+            models.Index(fields=['level', '-created', '-id'],
+                         name='backend_comment_keyset_idx'),
+            GinIndex(fields=['ancestors'],
+                     name='backend_comment_ancestors_gin'),
+            # Latest comment of an object, for CommentSummary.last_comment_at.
+            models.Index(fields=['content_type', 'object_id', '-created'],
+                         name='backend_comment_object_idx'),
+        ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              verbose_name=_('Comment Owner'),
@@ -49,12 +232,21 @@ class Comment(models.Model):
     parent = models.ForeignKey('self', verbose_name=_('Comment Parent'),
                                related_name='children', blank=True, null=True,
                                db_index=True)
-    level = models.PositiveIntegerField(db_index=True, editable=False)
-    ancestors = ArrayField(models.PositiveIntegerField(), db_index=True)
+    level = models.PositiveIntegerField(editable=False)
+    ancestors = ArrayField(models.PositiveIntegerField())
+    path = models.TextField(_('Comment Tree Path'), editable=False,
+                            blank=True, default='', db_index=True)
     text = models.TextField(_('Comment Text'))
-    history = HistoricalRecords(
+    children_count = models.PositiveIntegerField(_('Direct Replies Count'),
+                                                 editable=False, default=0)
+    descendant_count = models.PositiveIntegerField(_('All Replies Count'),
+                                                   editable=False, default=0)
+    history = CommentHistoricalRecords(
         excluded_fields=['user', 'created', 'content_type', 'object_id',
-                         'root', 'parent', 'level'])
+                         'root', 'parent', 'level', 'path',
+                         'children_count', 'descendant_count'])
+
+    objects = CommentManager()
 
     @property
     def _history_user(self):
@@ -66,35 +258,120 @@ class Comment(models.Model):
 
     @property
     def is_leaf_node(self):
-        return not bool(self.children.exists())
+        return not self.children_count
 
     def save(self, *args, **kwargs):
         reason = COMMENT_UPDATED_REASON
         if not self.id:
             reason = COMMENT_CREATED_REASON
+            # The id is taken up front so that path can be written by the
+            # INSERT itself instead of a follow-up UPDATE.
+            self.id = Comment.objects.allocate_ids(1)[0]
+            kwargs['force_insert'] = True
             if self.parent:
                 self.root = self.parent.root
                 self.level = self.parent.level + 1
                 self.ancestors = self.parent.ancestors + [self.parent_id]
+                if self.parent.path:
+                    self.path = COMMENT_PATH_SEPARATOR.join(
+                        [self.parent.path, make_path_segment(self.id)])
             else:
                 self.level = 0
                 self.ancestors = []
-        super(Comment, self).save(*args, **kwargs)
-        # from .serializers import CommentSerializer
-        # notification_comment(self.content_type, self.object_id,
-        #                      CommentSerializer(instance=self, many=False).data.update({'reason': reason}))
+                self.path = make_path_segment(self.id)
+        with transaction.atomic():
+            super(Comment, self).save(*args, **kwargs)
+            if reason == COMMENT_CREATED_REASON:
+                CommentSummary.objects.record_created(self)
+            if reason == COMMENT_CREATED_REASON and self.parent_id:
+                Comment.objects.adjust_reply_counts(self.parent_id, self.ancestors, 1)
+                self.parent.children_count += 1
+                self.parent.descendant_count += 1
+        invalidate_exports()
+        invalidate_thread(self.content_type_id, self.object_id)
+        notify_on_commit([(self.content_type_id, self.object_id, self.id, reason)])
 
     def delete(self, *args, **kwargs):
-        notification_params = {
-            'content_type': self.content_type,
-            'object_id': self.object_id,
-            'data': {
-                'id': self.id,
-                'reason': COMMENT_DELETED_REASON
-            }
-        }
-        super(Comment, self).delete(*args, **kwargs)
-        # notification_comment(**notification_params)
+        # The id is gone from the instance once it is deleted.
+        event = (self.content_type_id, self.object_id, self.id, COMMENT_DELETED_REASON)
+        with transaction.atomic():
+            # Replies go with the comment, so ancestors lose the whole subtree.
+            descendants = Comment.objects.filter(id=self.id) \
+                .values_list('descendant_count', flat=True).first() or 0
+            super(Comment, self).delete(*args, **kwargs)
+            Comment.objects.adjust_reply_counts(self.parent_id, self.ancestors,
+                                                -(descendants + 1))
+            CommentSummary.objects.record_deleted(self, descendants + 1)
+        invalidate_exports()
+        invalidate_thread(self.content_type_id, self.object_id)
+        notify_on_commit([event])
 
     def __str__(self):
         return '{0} | {1}'.format(self.user.username, self.text)
+
+
+class CommentSummaryManager(models.Manager):
+    def record_created(self, comment):
+        self.record_created_many([comment])
+
+    def record_created_many(self, comments):
+        summaries = {}
+        for comment in comments:
+            key = (comment.content_type_id, comment.object_id)
+            count, roots, last = summaries.get(key, (0, 0, comment.created))
+            summaries[key] = (count + 1, roots + (1 if comment.level == 0 else 0),
+                              max(last, comment.created))
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        params = []
+        for (content_type_id, object_id), values in summaries.items():
+            params += [content_type_id, object_id] + list(values)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {0} (content_type_id, object_id, comment_count,'
+                '                 root_comment_count, last_comment_at) '
+                'VALUES {1} '
+                'ON CONFLICT (content_type_id, object_id) DO UPDATE SET'
+                ' comment_count = {0}.comment_count + EXCLUDED.comment_count,'
+                ' root_comment_count = {0}.root_comment_count + EXCLUDED.root_comment_count,'
+                ' last_comment_at = GREATEST({0}.last_comment_at, EXCLUDED.last_comment_at)'.format(
+                    table, ', '.join(['(%s, %s, %s, %s, %s)'] * len(summaries))),
+                params)
+
+    def record_deleted(self, comment, removed):
+        latest = Comment.objects.filter(content_type_id=comment.content_type_id,
+                                        object_id=comment.object_id) \
+            .order_by('-created').values('created')[:1]
+        self.filter(content_type_id=comment.content_type_id,
+                    object_id=comment.object_id).update(
+            comment_count=F('comment_count') - removed,
+            root_comment_count=F('root_comment_count') - (1 if comment.level == 0 else 0),
+            last_comment_at=Subquery(latest))
+
+    def annotate_objects(self, queryset):
+        """
+        Annotate a Page or BlogArticle queryset with the comment summary of
+        each object, joined in the same query.
+        """
+        summaries = self.filter(content_type=ContentType.objects.get_for_model(queryset.model),
+                                object_id=OuterRef('pk'))
+        return queryset.annotate(
+            comment_count=Coalesce(Subquery(summaries.values('comment_count')[:1]), 0),
+            root_comment_count=Coalesce(Subquery(summaries.values('root_comment_count')[:1]), 0),
+            last_comment_at=Subquery(summaries.values('last_comment_at')[:1]))
+
+
+class CommentSummary(models.Model):
+    """
+    Comment totals per page or article, kept up to date by Comment.save and
+    Comment.delete so listings do not have to aggregate comments.
+    """
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    comment_count = models.PositiveIntegerField(_('Comments Count'), default=0)
+    root_comment_count = models.PositiveIntegerField(_('Root Comments Count'), default=0)
+    last_comment_at = models.DateTimeField(_('Last Comment At'), blank=True, null=True)
+
+    objects = CommentSummaryManager()
@@ -0,0 +1,131 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seek-method pagination over a fixed, unique ordering.
+
+    Unlike `PageNumberPagination` it never issues `OFFSET` and only runs
+    `COUNT(*)` when the client asks for it, so every page costs the same
+    as the first one as long as an index covers `ordering`.
+    """
+    ordering = ()
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self.get_reversed_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_reversed_ordering(self):
+        return tuple(o[1:] if o.startswith('-') else '-' + o
+                     for o in self.ordering)
+
+    def get_seek_filter(self, ordering, position):
+        """
+        Expand `(a, b, c) > (x, y, z)` with per-column directions into
+        `a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z))`.
+        The redundant bound on `a` lets the index scan start at the cursor
+        instead of filtering everything before it.
+        """
+        seek = Q()
+        equal = {}
+        for order, value in zip(ordering, position):
+            name = order.lstrip('-')
+            lookup = '{0}__lt' if order.startswith('-') else '{0}__gt'
+            seek |= Q(**dict(equal, **{lookup.format(name): value}))
+            equal[name] = value
+        first = ordering[0]
+        bound = '{0}__lte' if first.startswith('-') else '{0}__gte'
+        return Q(**{bound.format(first.lstrip('-')): position[0]}) & seek
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            token = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            reverse = bool(token['r'])
+            values = token['p']
+            if len(values) != len(self.ordering):
+                raise ValueError()
+            position = [self.model._meta.get_field(o.lstrip('-')).to_python(v)
+                        for o, v in zip(self.ordering, values)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, instance, reverse):
+        values = [instance._meta.get_field(o.lstrip('-')).value_to_string(instance)
+                  for o in self.ordering]
+        token = json.dumps({'p': values, 'r': int(reverse)})
+        encoded = urlsafe_b64encode(token.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class CommentKeysetPagination(KeysetPagination):
+    # Matches `Comment.Meta.ordering`, with `id` breaking ties between
+    # comments created in the same microsecond.
+    ordering = ('level', '-created', '-id')
+
+
+class RevisionKeysetPagination(KeysetPagination):
+    # Newest first, served by the `(id, history_date, history_id)` index
+    # for the revisions of one comment.
+    ordering = ('-history_date', '-history_id')
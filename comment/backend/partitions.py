@@ -0,0 +1,119 @@
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now, utc
+
+from .models import Comment
+
+HISTORY_PARTITION_RE = re.compile(r'_(\d{4})(\d{2})$')
+
+
+def month_start(value, months=0):
+    """
+    Return the first instant of the month of `value`, moved by `months`.
+    """
+    month = value.astimezone(utc).year * 12 + value.astimezone(utc).month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=utc)
+
+
+def history_table():
+    return Comment.history.model._meta.db_table
+
+
+def history_partition_name(month):
+    return '{0}_{1:%Y%m}'.format(history_table(), month)
+
+
+def get_history_partitions():
+    """
+    Return the monthly partitions of the history table as `(month, name)`
+    pairs in date order. The default partition is not among them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT c.relname FROM pg_inherits i '
+                       'JOIN pg_class c ON c.oid = i.inhrelid '
+                       'WHERE i.inhparent = %s::regclass', [history_table()])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = HISTORY_PARTITION_RE.search(name)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=utc), name))
+    return sorted(partitions)
+
+
+def create_history_partitions(start=None, end=None):
+    """
+    Create the missing monthly partitions from the month of `start` through
+    the month of `end`, by default the current month and the next
+    COMMENT_HISTORY_PARTITIONS_AHEAD. History rows of these months that fell
+    into the default partition are moved to their own. Returns the names of
+    the partitions created.
+    """
+    start = month_start(start or now())
+    if end is None:
+        end = month_start(now(), settings.COMMENT_HISTORY_PARTITIONS_AHEAD)
+    else:
+        end = month_start(end)
+    table = connection.ops.quote_name(history_table())
+    default = connection.ops.quote_name('{0}_default'.format(history_table()))
+    existing = {month for month, _ in get_history_partitions()}
+    created = []
+    month = start
+    while month <= end:
+        if month not in existing:
+            bounds = [month, month_start(month, 1)]
+            name = connection.ops.quote_name(history_partition_name(month))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SELECT EXISTS (SELECT 1 FROM {0} WHERE history_date >= %s '
+                               'AND history_date < %s)'.format(default), bounds)
+                if cursor.fetchone()[0]:
+                    # Postgres refuses a partition for rows the default holds.
+                    cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(table, default))
+                    cursor.execute('CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM (%s) TO (%s)'
+                                   .format(name, table), bounds)
+                    cursor.execute('WITH moved AS (DELETE FROM {0} WHERE history_date >= %s '
+                                   'AND history_date < %s RETURNING *) '
+                                   'INSERT INTO {1} SELECT * FROM moved'.format(default, name), bounds)
+                    cursor.execute('ALTER TABLE {0} ATTACH PARTITION {1} DEFAULT'.format(table, default))
+                else:
+                    cursor.execute('CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM (%s) TO (%s)'
+                                   .format(name, table), bounds)
+            created.append(history_partition_name(month))
+        month = month_start(month, 1)
+    return created
+
+
+def drop_history_partitions(before, detach_only=False):
+    """
+    Detach the monthly partitions that end on or before the month of
+    `before` and drop them, unless `detach_only` keeps them as standalone
+    tables for archiving. Returns the names of the partitions removed.
+    """
+    cutoff = month_start(before)
+    table = connection.ops.quote_name(history_table())
+    removed = []
+    for month, name in get_history_partitions():
+        if month >= cutoff:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(
+                table, connection.ops.quote_name(name)))
+            if not detach_only:
+                cursor.execute('DROP TABLE {0}'.format(connection.ops.quote_name(name)))
+        removed.append(name)
+    return removed
+
+
+def maintain_history_partitions():
+    """
+    Create the partitions of the coming months and, when
+    COMMENT_HISTORY_RETENTION_MONTHS is set, drop the ones past retention.
+    """
+    created = create_history_partitions()
+    removed = []
+    if settings.COMMENT_HISTORY_RETENTION_MONTHS:
+        removed = drop_history_partitions(month_start(now(), -settings.COMMENT_HISTORY_RETENTION_MONTHS))
+    return {'created': created, 'removed': removed}
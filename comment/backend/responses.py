@@ -0,0 +1,191 @@
+import json
+import os
+import re
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.utils.text import compress_sequence
+from rest_framework.response import Response
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RenderedJSONResponse(Response):
+    """
+    Response for a JSON `payload` rendered in advance, e.g. from a cache.
+    `data` is only parsed back from it when read.
+    """
+
+    def __init__(self, payload, **kwargs):
+        super(RenderedJSONResponse, self).__init__(**kwargs)
+        self.payload = payload
+
+    @property
+    def data(self):
+        if self._data is None and getattr(self, 'payload', None) is not None:
+            self._data = json.loads(self.payload.decode())
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = 'application/json'
+        return self.payload
+
+
+class ExportFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+def read_blocks(file, start=0, length=None, block_size=ExportFileResponse.block_size):
+    try:
+        file.seek(start)
+        while length is None or length > 0:
+            data = file.read(block_size if length is None else min(block_size, length))
+            if not data:
+                break
+            if length is not None:
+                length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive `(start, end)` of a single `bytes=` range, `None`
+    for headers that should be ignored, or raise ValueError when the range
+    cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def accepts_gzip(request):
+    """
+    Whether the request's Accept-Encoding allows a gzip body, honouring
+    q-values: `gzip;q=0` refuses it, and `*` covers it when gzip is not
+    listed. Unparseable q-values count as 0.
+    """
+    qualities = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def export_file_response(request, path, filename, content_type):
+    """
+    Build the response for a finished export file. The transfer is handed
+    to the front proxy when COMMENT_EXPORT_SENDFILE is set, otherwise the
+    file is streamed with support for conditional requests, single byte
+    ranges and on-the-fly gzip.
+    """
+    stat = os.stat(path)
+    etag = '{0:x}-{1:x}'.format(int(stat.st_mtime), stat.st_size)
+    byte_range = request.META.get('HTTP_RANGE')
+    if request.META.get('HTTP_IF_RANGE', quote_etag(etag)) != quote_etag(etag):
+        byte_range = None
+    use_gzip = accepts_gzip(request) and not byte_range and not settings.COMMENT_EXPORT_SENDFILE
+    if use_gzip:
+        etag += '-gzip'
+
+    if quote_etag(etag) in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = quote_etag(etag)
+        return response
+
+    if settings.COMMENT_EXPORT_SENDFILE == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.COMMENT_EXPORT_SENDFILE_ROOT + filename
+    elif settings.COMMENT_EXPORT_SENDFILE == 'X-Sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif use_gzip:
+        response = StreamingHttpResponse(compress_sequence(read_blocks(open(path, 'rb'))),
+                                         content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        try:
+            start_end = parse_range(byte_range, stat.st_size) if byte_range else None
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(stat.st_size)
+            return response
+        if start_end is None:
+            response = ExportFileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = stat.st_size
+        else:
+            start, end = start_end
+            response = StreamingHttpResponse(read_blocks(open(path, 'rb'), start, end - start + 1),
+                                             status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, stat.st_size)
+            response['Content-Length'] = end - start + 1
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = quote_etag(etag)
+    response['Vary'] = 'Accept-Encoding'
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
+
+
+def read_gzip_blocks(file):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for block in read_blocks(file):
+        data = decompressor.decompress(block)
+        if data:
+            yield data
+    yield decompressor.flush()
+
+
+def spooled_result_response(request, path):
+    """
+    Stream a `get_comments` result spooled to a gzip file, which holds the
+    body the list endpoint would have rendered, and remove the file once it
+    has been sent in full. Clients accepting gzip get the file as it is,
+    others get it decompressed on the fly.
+    """
+    file = open(path, 'rb')
+    use_gzip = accepts_gzip(request)
+    body = read_blocks(file) if use_gzip else read_gzip_blocks(file)
+
+    def stream():
+        yield from body
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    response = StreamingHttpResponse(stream(), content_type='application/json')
+    if use_gzip:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,201 @@
+import json
+import re
+from difflib import SequenceMatcher
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from psycopg2.extras import execute_values
+
+from .partitions import month_start
+
+# Words with the whitespace that follows them; together they make up the text.
+WORD_RE = re.compile(r'\s+|\S+\s*')
+
+COMPACT_UPDATE_SQL = '''
+UPDATE {0} AS h SET text = v.text, history_delta = v.history_delta
+FROM (VALUES %s) AS v (history_id, history_date, text, history_delta)
+WHERE h.history_id = v.history_id AND h.history_date = v.history_date
+'''
+
+# The latest revisions of each comment, newest first, up to a date: the
+# delta chains of the revisions being restored. Served by the
+# (id, history_date, history_id) timeline index.
+RESTORE_CHAIN_SQL = '''
+SELECT h.history_id, h.text, h.history_delta
+FROM unnest(%s::integer[], %s::timestamptz[], %s::integer[]) AS c (id, until, revisions)
+CROSS JOIN LATERAL (
+    SELECT history_id, text, history_delta FROM {0}
+    WHERE id = c.id AND history_date <= c.until
+    ORDER BY history_date DESC, history_id DESC LIMIT c.revisions
+) AS h
+'''
+
+
+def make_delta(base_id, base, text):
+    """
+    Encode `text` as edits of `base`, the text of revision `base_id`: a JSON
+    list of the base id followed by `[start, end]` character ranges copied
+    from the base and strings inserted between them. Texts are compared a
+    word at a time, which keeps diffing long comments fast.
+    """
+    base_words = WORD_RE.findall(base)
+    words = WORD_RE.findall(text)
+    offsets = [0]
+    for word in base_words:
+        offsets.append(offsets[-1] + len(word))
+    delta = [base_id]
+    matcher = SequenceMatcher(None, base_words, words, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([offsets[i1], offsets[i2]])
+        elif j2 > j1:
+            delta.append(''.join(words[j1:j2]))
+    return json.dumps(delta, separators=(',', ':'))
+
+
+def delta_base(delta):
+    return json.loads(delta)[0]
+
+
+def apply_delta(base, delta):
+    return ''.join(base[op[0]:op[1]] if isinstance(op, list) else op
+                   for op in json.loads(delta)[1:])
+
+
+def restore_texts(revisions):
+    """
+    Fill in the text of the revisions among `revisions` that are stored as
+    deltas, following their bases back to a full snapshot. A base is the
+    previous revision of the same comment and snapshots are at most
+    COMMENT_HISTORY_SNAPSHOT_INTERVAL revisions apart, so for each comment
+    only as many revisions as it has here plus one interval are loaded,
+    newest first from its latest one here. Returns `revisions`.
+    """
+    pending = [r for r in revisions if r.history_delta]
+    if not pending:
+        return revisions
+    history_model = type(pending[0])
+    rows = {r.history_id: (r.text, r.history_delta) for r in revisions}
+    comments = {}
+    for revision in revisions:
+        if revision.id in comments:
+            until, count = comments[revision.id]
+            comments[revision.id] = (max(until, revision.history_date), count + 1)
+        else:
+            comments[revision.id] = (revision.history_date, 1)
+    interval = settings.COMMENT_HISTORY_SNAPSHOT_INTERVAL
+    ids = sorted({r.id for r in pending})
+    with connection.cursor() as cursor:
+        cursor.execute(RESTORE_CHAIN_SQL.format(connection.ops.quote_name(history_model._meta.db_table)), [
+            ids, [comments[i][0] for i in ids], [comments[i][1] + interval for i in ids]])
+        for history_id, text, delta in cursor.fetchall():
+            rows[history_id] = (text, delta)
+
+    def chain_end(history_id):
+        while history_id in rows and rows[history_id][1]:
+            history_id = delta_base(rows[history_id][1])
+        return history_id
+
+    # Chains longer than expected, after a change of the interval or with
+    # revisions missing from `revisions`, are followed a step at a time.
+    while True:
+        missing = {chain_end(r.history_id) for r in pending} - set(rows)
+        if not missing:
+            break
+        loaded = dict.fromkeys(missing, ('', None))
+        # Compaction keeps bases within a month, so a base is only missing
+        # for a partition detached by hand; its text is left empty.
+        for history_id, text, delta in history_model.objects.filter(history_id__in=missing) \
+                .values_list('history_id', 'text', 'history_delta'):
+            loaded[history_id] = (text, delta)
+        rows.update(loaded)
+
+    texts = {}
+
+    def text_of(history_id):
+        chain = []
+        while history_id not in texts:
+            text, delta = rows[history_id]
+            if not delta:
+                texts[history_id] = text
+                break
+            chain.append(history_id)
+            history_id = delta_base(delta)
+        for step in reversed(chain):
+            texts[step] = apply_delta(texts[history_id], rows[step][1])
+            history_id = step
+        return texts[history_id]
+
+    for revision in pending:
+        revision.text = text_of(revision.history_id)
+        revision.history_delta = None
+    return revisions
+
+
+def compact_revisions(revisions, interval):
+    """
+    Decide the storage of one comment's revisions, given as
+    `(history_id, history_date, text, history_delta)` rows in date order.
+    Every `interval`-th revision, the first of each month and every one a
+    delta would not shrink is a full snapshot; the others are deltas of the
+    previous revision. Keeping deltas within a month lets old history
+    partitions be dropped without breaking newer revisions. Returns the
+    rows whose storage changes, as the same tuples.
+    """
+    full = {}
+    changed = []
+    previous = previous_month = None
+    since_snapshot = 0
+    for history_id, history_date, text, delta in revisions:
+        if delta:
+            text = apply_delta(full[delta_base(delta)], delta)
+        full[history_id] = text
+        new_text, new_delta = text, None
+        month = month_start(history_date)
+        if previous is not None and month == previous_month and since_snapshot < interval - 1:
+            candidate = make_delta(previous, full[previous], text)
+            if len(candidate) < len(text):
+                new_text, new_delta = '', candidate
+        since_snapshot = since_snapshot + 1 if new_delta else 0
+        if new_delta != delta:
+            changed.append((history_id, history_date, new_text, new_delta))
+        previous, previous_month = history_id, month
+    return changed
+
+
+def compact_history(history_model, comment_ids=None, since=None, interval=None, batch_size=1000):
+    """
+    Store the history of comments with more than one revision as snapshots
+    every `interval` revisions, COMMENT_HISTORY_SNAPSHOT_INTERVAL by
+    default, and deltas between them; an interval of 1 stores every
+    revision in full again. Limited to `comment_ids` or to comments with
+    revisions since `since`. Compaction is idempotent, and revisions added
+    meanwhile are stored in full until the next run. Returns the number of
+    revisions whose storage changed.
+    """
+    queryset = history_model.objects.all()
+    if comment_ids is not None:
+        queryset = queryset.filter(id__in=comment_ids)
+    if since is not None:
+        queryset = queryset.filter(id__in=history_model.objects.filter(history_date__gte=since)
+                                   .values('id'))
+    ids = list(queryset.order_by().values('id').annotate(revisions=Count('history_id'))
+               .filter(revisions__gt=1).values_list('id', flat=True))
+    interval = interval or settings.COMMENT_HISTORY_SNAPSHOT_INTERVAL
+    table = connection.ops.quote_name(history_model._meta.db_table)
+    changed = 0
+    for start in range(0, len(ids), batch_size):
+        rows = history_model.objects.filter(id__in=ids[start:start + batch_size]) \
+            .order_by('id', 'history_date', 'history_id') \
+            .values_list('id', 'history_id', 'history_date', 'text', 'history_delta')
+        updates = []
+        for _, revisions in groupby(rows, key=lambda row: row[0]):
+            updates.extend(compact_revisions([row[1:] for row in revisions], interval))
+        if updates:
+            with connection.cursor() as cursor:
+                execute_values(cursor.cursor, COMPACT_UPDATE_SQL.format(table), updates,
+                               template='(%s, %s::timestamptz, %s, %s)')
+            changed += len(updates)
+    return changed
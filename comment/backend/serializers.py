@@ -1,24 +1,49 @@
+from collections import OrderedDict, defaultdict
+
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
 from rest_framework import serializers
 
 from .models import BlogArticle, Page, Comment
+from .revisions import restore_texts
+
+
+class CommentSummaryFieldsMixin(serializers.Serializer):
+    # Filled by CommentSummary.objects.annotate_objects; left out of the
+    # response for instances that were not loaded through it.
+    comment_count = serializers.IntegerField(read_only=True)
+    root_comment_count = serializers.IntegerField(read_only=True)
+    last_comment_at = serializers.DateTimeField(read_only=True)
 
 
-class BlogArticleSerializer(serializers.ModelSerializer):
+class BlogArticleSerializer(CommentSummaryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = BlogArticle
-        fields = ('id', 'title')
+        fields = ('id', 'title', 'comment_count', 'root_comment_count',
+                  'last_comment_at')
 
 
-class PageSerializer(serializers.ModelSerializer):
+class PageSerializer(CommentSummaryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Page
-        fields = ('id', 'title')
+        fields = ('id', 'title', 'comment_count', 'root_comment_count',
+                  'last_comment_at')
+
+
+class CommentHistoryListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Restore the texts of a whole page at once.
+        revisions = list(data.all() if isinstance(data, models.Manager) else data)
+        return super(CommentHistoryListSerializer, self).to_representation(restore_texts(revisions))
 
 
 class CommentHistorySerializer(serializers.ModelSerializer):
     reason = serializers.SerializerMethodField()
 
+    def to_representation(self, instance):
+        return super(CommentHistorySerializer, self).to_representation(restore_texts([instance])[0])
+
     def get_reason(self, obj):
         if obj.history_type == '+':
             return 'Created'
@@ -32,6 +57,7 @@ class CommentHistorySerializer(serializers.ModelSerializer):
         model = Comment.history.model
         fields = ('id', 'history_user_id', 'history_date',
                   'reason', 'text')
+        list_serializer_class = CommentHistoryListSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -49,4 +75,101 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ('__all__')
+        exclude = ('path',)
+
+
+class CommentBulkListSerializer(serializers.ListSerializer):
+    def validate(self, data):
+        refs = set()
+        for item in data:
+            if 'ref' in item:
+                if item['ref'] in refs:
+                    raise serializers.ValidationError({'ref': 'Duplicate reference {0}.'.format(item['ref'])})
+                refs.add(item['ref'])
+        # Ids are checked with one query per kind instead of one per item.
+        self.check_ids('user_id', get_user_model().objects.all(), {item['user_id'] for item in data})
+        self.check_ids('parent', Comment.objects.all(),
+                       {item['parent'] for item in data if 'parent' in item})
+        self.check_ids(
+            'content_type',
+            ContentType.objects.filter(Comment._meta.get_field('content_type').get_limit_choices_to()),
+            {item['content_type'] for item in data if 'content_type' in item})
+        roots = defaultdict(set)
+        for item in data:
+            if 'content_type' in item and 'object_id' in item:
+                roots[item['content_type']].add(item['object_id'])
+        for content_type_id, object_ids in roots.items():
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            self.check_ids('object_id', content_type.model_class().objects.all(), object_ids,
+                           content_type.model)
+        return data
+
+    def check_ids(self, field, queryset, ids, name=None):
+        """
+        Raise a validation error for `field` unless `queryset` has all of
+        `ids`.
+        """
+        if not ids:
+            return
+        missing = ids - set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError({field: 'Unknown {0} {1}.'.format(
+                name or field, min(missing))})
+
+
+class CommentBulkSerializer(serializers.Serializer):
+    """
+    One comment of a bulk create request. `ref` names the comment within
+    the request so that later items can reply to it with `parent_ref`.
+    """
+    ref = serializers.CharField(required=False)
+    parent_ref = serializers.CharField(required=False)
+    parent = serializers.IntegerField(required=False)
+    user_id = serializers.IntegerField()
+    content_type = serializers.IntegerField(required=False)
+    object_id = serializers.IntegerField(required=False, min_value=0)
+    text = serializers.CharField()
+
+    def validate(self, data):
+        if 'parent' in data and 'parent_ref' in data:
+            raise serializers.ValidationError('Only one of parent and '
+                                              'parent_ref may be given.')
+        return data
+
+    class Meta:
+        list_serializer_class = CommentBulkListSerializer
+
+
+COMMENT_ROW_FIELDS = ('id', 'user_id', 'ancestors', 'created', 'object_id', 'level', 'text',
+                      'children_count', 'descendant_count', 'content_type_id', 'parent_id')
+
+
+def serialize_comment_rows(queryset):
+    """
+    Render `queryset` exactly as `CommentSerializer(queryset, many=True)`
+    would, reading only the exposed columns instead of building model
+    instances and walking the serializer fields for every row.
+    """
+    return render_comment_rows(queryset.values_list(*COMMENT_ROW_FIELDS))
+
+
+def render_comment_rows(rows):
+    """
+    Render tuples of `COMMENT_ROW_FIELDS` for `serialize_comment_rows`.
+    """
+    created = CommentSerializer().fields['created'].to_representation
+    return [OrderedDict((
+        ('id', pk),
+        ('user_id', user_id),
+        ('ancestors', ancestors),
+        ('created', created(created_at)),
+        ('object_id', object_id),
+        ('level', level),
+        ('text', text),
+        ('children_count', children_count),
+        ('descendant_count', descendant_count),
+        ('user', user_id),
+        ('content_type', content_type_id),
+        ('parent', parent_id),
+    )) for pk, user_id, ancestors, created_at, object_id, level, text,
+        children_count, descendant_count, content_type_id, parent_id in rows]
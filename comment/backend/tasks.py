@@ -1,33 +1,171 @@
 from __future__ import absolute_import, unicode_literals
 
+import gzip
+import os
+from collections import OrderedDict
+from contextlib import closing
+from datetime import timedelta
+
 from celery import task
+from celery.signals import task_postrun
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
 
+from . import history, partitions, revisions
+from .cache import thread_cache
+from .exporters import JSONStreamWriter, get_stream_writer_class, iter_comment_chunks, \
+    sweep_export_dir, temporary_export_path
+from .filters import get_comment_queryset
+from .metrics import TaskTimer, TimedStream
 from .models import Comment
-from .renderer import get_renderer_class
-from .serializers import CommentSerializer
+from .serializers import COMMENT_ROW_FIELDS, CommentSerializer, render_comment_rows
+from .websockets import notification_task
+
+logger = get_task_logger(__name__)
+
+
+@task(bind=True)
+def get_comments(self, spec, cache_key=None):
+    timer = TaskTimer.start(self, 'get_comments')
+    with timer.phase('sql'):
+        rows = list(get_comment_queryset(spec).values_list(*COMMENT_ROW_FIELDS))
+    with timer.phase('serialization'):
+        comments = render_comment_rows(rows)
+    timer.sizes['rows'] = len(comments)
+    threshold = settings.COMMENT_RESULT_SPOOL_THRESHOLD
+    if threshold and len(comments) > threshold:
+        comments = spool_comments(self, comments, timer)
+    elif cache_key:
+        with timer.phase('rendering'):
+            thread_cache.set(cache_key, JSONRenderer().render(comments), local=False)
+    timer.finish()
+    return comments
+
+
+def spool_comments(task, comments, timer):
+    """
+    Write the list response body for `comments` as one gzip stream next to
+    the exports and return the manifest that is stored as the task result
+    in their place. The file is served as it is to clients accepting gzip.
+    """
+    filename = '{0}.json.gz'.format(task.request.id)
+    path = os.path.join(settings.COMMENT_EXPORT_DIR, filename)
+    chunk_size = settings.COMMENT_EXPORT_CHUNK_SIZE
+    head = JSONRenderer().render(OrderedDict((('task_id', task.request.id), ('status', 'SUCCESS'))))
+    # Level 6 compresses comment text nearly as well as 9 at a fraction of the cost.
+    with temporary_export_path(path) as temp_path, \
+            gzip.open(temp_path, 'wt', compresslevel=6, encoding='utf-8') as f:
+        stream = TimedStream(f, timer)
+        writer = JSONStreamWriter(stream)
+        with timer.phase('rendering'):
+            stream.write(head[:-1].decode() + ',"result":')
+            writer.start()
+            for start in range(0, len(comments), chunk_size):
+                writer.write(comments[start:start + chunk_size])
+            writer.finish()
+            stream.write('}')
+    return {
+        'spooled': filename,
+        'rows': len(comments),
+        'size': os.path.getsize(path)
+    }
+
+
+# Redelivered when the worker dies mid-export, so that downloads which joined
+# it through the export cache still get their file.
+@task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def create_import_file(self, spec, format_suffix='xml', cache_key=None):
+    try:
+        result = write_import_file(self, spec, format_suffix, cache_key)
+    except Exception:
+        if cache_key:
+            cache.delete(cache_key)
+        raise
+    if cache_key:
+        cache.set(cache_key, {'task_id': self.request.id, 'result': result},
+                  settings.COMMENT_EXPORT_TTL)
+    return result
+
+
+def keep_export_pending(task, cache_key):
+    # The in-flight entry expires soon unless a live task keeps refreshing it.
+    if cache_key:
+        cache.set(cache_key, {'task_id': task.request.id}, settings.COMMENT_EXPORT_PENDING_TTL)
+
+
+def write_import_file(task, spec, format_suffix, cache_key=None):
+    writer_class = get_stream_writer_class(format_suffix)
+    filename = '{0}.{1}'.format(task.request.id, format_suffix)
+    timer = TaskTimer.start(task, 'create_import_file')
+    exported = 0
+    path = os.path.join(settings.COMMENT_EXPORT_DIR, filename)
+    with temporary_export_path(path) as temp_path, open(temp_path, "w") as f, transaction.atomic():
+        writer = writer_class(TimedStream(f, timer))
+        with timer.phase('rendering'):
+            writer.start()
+        # Closed before the transaction ends, also when writing fails.
+        with closing(iter_comment_chunks(get_comment_queryset(spec),
+                                         settings.COMMENT_EXPORT_CHUNK_SIZE)) as chunks:
+            while True:
+                with timer.phase('sql'):
+                    comments = next(chunks, None)
+                if comments is None:
+                    break
+                with timer.phase('serialization'):
+                    data = CommentSerializer(instance=comments, many=True).data
+                with timer.phase('rendering'):
+                    writer.write(data)
+                exported += len(comments)
+                keep_export_pending(task, cache_key)
+                if not task.request.is_eager:
+                    task.update_state(state='PROGRESS', meta={'exported': exported,
+                                                             'timings': timer.as_dict()})
+        with timer.phase('rendering'):
+            writer.finish()
+    timer.sizes['rows'] = exported
+    return {
+        'filename': filename,
+        'media_type': writer.media_type,
+        'format': format_suffix,
+        'timings': timer.finish()
+    }
+
+
+@task(acks_late=True, reject_on_worker_lost=True)
+def write_deferred_history():
+    return history.drain_history(Comment.history.model, settings.COMMENT_HISTORY_BATCH_SIZE)
 
 
 @task()
-def get_comments(query):
-    qs = Comment.objects.raw(query)
-    data = CommentSerializer(qs, many=True).data
-    return data
+def compact_comment_history():
+    # Two days back, so that a run that failed is made up for by the next.
+    since = now() - timedelta(days=2)
+    return revisions.compact_history(Comment.history.model, since=since)
 
 
-@task(bind=True)
-def create_import_file(self, query, format_suffix='xml'):
-    renderer_class = get_renderer_class(format_suffix)
-    renderer = renderer_class()
-    qs = Comment.objects.raw(query)
-    data = CommentSerializer(instance=qs, many=True).data
-    filename = '{0}.{1}'.format(self.request.id, format_suffix)
-    with open('/tmp/{0}'.format(filename), "w") as f:
-        file_data = renderer.render(data)
-        if hasattr(file_data, 'decode'):
-            file_data = file_data.decode()
-        f.write(file_data)
-        return {
-            'filename': filename,
-            'media_type': renderer.media_type,
-            'format': format_suffix
-        }
+@task()
+def maintain_history_partitions():
+    return partitions.maintain_history_partitions()
+
+
+@task()
+def sweep_export_files():
+    return sweep_export_dir(settings.COMMENT_EXPORT_DIR,
+                            settings.COMMENT_EXPORT_TTL,
+                            settings.COMMENT_EXPORT_MAX_BYTES)
+
+
+@task_postrun.connect
+def push_task_state(sender=None, task_id=None, state=None, **kwargs):
+    # Sent once the result is stored, so subscribers can fetch it right away.
+    if sender.name not in (get_comments.name, create_import_file.name) or sender.request.is_eager:
+        return
+    try:
+        notification_task(task_id, state)
+    except RedisError as e:
+        logger.warning('Could not push the state of task %s: %s', task_id, e)
@@ -0,0 +1,77 @@
+from django.db import connection
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageCommentFactory
+from backend.models import Comment
+
+
+class APICommentRevisionsTestCase(TestCase):
+    def setUp(self):
+        self.comment = PageCommentFactory(text='Revision 0')
+        for i in range(1, 13):
+            self.comment.text = 'Revision {0}'.format(i)
+            self.comment.save()
+        PageCommentFactory(text='Other comment')
+        self.url = reverse('comment-revisions', args=[self.comment.id])
+
+    def test_pages_newest_first(self):
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['text'] for r in res.data['results']],
+                         ['Revision {0}'.format(i) for i in range(12, 2, -1)])
+        self.assertIsNone(res.data['previous'])
+
+        res = self.client.get(res.data['next'])
+
+        self.assertEqual([r['text'] for r in res.data['results']], ['Revision 2', 'Revision 1', 'Revision 0'])
+        self.assertEqual(res.data['results'][-1]['reason'], 'Created')
+        self.assertIsNone(res.data['next'])
+
+        res = self.client.get(res.data['previous'])
+
+        self.assertEqual(res.data['results'][0]['text'], 'Revision 12')
+
+    def test_count(self):
+        res = self.client.get(self.url, {'count': 'true'})
+
+        self.assertEqual(res.data['count'], 13)
+
+    def test_latest(self):
+        res = self.client.get(self.url, {'latest': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['text'] for r in res.data['results']], ['Revision 12', 'Revision 11'])
+
+    def test_invalid_latest(self):
+        for value in ('0', '-1', 'x', '101'):
+            res = self.client.get(self.url, {'latest': value})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, value)
+
+    def test_deleted_comment(self):
+        self.comment.delete()
+
+        res = self.client.get(self.url, {'latest': 1})
+
+        self.assertEqual(res.data['results'][0]['reason'], 'Deleted')
+
+    def test_unknown_comment(self):
+        res = self.client.get(reverse('comment-revisions', args=[self.comment.id + 100]))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_timeline_index(self):
+        history = self.comment.history.order_by('-history_date', '-history_id')
+        queryset = Comment.history.filter(id=self.comment.id, history_date__lte=history[5].history_date) \
+            .order_by('-history_date', '-history_id')[:11]
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+        self.assertIn('_id_history_date_history_id_idx', plan)
+        self.assertIn('history_date <=', plan)
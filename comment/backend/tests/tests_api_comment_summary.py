@@ -0,0 +1,70 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory, BlogArticleFactory, \
+    BlogArticleCommentFactory, UserFactory
+
+
+class APICommentSummaryTestCase(TestCase):
+    def setUp(self):
+        super(APICommentSummaryTestCase, self).setUp()
+        self.page = PageFactory()
+        self.roots = PageCommentFactory.create_batch(2, root=self.page)
+        self.reply = PageCommentFactory(parent=self.roots[0])
+        self.empty_page = PageFactory()
+
+    def test_page_detail(self):
+        res = self.client.get(reverse('page-detail', args=(self.page.id,)))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['comment_count'], 3)
+        self.assertEqual(res.data['root_comment_count'], 2)
+        self.assertIsNotNone(res.data['last_comment_at'])
+
+    def test_page_without_comments(self):
+        res = self.client.get(reverse('page-detail', args=(self.empty_page.id,)))
+
+        self.assertEqual(res.data['comment_count'], 0)
+        self.assertEqual(res.data['root_comment_count'], 0)
+        self.assertIsNone(res.data['last_comment_at'])
+
+    def test_delete_updates_summary(self):
+        self.reply.delete()
+        self.roots[1].delete()
+
+        res = self.client.get(reverse('page-detail', args=(self.page.id,)))
+
+        self.assertEqual(res.data['comment_count'], 1)
+        self.assertEqual(res.data['root_comment_count'], 1)
+
+    def test_article_summary_is_separate(self):
+        article = BlogArticleFactory(id=self.page.id, user=UserFactory())
+        BlogArticleCommentFactory(root=article)
+
+        res = self.client.get(reverse('blogarticle-detail', args=(article.id,)))
+
+        self.assertEqual(res.data['comment_count'], 1)
+
+    def test_listing_is_one_query_per_page(self):
+        PageFactory.create_batch(5)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('page-list'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # Paginator count plus the annotated page of results.
+        self.assertEqual(len(queries), 2)
+
+    def test_last_comment_lookup_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.reply.delete()
+        sql = next(q['sql'] for q in queries if q['sql'].startswith('UPDATE "backend_commentsummary"'))
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+        self.assertIn('backend_comment_object_idx', plan)
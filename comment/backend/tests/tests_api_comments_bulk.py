@@ -0,0 +1,156 @@
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory, UserFactory
+from backend.models import Comment, CommentSummary, Page
+
+
+class BulkCreateTreeTestCase(TestCase):
+    def setUp(self):
+        super(BulkCreateTreeTestCase, self).setUp()
+        self.user = UserFactory()
+        self.page = PageFactory()
+        self.content_type = ContentType.objects.get_for_model(Page)
+        self.existing = PageCommentFactory(root=self.page)
+
+    def test_tree_with_batch_and_existing_parents(self):
+        root = Comment(user=self.user, content_type=self.content_type, object_id=self.page.id, text='root')
+        reply = Comment(user=self.user, parent=root, text='reply')
+        nested = Comment(user=self.user, parent=reply, text='nested')
+        external = Comment(user=self.user, parent_id=self.existing.id, text='external')
+
+        Comment.objects.bulk_create_tree([root, reply, nested, external])
+
+        nested.refresh_from_db()
+        self.assertEqual(nested.level, 2)
+        self.assertEqual(nested.ancestors, [root.id, reply.id])
+        self.assertTrue(nested.path.startswith(root.path + '.'))
+        self.assertEqual(nested.object_id, self.page.id)
+        root.refresh_from_db()
+        self.assertEqual((root.children_count, root.descendant_count), (1, 2))
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.children_count, self.existing.descendant_count), (1, 1))
+        self.assertEqual(Comment.history.filter(id__in=[root.id, reply.id, nested.id, external.id],
+                                                history_type='+').count(), 4)
+        summary = CommentSummary.objects.get(object_id=self.page.id, content_type=self.content_type)
+        self.assertEqual((summary.comment_count, summary.root_comment_count), (5, 2))
+
+    def test_same_queries_for_any_batch_size(self):
+        def create(count):
+            Comment.objects.bulk_create_tree(
+                [Comment(user=self.user, parent_id=self.existing.id, text=str(i)) for i in range(count)])
+
+        with self.assertNumQueries(8):
+            create(2)
+        with self.assertNumQueries(8):
+            create(50)
+
+    def test_parent_must_precede_reply(self):
+        root = Comment(user=self.user, content_type=self.content_type, object_id=self.page.id, text='root')
+        reply = Comment(user=self.user, parent=root, text='reply')
+
+        with self.assertRaises(ValueError):
+            Comment.objects.bulk_create_tree([reply, root])
+
+    def test_unknown_parent(self):
+        with self.assertRaises(ValueError):
+            Comment.objects.bulk_create_tree([Comment(user=self.user, parent_id=0, text='x')])
+
+
+class APIBulkCreateCommentsTestCase(TestCase):
+    def setUp(self):
+        super(APIBulkCreateCommentsTestCase, self).setUp()
+        self.user = UserFactory()
+        self.page = PageFactory()
+        self.content_type = ContentType.objects.get_for_model(Page)
+
+    def post(self, data):
+        return self.client.post(reverse('comment-bulk'), json.dumps(data), content_type='application/json')
+
+    def test_create_thread(self):
+        res = self.post([
+            {'ref': 'a', 'user_id': self.user.id, 'content_type': self.content_type.id,
+             'object_id': self.page.id, 'text': 'root'},
+            {'ref': 'b', 'parent_ref': 'a', 'user_id': self.user.id, 'text': 'reply'},
+            {'parent_ref': 'b', 'user_id': self.user.id, 'text': 'nested'},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED, res.data)
+        self.assertEqual([c['level'] for c in res.data], [0, 1, 2])
+        self.assertEqual(res.data[2]['ancestors'], [res.data[0]['id'], res.data[1]['id']])
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_unknown_reference(self):
+        res = self.post([{'parent_ref': 'missing', 'user_id': self.user.id, 'text': 'reply'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent_ref', res.data)
+
+    def test_root_without_object(self):
+        res = self.post([{'user_id': self.user.id, 'text': 'root'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(COMMENT_BULK_MAX_SIZE=1)
+    def test_batch_size_limit(self):
+        res = self.post([{'parent': 1, 'user_id': self.user.id, 'text': 'x'}] * 2)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_user(self):
+        res = self.post([{'user_id': self.user.id + 100, 'content_type': self.content_type.id,
+                          'object_id': self.page.id, 'text': 'root'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user_id', res.data)
+
+    def test_unknown_parent(self):
+        res = self.post([{'parent': 0, 'user_id': self.user.id, 'text': 'reply'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent', res.data)
+
+    def test_content_type_not_commentable(self):
+        content_type = ContentType.objects.get_for_model(Comment)
+        res = self.post([{'user_id': self.user.id, 'content_type': content_type.id,
+                          'object_id': self.page.id, 'text': 'root'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('content_type', res.data)
+
+    def test_unknown_object(self):
+        res = self.post([{'user_id': self.user.id, 'content_type': self.content_type.id,
+                          'object_id': self.page.id + 100, 'text': 'root'}])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('object_id', res.data)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_duplicate_reference(self):
+        item = {'ref': 'a', 'user_id': self.user.id, 'content_type': self.content_type.id,
+                'object_id': self.page.id, 'text': 'root'}
+        res = self.post([item, item])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ref', res.data)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_same_queries_for_any_batch_size(self):
+        parent = PageCommentFactory(root=self.page)
+
+        def post(count):
+            return self.post([{'ref': 'r{0}'.format(i), 'user_id': self.user.id,
+                               'content_type': self.content_type.id, 'object_id': self.page.id,
+                               'text': 'root'} for i in range(count)] +
+                             [{'parent': parent.id, 'user_id': self.user.id, 'text': 'reply'}] * count)
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(post(2).status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(len(small)):
+            self.assertEqual(post(50).status_code, status.HTTP_201_CREATED)
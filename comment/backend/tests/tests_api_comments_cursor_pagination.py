@@ -0,0 +1,77 @@
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import BlogArticleFactory, BlogArticleCommentFactory
+
+
+class APICursorPaginationCommentTest(TestCase):
+    def test_cursor_pagination_without_count(self):
+        blog = BlogArticleFactory()
+        BlogArticleCommentFactory.create_batch(15, root=blog)
+
+        res = self.client.get(reverse('comment-list'), {
+            'level': 0,
+            'pagination': 'cursor'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertFalse('count' in res.data)
+        self.assertEqual(res.data['previous'], None)
+        self.assertTrue('cursor=' in res.data['next'])
+        self.assertEqual(len(res.data['results']), 10)
+
+    def test_cursor_pagination_with_count(self):
+        blog = BlogArticleFactory()
+        BlogArticleCommentFactory.create_batch(15, root=blog)
+
+        res = self.client.get(reverse('comment-list'), {
+            'level': 0,
+            'pagination': 'cursor',
+            'count': 'true'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 15)
+
+    def test_cursor_pagination_walks_all_pages_in_order(self):
+        blog = BlogArticleFactory()
+        comments = BlogArticleCommentFactory.create_batch(25, root=blog)
+        expected = [c.id for c in sorted(comments, key=lambda c: (c.created, c.id), reverse=True)]
+
+        received = []
+        url = reverse('comment-list') + '?level=0&pagination=cursor'
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            received.extend(c['id'] for c in res.data['results'])
+            url = res.data['next']
+
+        self.assertListEqual(received, expected)
+
+    def test_cursor_pagination_previous_page(self):
+        blog = BlogArticleFactory()
+        BlogArticleCommentFactory.create_batch(15, root=blog)
+
+        first = self.client.get(reverse('comment-list'), {
+            'level': 0,
+            'pagination': 'cursor'
+        })
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+
+        self.assertEqual(len(second.data['results']), 5)
+        self.assertEqual(second.data['next'], None)
+        self.assertListEqual([c['id'] for c in previous.data['results']],
+                             [c['id'] for c in first.data['results']])
+        self.assertEqual(previous.data['previous'], None)
+
+    def test_cursor_pagination_invalid_cursor(self):
+        res = self.client.get(reverse('comment-list'), {
+            'level': 0,
+            'pagination': 'cursor',
+            'cursor': 'not-a-cursor'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
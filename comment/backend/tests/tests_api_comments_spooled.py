@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from unittest import mock
+
+from celery.result import EagerResult
+from django.test import override_settings, TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory
+from backend.models import Comment
+from backend.serializers import CommentSerializer
+from backend.tasks import get_comments
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, COMMENT_SYNC_LIST_THRESHOLD=0,
+                   COMMENT_RESULT_SPOOL_THRESHOLD=3, COMMENT_EXPORT_CHUNK_SIZE=2)
+class APISpooledCommentsTestCase(TestCase):
+    def setUp(self):
+        super(APISpooledCommentsTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(COMMENT_EXPORT_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.page = PageFactory()
+        root = PageCommentFactory(root=self.page, text='Ünïcödé "quoted"')
+        PageCommentFactory.create_batch(4, parent=root)
+
+    def test_task_returns_manifest(self):
+        task = get_comments.delay({'object_id': self.page.id})
+
+        self.assertEqual(task.result['spooled'], '{0}.json.gz'.format(task.id))
+        self.assertEqual(task.result['rows'], 5)
+        with gzip.open(os.path.join(self.directory, task.result['spooled']), 'rt', encoding='utf-8') as f:
+            body = json.load(f)
+        self.assertEqual(body['task_id'], task.id)
+        self.assertEqual(body['result'], CommentSerializer(Comment.objects.all(), many=True).data)
+
+    def test_failed_spool_leaves_no_file(self):
+        with mock.patch('backend.tasks.JSONStreamWriter.write', side_effect=RuntimeError):
+            task = get_comments.delay({'object_id': self.page.id})
+
+        self.assertIsInstance(task.result, RuntimeError)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(COMMENT_RESULT_SPOOL_THRESHOLD=5)
+    def test_small_result_is_not_spooled(self):
+        task = get_comments.delay({'object_id': self.page.id})
+
+        self.assertEqual(len(task.result), 5)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_stream_decompressed(self):
+        res = self.client.get(reverse('comment-list'), {'object_id': self.page.id})
+
+        body = json.loads(b''.join(res.streaming_content).decode())
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(body['status'], 'SUCCESS')
+        self.assertEqual(len(body['result']), 5)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_stream_gzip(self):
+        res = self.client.get(reverse('comment-list'), {'object_id': self.page.id},
+                              HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        # Decoded the way HTTP clients do, which stop after the first gzip member.
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = json.loads(decoder.decompress(b''.join(res.streaming_content)).decode())
+        self.assertTrue(decoder.eof)
+        self.assertEqual(decoder.unused_data, b'')
+        self.assertEqual(body['status'], 'SUCCESS')
+        self.assertEqual(len(body['result']), 5)
+        self.assertEqual(body['result'][0]['text'], 'Ünïcödé "quoted"')
+
+    def test_stream_gzip_refused(self):
+        res = self.client.get(reverse('comment-list'), {'object_id': self.page.id},
+                              HTTP_ACCEPT_ENCODING='gzip;q=0')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(len(json.loads(b''.join(res.streaming_content).decode())['result']), 5)
+
+    def test_fetched_result_is_gone(self):
+        task = get_comments.delay({'object_id': self.page.id})
+        polled = EagerResult(task.id, task.result, 'SUCCESS')
+
+        with mock.patch('backend.views.AsyncResult', return_value=polled):
+            first = self.client.get(reverse('comment-list'), {'task_id': task.id})
+            b''.join(first.streaming_content)
+            second = self.client.get(reverse('comment-list'), {'task_id': task.id})
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_410_GONE)
@@ -0,0 +1,65 @@
+from django.test import override_settings, TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class APISyncListCommentsTestCase(TestCase):
+    def setUp(self):
+        super(APISyncListCommentsTestCase, self).setUp()
+        self.page = PageFactory()
+        for root in PageCommentFactory.create_batch(5, root=self.page):
+            parent = root
+            for _ in range(3):
+                parent = PageCommentFactory(parent=parent)
+
+    @override_settings(COMMENT_SYNC_LIST_THRESHOLD=20)
+    def test_small_thread_served_inline(self):
+        res = self.client.get(reverse('comment-list'), {
+            'object_id': self.page.id
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(res.data['task_id'], None)
+        self.assertEqual(res.data['status'], 'SUCCESS')
+        self.assertEqual(len(res.data['result']), 20)
+
+    @override_settings(COMMENT_SYNC_LIST_THRESHOLD=19)
+    def test_large_thread_goes_through_task(self):
+        res = self.client.get(reverse('comment-list'), {
+            'object_id': self.page.id
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertNotEqual(res.data['task_id'], None)
+        self.assertEqual(res.data['status'], 'SUCCESS')
+        self.assertEqual(len(res.data['result']), 20)
+
+    @override_settings(COMMENT_SYNC_LIST_THRESHOLD=0)
+    def test_disabled_threshold_goes_through_task(self):
+        res = self.client.get(reverse('comment-list'), {
+            'object_id': self.page.id
+        })
+
+        self.assertNotEqual(res.data['task_id'], None)
+        self.assertEqual(len(res.data['result']), 20)
+
+    @override_settings(COMMENT_SYNC_LIST_THRESHOLD=20)
+    def test_inline_and_task_results_are_equal(self):
+        inline = self.client.get(reverse('comment-list'), {'object_id': self.page.id})
+        with self.settings(COMMENT_SYNC_LIST_THRESHOLD=0):
+            delayed = self.client.get(reverse('comment-list'), {'object_id': self.page.id})
+
+        self.assertListEqual(inline.data['result'], delayed.data['result'])
+
+    def test_subtree_with_invalid_parent_is_empty(self):
+        res = self.client.get(reverse('comment-list'), {
+            'parent': 'not-an-id'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['result'], [])
@@ -0,0 +1,115 @@
+from django.db import connection
+from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory
+from backend.trees import build_comment_tree
+
+
+class BuildCommentTreeTestCase(TestCase):
+    def rows(self):
+        return [
+            {'id': 1, 'parent': None, 'level': 0},
+            {'id': 2, 'parent': 1, 'level': 1},
+            {'id': 3, 'parent': 2, 'level': 2},
+            {'id': 4, 'parent': 1, 'level': 1},
+            {'id': 5, 'parent': None, 'level': 0},
+        ]
+
+    def test_nests_children(self):
+        top = build_comment_tree(self.rows())
+
+        self.assertEqual([n['id'] for n in top['children']], [1, 5])
+        self.assertEqual([n['id'] for n in top['children'][0]['children']], [2, 4])
+        self.assertEqual(top['children'][0]['children'][0]['children'][0]['id'], 3)
+        self.assertEqual(top['more_replies'], 0)
+
+    def test_max_depth(self):
+        top = build_comment_tree(self.rows(), max_depth=1)
+
+        child = top['children'][0]['children'][0]
+        self.assertEqual(child['children'], [])
+        self.assertEqual(child['more_replies'], 1)
+
+    def test_max_children(self):
+        top = build_comment_tree(self.rows(), max_children=1)
+
+        self.assertEqual([n['id'] for n in top['children']], [1])
+        self.assertEqual(top['more_replies'], 1)
+        self.assertEqual([n['id'] for n in top['children'][0]['children']], [2])
+        self.assertEqual(top['children'][0]['more_replies'], 1)
+
+
+@override_settings(COMMENT_TREE_MAX_DEPTH=None, COMMENT_TREE_MAX_CHILDREN=None)
+class APICommentTreeTestCase(TestCase):
+    def setUp(self):
+        super(APICommentTreeTestCase, self).setUp()
+        self.page = PageFactory()
+        self.root = PageCommentFactory(root=self.page)
+        self.children = PageCommentFactory.create_batch(3, parent=self.root)
+        self.grandchild = PageCommentFactory(parent=self.children[0])
+        PageCommentFactory()
+
+    def get_tree(self, **params):
+        return self.client.get(reverse('comment-tree'), params)
+
+    def test_tree_for_object(self):
+        res = self.get_tree(object_id=self.page.id)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+        root = res.data['results'][0]
+        self.assertEqual(root['id'], self.root.id)
+        self.assertEqual([n['id'] for n in root['children']], [c.id for c in self.children])
+        self.assertEqual(root['children'][0]['children'][0]['id'], self.grandchild.id)
+
+    def test_tree_for_parent(self):
+        res = self.get_tree(parent=self.root.id)
+
+        self.assertEqual([n['id'] for n in res.data['results']], [c.id for c in self.children])
+        self.assertEqual(res.data['results'][0]['children'][0]['id'], self.grandchild.id)
+
+    def test_truncation(self):
+        res = self.get_tree(object_id=self.page.id, max_depth=1, max_children_per_node=2)
+
+        root = res.data['results'][0]
+        self.assertEqual(len(root['children']), 2)
+        self.assertEqual(root['more_replies'], 1)
+        self.assertEqual(root['children'][0]['children'], [])
+        self.assertEqual(root['children'][0]['more_replies'], 1)
+
+    @override_settings(COMMENT_TREE_MAX_CHILDREN=1)
+    def test_limits_capped_by_settings(self):
+        res = self.get_tree(object_id=self.page.id, max_children_per_node=50)
+
+        self.assertEqual(len(res.data['results'][0]['children']), 1)
+
+    def test_top_level_cut(self):
+        PageCommentFactory.create_batch(3, root=self.page)
+
+        res = self.get_tree(object_id=self.page.id, max_children_per_node=2)
+
+        self.assertEqual([n['id'] for n in res.data['results']][:1], [self.root.id])
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertEqual(res.data['more_replies'], 2)
+        self.assertEqual(len(res.data['results'][0]['children']), 2)
+        self.assertEqual(res.data['results'][0]['more_replies'], 1)
+
+    def test_replies_cut_in_sql(self):
+        PageCommentFactory.create_batch(20, parent=self.root)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.get_tree(parent=self.root.id, max_children_per_node=2)
+
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertEqual(res.data['more_replies'], 21)
+        self.assertEqual(res.data['results'][0]['children'][0]['id'], self.grandchild.id)
+        self.assertTrue(any('LIMIT 3' in query['sql'] for query in queries))
+
+    def test_invalid_params(self):
+        self.assertEqual(self.get_tree().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_tree(object_id=self.page.id, max_depth=-1).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_tree(parent='nope').data['results'], [])
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from celery.exceptions import TimeoutError
+from django.test import override_settings, TestCase
+from redis.exceptions import ConnectionError
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.tasks import create_import_file, get_comments, push_task_state, sweep_export_files
+
+
+@override_settings(COMMENT_TASK_MAX_WAIT=5)
+class APITaskWaitTestCase(TestCase):
+    def get(self, name, params, task):
+        with mock.patch('backend.views.AsyncResult', return_value=task):
+            return self.client.get(reverse(name), params)
+
+    def test_waits_for_pending_task(self):
+        task = mock.Mock(id='abc', status='PENDING', result=None)
+        task.ready.return_value = False
+        task.get.side_effect = TimeoutError
+
+        res = self.get('comment-list', {'task_id': 'abc', 'wait': '2.5'}, task)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], 'PENDING')
+        task.get.assert_called_once_with(timeout=2.5, propagate=False)
+
+    def test_wait_is_capped(self):
+        task = mock.Mock(id='abc', status='SUCCESS', result=[])
+        task.ready.return_value = False
+
+        self.get('comment-list', {'task_id': 'abc', 'wait': '600'}, task)
+
+        task.get.assert_called_once_with(timeout=5, propagate=False)
+
+    def test_no_wait_for_finished_task(self):
+        task = mock.Mock(id='abc', status='PROGRESS', result={'exported': 1})
+        task.ready.return_value = True
+
+        res = self.get('comment-download', {'task_id': 'abc', 'wait': '3'}, task)
+
+        self.assertEqual(res.data['progress'], {'exported': 1})
+        task.get.assert_not_called()
+
+    def test_invalid_wait(self):
+        for value in ('-1', 'soon', 'inf'):
+            res = self.get('comment-list', {'task_id': 'abc', 'wait': value}, mock.Mock())
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, value)
+            self.assertIn('wait', res.data)
+
+
+class PushTaskStateTestCase(TestCase):
+    def sender(self, task, is_eager=False):
+        return SimpleNamespace(name=task.name, request=SimpleNamespace(is_eager=is_eager))
+
+    @mock.patch('backend.tasks.notification_task')
+    def test_pushes_comment_tasks(self, notification_task):
+        push_task_state(sender=self.sender(get_comments), task_id='abc', state='SUCCESS')
+        push_task_state(sender=self.sender(create_import_file), task_id='def', state='FAILURE')
+
+        notification_task.assert_has_calls([mock.call('abc', 'SUCCESS'), mock.call('def', 'FAILURE')])
+
+    @mock.patch('backend.tasks.notification_task')
+    def test_skips_eager_and_other_tasks(self, notification_task):
+        push_task_state(sender=self.sender(get_comments, is_eager=True), task_id='abc', state='SUCCESS')
+        push_task_state(sender=self.sender(sweep_export_files), task_id='def', state='SUCCESS')
+
+        notification_task.assert_not_called()
+
+    @mock.patch('backend.tasks.notification_task', side_effect=ConnectionError)
+    def test_redis_errors_are_ignored(self, notification_task):
+        push_task_state(sender=self.sender(get_comments), task_id='abc', state='SUCCESS')
+
+        notification_task.assert_called_once_with('abc', 'SUCCESS')
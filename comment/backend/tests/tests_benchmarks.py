@@ -0,0 +1,57 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def test_ancestors_index_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', 'ancestors_index', rows=2000, repeat=2, stdout=out, stderr=StringIO())
+
+        result = json.loads(out.getvalue())['ancestors_index']
+
+        self.assertEqual(result['rows'], 2000)
+        self.assertEqual(result['gin']['runs'], 2)
+        self.assertTrue(all(k in result for k in ('seq_scan', 'btree', 'gin')), result)
+
+    def test_comment_serialization_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', 'comment_serialization', rows=50, repeat=2, stdout=out, stderr=StringIO())
+
+        result = json.loads(out.getvalue())['comment_serialization']
+
+        self.assertEqual(result['rows'], 50)
+        self.assertTrue(result['identical'])
+        self.assertEqual(result['values_list']['runs'], 2)
+
+    def test_history_revisions_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', 'history_revisions', rows=100, repeat=2, stdout=out, stderr=StringIO())
+
+        result = json.loads(out.getvalue())['history_revisions']
+
+        self.assertEqual(result['revisions'], 100)
+        self.assertTrue(result['identical'])
+        self.assertLess(result['text_chars']['compacted'], result['text_chars']['full'])
+        self.assertEqual(result['compacted']['runs'], 2)
+
+    def test_api_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', 'api', rows=400, repeat=2, stdout=out, stderr=StringIO())
+
+        results = json.loads(out.getvalue())
+        result = results['api']
+
+        self.assertEqual(results['meta']['rows'], 400)
+        self.assertEqual(result['shape'], 'shallow')
+        for name in ('list_level', 'list_object', 'list_parent', 'tree', 'download',
+                     'history', 'create', 'update', 'delete'):
+            self.assertEqual(result[name]['runs'], 2, name)
+            self.assertIn('queries', result[name])
+            self.assertIn('peak_memory_kb', result[name])
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'unknown', stdout=StringIO(), stderr=StringIO())
@@ -1,3 +1,6 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.db import IntegrityError
 from django.test import TestCase
 
@@ -118,3 +121,41 @@ class CommentTestCase(TestCase):
         self.assertEqual(comment.root, page1, comment)
         self.assertEqual(comment.parent, root_comment, comment)
         self.assertEqual(comment.root, comment.parent.root, comment)
+
+
+class CommentReplyCountsTestCase(TestCase):
+    def setUp(self):
+        super(CommentReplyCountsTestCase, self).setUp()
+        self.root = PageCommentFactory()
+        self.child1 = PageCommentFactory(parent=self.root)
+        self.child2 = PageCommentFactory(parent=self.root)
+        self.grandchild = PageCommentFactory(parent=self.child1)
+
+    def counts(self, comment):
+        comment.refresh_from_db()
+        return comment.children_count, comment.descendant_count
+
+    def test_counts_after_create(self):
+        self.assertEqual(self.counts(self.root), (2, 3))
+        self.assertEqual(self.counts(self.child1), (1, 1))
+        self.assertEqual(self.counts(self.grandchild), (0, 0))
+
+    def test_counts_after_delete(self):
+        self.grandchild.delete()
+
+        self.assertEqual(self.counts(self.root), (2, 2))
+        self.assertEqual(self.counts(self.child1), (0, 0))
+
+    def test_counts_after_subtree_delete(self):
+        self.child1.delete()
+
+        self.assertEqual(self.counts(self.root), (1, 1))
+
+    def test_repair(self):
+        Comment.objects.filter(id=self.root.id).update(children_count=7, descendant_count=0)
+
+        out = StringIO()
+        call_command('repair_reply_counts', stdout=out)
+
+        self.assertEqual(self.counts(self.root), (2, 3))
+        self.assertIn('Repaired 1 comments', out.getvalue())
@@ -0,0 +1,95 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageFactory, PageCommentFactory
+from backend.models import Comment
+
+
+class CommentPathTestCase(TestCase):
+    def test_root_comment_path(self):
+        root = PageCommentFactory()
+
+        self.assertEqual(root.path, str(root.id).zfill(10), root)
+
+    def test_nested_comment_path(self):
+        root = PageCommentFactory()
+        children1 = PageCommentFactory(parent=root)
+        children11 = PageCommentFactory(parent=children1)
+
+        self.assertEqual(children11.path, '.'.join(str(i).zfill(10) for i in
+                                                   [root.id, children1.id, children11.id]), children11)
+
+    def test_path_order_is_depth_first(self):
+        page = PageFactory()
+        root1 = PageCommentFactory(root=page)
+        root2 = PageCommentFactory(root=page)
+        children1 = PageCommentFactory(parent=root1)
+        children2 = PageCommentFactory(parent=root2)
+        children11 = PageCommentFactory(parent=children1)
+
+        self.assertListEqual(list(Comment.objects.filter(object_id=page.id).order_by('path')),
+                             [root1, children1, children11, root2, children2])
+
+    def test_backfill_paths(self):
+        root = PageCommentFactory()
+        children1 = PageCommentFactory(parent=root)
+        children11 = PageCommentFactory(parent=children1)
+        expected = dict(Comment.objects.values_list('id', 'path'))
+        Comment.objects.update(path='')
+
+        call_command('backfill_comment_paths', batch_size=2, stdout=StringIO())
+
+        self.assertDictEqual(dict(Comment.objects.values_list('id', 'path')), expected)
+
+    def test_child_of_not_backfilled_parent_has_no_path(self):
+        root = PageCommentFactory()
+        Comment.objects.update(path='')
+        root.refresh_from_db()
+
+        children1 = PageCommentFactory(parent=root)
+
+        self.assertEqual(children1.path, '', children1)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class APICommentPathTestCase(TestCase):
+    def test_subtree_in_display_order(self):
+        page = PageFactory()
+        root = PageCommentFactory(root=page)
+        children1 = PageCommentFactory(parent=root)
+        children2 = PageCommentFactory(parent=root)
+        children11 = PageCommentFactory(parent=children1)
+        PageCommentFactory(root=page)
+
+        res = self.client.get(reverse('comment-list'), {
+            'parent': root.id,
+            'ordering': 'path'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertListEqual([c['id'] for c in res.data['result']],
+                             [children1.id, children11.id, children2.id])
+        self.assertTrue(all('path' not in c for c in res.data['result']))
+
+    def test_subtree_of_not_backfilled_parent(self):
+        root = PageCommentFactory()
+        children1 = PageCommentFactory(parent=root)
+        PageCommentFactory(parent=children1)
+        Comment.objects.update(path='')
+
+        res = self.client.get(reverse('comment-list'), {
+            'parent': root.id
+        })
+
+        self.assertEqual(len(res.data['result']), 2)
+
+    def test_subtree_of_missing_parent(self):
+        res = self.client.get(reverse('comment-list'), {
+            'parent': 100500
+        })
+
+        self.assertEqual(res.data['result'], [])
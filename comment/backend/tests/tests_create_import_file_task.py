@@ -1,5 +1,7 @@
 import json
 import os
+import shutil
+import tempfile
 from unittest import mock
 
 from django.test import TestCase, override_settings
@@ -12,51 +14,56 @@ from backend.tasks import create_import_file
 class CreateImportFileTaskTestCase(TestCase):
     def setUp(self):
         super(CreateImportFileTaskTestCase, self).setUp()
-        self.QUERY_WITH_LEVEL = 'SELECT "backend_comment"."id", "backend_comment"."user_id", "backend_comment"."created", "backend_comment"."content_type_id", "backend_comment"."object_id", "backend_comment"."parent_id", "backend_comment"."level", "backend_comment"."ancestors", "backend_comment"."text" FROM "backend_comment" WHERE "backend_comment"."level" = 0 ORDER BY "backend_comment"."level" ASC, "backend_comment"."created" DESC'
-        self.QUERY_WITH_CONTENT_TYPE = 'SELECT "backend_comment"."id", "backend_comment"."user_id", "backend_comment"."created", "backend_comment"."content_type_id", "backend_comment"."object_id", "backend_comment"."parent_id", "backend_comment"."level", "backend_comment"."ancestors", "backend_comment"."text" FROM "backend_comment" WHERE ("backend_comment"."content_type_id" = {0} AND "backend_comment"."object_id" = {1}) ORDER BY "backend_comment"."level" ASC, "backend_comment"."created" DESC'
+        self.SPEC_WITH_LEVEL = {'level': 0}
 
+    @mock.patch('backend.exporters.os.replace')
     @mock.patch('builtins.open')
-    def test_return_is_dict_with_needed_fields(self, open):
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL)
+    def test_return_is_dict_with_needed_fields(self, open, replace):
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL)
 
         self.assertIsInstance(task.result, dict, task.result)
         self.assertTrue(all(map(lambda f: f in task.result, ('filename', 'media_type', 'format'))), task.result)
 
+    @mock.patch('backend.exporters.os.replace')
     @mock.patch('builtins.open')
-    def test_return_correctly_filename(self, open):
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL)
+    def test_return_correctly_filename(self, open, replace):
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL)
         expected_filename = '{0}.xml'.format(task.id)
 
         self.assertEqual(task.result['filename'], expected_filename, task.result['filename'])
-        open.assert_called_with('/tmp/{0}'.format(expected_filename), 'w')
+        open.assert_called_with('/tmp/{0}.tmp'.format(expected_filename), 'w')
+        replace.assert_called_with('/tmp/{0}.tmp'.format(expected_filename), '/tmp/{0}'.format(expected_filename))
 
+    @mock.patch('backend.exporters.os.replace')
     @mock.patch('builtins.open')
-    def test_return_correctly_format_and_media_type_for_xml(self, open):
+    def test_return_correctly_format_and_media_type_for_xml(self, open, replace):
         expected_format = 'xml'
         expected_media_type = 'application/xml'
 
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL, 'xml')
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL, 'xml')
 
         self.assertEqual(task.result['format'], expected_format, task.result['format'])
         self.assertEqual(task.result['media_type'], expected_media_type, task.result['media_type'])
 
+    @mock.patch('backend.exporters.os.replace')
     @mock.patch('builtins.open')
-    def test_return_correctly_format_and_media_type_for_json(self, open):
+    def test_return_correctly_format_and_media_type_for_json(self, open, replace):
         expected_format = 'json'
         expected_media_type = 'application/json'
 
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL, 'json')
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL, 'json')
 
         self.assertEqual(task.result['format'], expected_format, task.result['format'])
         self.assertEqual(task.result['media_type'], expected_media_type, task.result['media_type'])
 
+    @mock.patch('backend.exporters.os.replace')
     @mock.patch('builtins.open')
-    def test_failed_with_unsupported_format(self, open):
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL, 'unsupported_format')
+    def test_failed_with_unsupported_format(self, open, replace):
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL, 'unsupported_format')
         self.assertIsInstance(task.result, NotImplementedError)
 
     def test_file_created(self):
-        task = create_import_file.delay(self.QUERY_WITH_LEVEL)
+        task = create_import_file.delay(self.SPEC_WITH_LEVEL)
         expected_filepath = '/tmp/{0}'.format(task.result['filename'])
 
         self.assertTrue(os.path.exists(expected_filepath), 'Path does not exist')
@@ -64,6 +71,18 @@ class CreateImportFileTaskTestCase(TestCase):
 
         os.remove(expected_filepath)
 
+    def test_failed_export_leaves_no_file(self):
+        PageCommentFactory()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with override_settings(COMMENT_EXPORT_DIR=directory), \
+                mock.patch('backend.exporters.XMLStreamWriter.write', side_effect=RuntimeError):
+            task = create_import_file.delay(self.SPEC_WITH_LEVEL)
+
+        self.assertIsInstance(task.result, RuntimeError)
+        self.assertEqual(os.listdir(directory), [])
+
     def test_xml_file_have_valid_data(self):
         user = UserFactory()
         page = PageFactory(user=user)
@@ -73,11 +92,11 @@ class CreateImportFileTaskTestCase(TestCase):
         children1 = PageCommentFactory(user=user, parent=root)
         children1_created_date = children1.created.isoformat().replace('+00:00', 'Z')
 
-        expected_xml = '''<?xml version="1.0" encoding="utf-8"?>\n<root><list-item><id>{root.id}</id><user_id>{root.user.id}</user_id><ancestors></ancestors><created>{root_created_date}</created><object_id>{page.id}</object_id><level>0</level><text>{root.text}</text><user>{root.user.id}</user><content_type>10</content_type><parent></parent></list-item><list-item><id>{children1.id}</id><user_id>{children1.user.id}</user_id><ancestors><list-item>{children1.parent.id}</list-item></ancestors><created>{children1_created_date}</created><object_id>{page.id}</object_id><level>1</level><text>{children1.text}</text><user>{children1.user.id}</user><content_type>10</content_type><parent>{children1.parent.id}</parent></list-item></root>'''.format(
+        expected_xml = '''<?xml version="1.0" encoding="utf-8"?>\n<root><list-item><id>{root.id}</id><user_id>{root.user.id}</user_id><ancestors></ancestors><created>{root_created_date}</created><object_id>{page.id}</object_id><level>0</level><text>{root.text}</text><children_count>1</children_count><descendant_count>1</descendant_count><user>{root.user.id}</user><content_type>10</content_type><parent></parent></list-item><list-item><id>{children1.id}</id><user_id>{children1.user.id}</user_id><ancestors><list-item>{children1.parent.id}</list-item></ancestors><created>{children1_created_date}</created><object_id>{page.id}</object_id><level>1</level><text>{children1.text}</text><children_count>0</children_count><descendant_count>0</descendant_count><user>{children1.user.id}</user><content_type>10</content_type><parent>{children1.parent.id}</parent></list-item></root>'''.format(
             page=page, root=root, children1=children1, root_created_date=root_created_date,
             children1_created_date=children1_created_date)
 
-        task = create_import_file.delay(self.QUERY_WITH_CONTENT_TYPE.format(10, page.id))
+        task = create_import_file.delay({'object_id': page.id})
         filepath = '/tmp/{0}'.format(task.result['filename'])
 
         with open(filepath, 'r') as f:
@@ -103,6 +122,8 @@ class CreateImportFileTaskTestCase(TestCase):
                 'object_id': root.root.id,
                 'level': root.level,
                 'text': root.text,
+                'children_count': 1,
+                'descendant_count': 1,
                 'user': root.user.id,
                 'content_type': 10,
                 'parent': None
@@ -115,6 +136,8 @@ class CreateImportFileTaskTestCase(TestCase):
                 'object_id': children1.root.id,
                 'level': children1.level,
                 'text': children1.text,
+                'children_count': 0,
+                'descendant_count': 0,
                 'user': children1.user.id,
                 'content_type': 10,
                 'parent': children1.parent.id
@@ -122,7 +145,7 @@ class CreateImportFileTaskTestCase(TestCase):
         ]
         expected_json = json.dumps(expected_data)
 
-        task = create_import_file.delay(self.QUERY_WITH_CONTENT_TYPE.format(10, page.id), 'json')
+        task = create_import_file.delay({'object_id': page.id}, 'json')
         filepath = '/tmp/{0}'.format(task.result['filename'])
 
         with open(filepath, 'r') as f:
@@ -0,0 +1,152 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from redis.exceptions import ConnectionError
+
+from backend.factories import PageCommentFactory, UserFactory
+from backend.history import HISTORY_FAILED_KEY, HISTORY_PROCESSING_KEY, HISTORY_QUEUE_KEY, \
+    drain_history, encode_history, get_history_backlog
+from backend.models import Comment
+
+
+def run_on_commit(func):
+    func()
+
+
+@override_settings(COMMENT_DEFERRED_HISTORY=True, COMMENT_NOTIFICATIONS_ENABLED=False)
+@mock.patch('backend.history.get_redis')
+@mock.patch('backend.history.transaction.on_commit', side_effect=run_on_commit)
+class DeferredHistoryTestCase(TestCase):
+    def queued(self, get_redis):
+        return [record.encode() for call in get_redis.return_value.rpush.call_args_list
+                for record in call[0][1:]]
+
+    def drain(self, get_redis, processing=(), batches=()):
+        connection = get_redis.return_value
+        connection.lrange.return_value = list(processing)
+        connection.lock.return_value.acquire.return_value = True
+        take = connection.register_script.return_value
+        take.side_effect = [list(batch) for batch in batches] + [[]]
+        return drain_history(Comment.history.model, 1000)
+
+    def test_history_is_queued_after_commit(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        comment.text = 'changed'
+        comment.save()
+
+        self.assertFalse(Comment.history.exists())
+        self.assertEqual(get_redis.return_value.rpush.call_count, 2)
+        self.assertEqual(get_redis.return_value.rpush.call_args[0][0], HISTORY_QUEUE_KEY)
+
+    def test_drain_writes_queued_history(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        reply = PageCommentFactory(parent=comment)
+        reply.text = 'changed'
+        reply.save()
+        reply_id = reply.id
+        reply.delete()
+
+        written = self.drain(get_redis, batches=[self.queued(get_redis)])
+
+        self.assertEqual(written, 4)
+        history = Comment.history.filter(id=reply_id).order_by('history_date')
+        self.assertEqual([h.history_type for h in history], ['+', '~', '-'])
+        self.assertEqual(history[1].text, 'changed')
+        self.assertEqual(history[1].ancestors, [comment.id])
+        self.assertEqual(history[1].history_user_id, reply.user_id)
+        get_redis.return_value.delete.assert_called_with(HISTORY_PROCESSING_KEY)
+        get_redis.return_value.lock.return_value.release.assert_called_once_with()
+
+    def test_history_date_keeps_microseconds(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        history_date = comment._history_date = now().replace(microsecond=123456)
+        comment.text = 'changed'
+        comment.save()
+
+        self.drain(get_redis, batches=[self.queued(get_redis)])
+
+        self.assertEqual(comment.history.get(history_type='~').history_date, history_date)
+
+    def test_interrupted_batch_is_written_once(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        comment.text = 'changed'
+        comment.save()
+        records = self.queued(get_redis)
+        self.drain(get_redis, batches=[records[:1]])
+
+        written = self.drain(get_redis, processing=records)
+
+        self.assertEqual(written, 1)
+        self.assertEqual(sorted(comment.history.values_list('history_type', flat=True)), ['+', '~'])
+
+    def test_deleted_user_is_left_out(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        comment._history_user = UserFactory()
+        comment.text = 'changed'
+        comment.save()
+        records = self.queued(get_redis)
+        self.assertEqual(json.loads(records[1].decode())['history_user_id'], comment._history_user.id)
+        comment._history_user.delete()
+
+        self.assertEqual(self.drain(get_redis, batches=[records]), 2)
+        self.assertIsNone(comment.history.get(history_type='~').history_user_id)
+
+    def test_failing_record_is_set_aside(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+        comment.text = 'changed'
+        comment.save()
+        records = self.queued(get_redis) + [b'{"unknown": 1}']
+
+        with self.assertLogs('backend.history', 'WARNING'):
+            written = self.drain(get_redis, batches=[records])
+
+        self.assertEqual(written, 2)
+        self.assertEqual(comment.history.count(), 2)
+        get_redis.return_value.rpush.assert_called_with(HISTORY_FAILED_KEY, records[2])
+        get_redis.return_value.delete.assert_called_with(HISTORY_PROCESSING_KEY)
+
+    def test_one_worker_drains_at_a_time(self, on_commit, get_redis):
+        get_redis.return_value.lock.return_value.acquire.return_value = False
+
+        self.assertIsNone(drain_history(Comment.history.model, 1000))
+        get_redis.return_value.register_script.return_value.assert_not_called()
+
+    def test_written_inline_without_redis(self, on_commit, get_redis):
+        get_redis.return_value.rpush.side_effect = ConnectionError
+
+        with self.assertLogs('backend.history', 'WARNING'):
+            comment = PageCommentFactory()
+
+        self.assertEqual(comment.history.get().history_type, '+')
+
+    @override_settings(COMMENT_DEFERRED_HISTORY=False)
+    def test_inline_by_default(self, on_commit, get_redis):
+        comment = PageCommentFactory()
+
+        self.assertEqual(comment.history.count(), 1)
+        get_redis.assert_not_called()
+
+
+class HistoryBacklogTestCase(TestCase):
+    @mock.patch('backend.history.get_redis')
+    def test_backlog(self, get_redis):
+        oldest = encode_history({'history_date': now() - timedelta(seconds=30)}).encode()
+        get_redis.return_value.pipeline.return_value.execute.return_value = [2, 5, oldest, b'{}']
+
+        backlog, lag = get_history_backlog()
+
+        self.assertEqual(backlog, 7)
+        self.assertAlmostEqual(lag, 30, delta=5)
+
+    @override_settings(COMMENT_METRICS_ENABLED=True, COMMENT_DEFERRED_HISTORY=True)
+    @mock.patch('backend.metrics.get_redis')
+    @mock.patch('backend.views.get_history_backlog', return_value=(7, 1.5))
+    def test_metrics(self, get_history_backlog, get_redis):
+        content = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('# TYPE comment_history_backlog gauge\ncomment_history_backlog 7\n', content)
+        self.assertIn('comment_history_lag_seconds 1.5\n', content)
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from time import time
+from unittest import mock
+
+from celery.result import EagerResult
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings, TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.cache import get_export_cache_key, get_export_generation, invalidate_exports
+from backend.exporters import sweep_export_dir
+from backend.factories import UserFactory, PageCommentFactory
+from backend.tasks import create_import_file
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class APIExportCacheTestCase(TestCase):
+    def setUp(self):
+        super(APIExportCacheTestCase, self).setUp()
+        cache.clear()
+        self.user = UserFactory()
+        PageCommentFactory.create_batch(3, user=self.user)
+
+    def download(self, **params):
+        params.setdefault('user', self.user.id)
+        return self.client.get(reverse('comment-download'), params)
+
+    def test_identical_exports_share_task(self):
+        with mock.patch.object(create_import_file, 'apply_async', wraps=create_import_file.apply_async) as apply:
+            first = self.download()
+            second = self.download()
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(apply.call_count, 1)
+        self.assertEqual(first['Content-Disposition'], second['Content-Disposition'])
+
+    def test_different_filters_do_not_share_task(self):
+        with mock.patch.object(create_import_file, 'apply_async', wraps=create_import_file.apply_async) as apply:
+            self.download()
+            self.download(created_gte='2017-08-26')
+
+        self.assertEqual(apply.call_count, 2)
+
+    def test_comment_write_invalidates_exports(self):
+        generation = get_export_generation()
+        with mock.patch.object(create_import_file, 'apply_async', wraps=create_import_file.apply_async) as apply:
+            self.download()
+            PageCommentFactory(user=self.user)
+            self.download()
+
+        self.assertNotEqual(get_export_generation(), generation)
+        self.assertEqual(apply.call_count, 2)
+
+    def test_generation_moves_on_again_after_commit(self):
+        callbacks = []
+        generation = get_export_generation()
+        with mock.patch('backend.cache.transaction.on_commit', side_effect=callbacks.append):
+            invalidate_exports()
+        key = get_export_cache_key({}, 'xml')
+        callbacks[0]()
+
+        self.assertEqual(get_export_generation(), generation + 2)
+        self.assertNotEqual(get_export_cache_key({}, 'xml'), key)
+
+    def test_removed_file_is_exported_again(self):
+        with mock.patch.object(create_import_file, 'apply_async', wraps=create_import_file.apply_async) as apply:
+            first = self.download()
+            os.remove('/tmp/' + first['Content-Disposition'].split('=')[1])
+            second = self.download()
+
+        self.assertEqual(apply.call_count, 2)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+
+    @override_settings(COMMENT_EXPORT_CHUNK_SIZE=1)
+    def test_pending_export_is_kept_alive_by_its_task(self):
+        with mock.patch('backend.views.cache.add', wraps=cache.add) as add, \
+                mock.patch('backend.tasks.cache.set', wraps=cache.set) as set_:
+            self.download()
+
+        self.assertEqual(add.call_args[0][2], settings.COMMENT_EXPORT_PENDING_TTL)
+        timeouts = [call[0][2] for call in set_.call_args_list]
+        self.assertEqual(timeouts, [settings.COMMENT_EXPORT_PENDING_TTL] * 3 + [settings.COMMENT_EXPORT_TTL])
+
+    def test_lost_export_is_not_joined_after_pending_ttl(self):
+        def pending(args, task_id):
+            return EagerResult(task_id, None, 'PENDING')
+
+        with mock.patch.object(create_import_file, 'apply_async', side_effect=pending) as apply:
+            self.download()
+            # The worker died; nothing refreshes the in-flight entry.
+            cache.delete(get_export_cache_key({'user': str(self.user.id)}, 'xml'))
+            self.download()
+
+        self.assertEqual(apply.call_count, 2)
+        self.assertTrue(create_import_file.acks_late)
+        self.assertTrue(create_import_file.reject_on_worker_lost)
+
+    def test_cache_key_ignores_spec_key_order(self):
+        self.assertEqual(get_export_cache_key({'user': '1', 'level': '0'}, 'xml'),
+                         get_export_cache_key({'level': '0', 'user': '1'}, 'xml'))
+        self.assertNotEqual(get_export_cache_key({'level': '0'}, 'xml'),
+                            get_export_cache_key({'level': '0'}, 'json'))
+
+
+class SweepExportDirTestCase(TestCase):
+    def setUp(self):
+        super(SweepExportDirTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(SweepExportDirTestCase, self).tearDown()
+
+    def make_file(self, name, size, age):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+        os.utime(path, (time() - age, time() - age))
+        return path
+
+    def test_expired_files_removed(self):
+        old = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a001.xml', 10, 7200)
+        new = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a002.json', 10, 10)
+
+        self.assertEqual(sweep_export_dir(self.directory, 3600, 1000), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_oldest_files_removed_over_size_limit(self):
+        oldest = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a001.xml', 60, 30)
+        older = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a002.xml', 60, 20)
+        newest = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a003.xml', 60, 10)
+
+        self.assertEqual(sweep_export_dir(self.directory, 3600, 100), 2)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+
+    def test_abandoned_temporary_files_removed(self):
+        abandoned = self.make_file('0b5f3a5e-2c79-4c1e-9a4e-3b1c4fd0a001.json.gz.tmp', 10, 7200)
+
+        self.assertEqual(sweep_export_dir(self.directory, 3600, 1000), 1)
+        self.assertFalse(os.path.exists(abandoned))
+
+    def test_foreign_files_kept(self):
+        foreign = self.make_file('something-else.xml', 10, 7200)
+
+        self.assertEqual(sweep_export_dir(self.directory, 3600, 0), 0)
+        self.assertTrue(os.path.exists(foreign))
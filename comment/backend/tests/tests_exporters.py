@@ -0,0 +1,54 @@
+from io import StringIO
+
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework_xml.renderers import XMLRenderer
+
+from backend.exporters import get_stream_writer_class, iter_comment_chunks, JSONStreamWriter, XMLStreamWriter
+from backend.factories import PageCommentFactory
+from backend.models import Comment
+from backend.serializers import CommentSerializer
+
+
+class StreamWriterTestCase(TestCase):
+    def setUp(self):
+        super(StreamWriterTestCase, self).setUp()
+        root = PageCommentFactory(text='<b>Root & "quoted"</b>')
+        PageCommentFactory.create_batch(4, parent=root, text='Ünïcödé')
+        self.queryset = Comment.objects.all()
+
+    def export(self, writer_class, chunk_size):
+        stream = StringIO()
+        writer = writer_class(stream)
+        writer.start()
+        for comments in iter_comment_chunks(self.queryset, chunk_size):
+            writer.write(CommentSerializer(comments, many=True).data)
+        writer.finish()
+        return stream.getvalue()
+
+    def test_get_stream_writer_class(self):
+        self.assertIs(get_stream_writer_class(), XMLStreamWriter)
+        self.assertIs(get_stream_writer_class('json'), JSONStreamWriter)
+        with self.assertRaises(NotImplementedError):
+            get_stream_writer_class('unsupported_format')
+
+    def test_chunks_cover_all_rows_in_order(self):
+        ids = [c.id for comments in iter_comment_chunks(self.queryset, 2) for c in comments]
+
+        self.assertListEqual(ids, list(Comment.objects.values_list('id', flat=True)))
+
+    def test_json_stream_equals_rendered_document(self):
+        expected = JSONRenderer().render(CommentSerializer(Comment.objects.all(), many=True).data).decode()
+
+        self.assertEqual(self.export(JSONStreamWriter, 2), expected)
+
+    def test_xml_stream_equals_rendered_document(self):
+        expected = XMLRenderer().render(CommentSerializer(Comment.objects.all(), many=True).data)
+
+        self.assertEqual(self.export(XMLStreamWriter, 2), expected)
+
+    def test_empty_export(self):
+        self.queryset = Comment.objects.filter(level=100)
+
+        self.assertEqual(self.export(JSONStreamWriter, 2), '[]')
+        self.assertEqual(self.export(XMLStreamWriter, 2), XMLRenderer().render([]))
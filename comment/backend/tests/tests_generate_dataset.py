@@ -0,0 +1,57 @@
+import json
+import random
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.db.models import Sum
+from django.test import TestCase
+
+from backend.datasets import generate_thread
+from backend.models import BlogArticle, Comment, CommentSummary, Page
+
+
+class GenerateDatasetCommandTestCase(TestCase):
+    def generate(self, **options):
+        out = StringIO()
+        call_command('generate_dataset', stdout=out, **options)
+        return json.loads(out.getvalue())
+
+    def test_generates_consistent_dataset(self):
+        result = self.generate(users=5, pages=3, articles=2, comments=400, max_depth=4,
+                               fan_out=1.5, seed=1, chunk_size=50)
+
+        self.assertEqual(result['comments'], 400)
+        self.assertEqual(get_user_model().objects.count(), 5)
+        self.assertEqual(Page.objects.count(), 3)
+        self.assertEqual(BlogArticle.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 400)
+        self.assertEqual(Comment.history.count(), 400)
+        self.assertLessEqual(Comment.objects.order_by('-level').first().level, 4)
+        # Counters and summaries were computed in memory; nothing to repair.
+        self.assertEqual(Comment.objects.repair_reply_counts(), 0)
+        self.assertEqual(CommentSummary.objects.aggregate(n=Sum('comment_count'))['n'], 400)
+        for comment in Comment.objects.exclude(parent=None)[:50]:
+            self.assertEqual(comment.ancestors[-1], comment.parent_id)
+            self.assertEqual(comment.level, comment.parent.level + 1)
+            self.assertTrue(comment.path.startswith(comment.parent.path + '.'))
+            self.assertEqual(comment.object_id, comment.parent.object_id)
+
+    def test_without_history(self):
+        self.generate(users=1, pages=1, articles=0, comments=10, history=False)
+
+        self.assertEqual(Comment.history.count(), 0)
+
+    def test_comments_need_objects(self):
+        with self.assertRaises(CommandError):
+            self.generate(users=1, pages=0, articles=0, comments=10)
+
+
+class GenerateThreadTestCase(TestCase):
+    def test_mean_reply_count(self):
+        rng = random.Random(0)
+        for fan_out in (0.2, 1.0, 2.0):
+            # With max_depth 1 only the first comment gets replies.
+            replies = [len(generate_thread(rng, 1, 10 ** 6, 1, fan_out)) - 1 for _ in range(20000)]
+
+            self.assertAlmostEqual(sum(replies) / len(replies), fan_out, delta=fan_out * 0.05)
@@ -1,11 +1,12 @@
 from random import choice
 
-from django.db import ProgrammingError
 from django.test import TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
 
 from backend.factories import PageCommentFactory, PageFactory
+from backend.filters import get_comment_queryset
 from backend.models import Comment
-from backend.serializers import CommentSerializer
+from backend.serializers import CommentSerializer, serialize_comment_rows
 from backend.tasks import get_comments
 
 
@@ -15,9 +16,11 @@ class GetCommentsTaskTestCase(TestCase):
         with self.assertRaises(TypeError):
             get_comments()
 
-    def test_with_invalid_sql_query(self):
-        with self.assertRaises(ProgrammingError):
-            get_comments('What the string is this???')
+    def test_with_invalid_spec(self):
+        PageCommentFactory()
+
+        self.assertListEqual(get_comments({'level': 'What the string is this???'}), [])
+        self.assertListEqual(get_comments({'parent': 'nope'}), [])
 
     def test_with_valid_query_simple_query(self):
         root1 = PageCommentFactory()
@@ -28,16 +31,16 @@ class GetCommentsTaskTestCase(TestCase):
         root2 = PageCommentFactory()
         children2 = PageCommentFactory(parent=root2)
 
-        query = 'SELECT "backend_comment"."id", "backend_comment"."user_id", "backend_comment"."created", "backend_comment"."content_type_id", "backend_comment"."object_id", "backend_comment"."parent_id", "backend_comment"."level", "backend_comment"."ancestors", "backend_comment"."text" FROM "backend_comment" ORDER BY "backend_comment"."level" ASC, "backend_comment"."created" DESC'
+        spec = {}
         expected_qs_orm_analog = Comment.objects.all()
-        comments = get_comments(query)
+        comments = get_comments(spec)
 
         self.assertIsInstance(comments, list, comments)
         self.assertEqual(len(comments), 6)
-        self.assertListEqual(comments, CommentSerializer(Comment.objects.raw(query), many=True).data, comments)
+        self.assertListEqual(comments, CommentSerializer(get_comment_queryset(spec), many=True).data, comments)
         self.assertListEqual(comments, CommentSerializer(expected_qs_orm_analog, many=True).data, comments)
-        self.assertQuerysetEqual(Comment.objects.raw(query), [o.__repr__() for o in expected_qs_orm_analog[:]])
-        self.assertQuerysetEqual(Comment.objects.raw(query),
+        self.assertQuerysetEqual(get_comment_queryset(spec), [o.__repr__() for o in expected_qs_orm_analog[:]])
+        self.assertQuerysetEqual(get_comment_queryset(spec),
                                  [root2.__repr__(),
                                   root1.__repr__(),
                                   children2.__repr__(),
@@ -57,16 +60,15 @@ class GetCommentsTaskTestCase(TestCase):
 
         roots3 = PageCommentFactory.create_batch(10, root=page1)
 
-        query = 'SELECT "backend_comment"."id", "backend_comment"."user_id", "backend_comment"."created", "backend_comment"."content_type_id", "backend_comment"."object_id", "backend_comment"."parent_id", "backend_comment"."level", "backend_comment"."ancestors", "backend_comment"."text" FROM "backend_comment" WHERE ("backend_comment"."object_id" = {0} AND "backend_comment"."content_type_id" = 10 AND "backend_comment"."level" = 0) ORDER BY "backend_comment"."level" ASC, "backend_comment"."created" DESC'.format(
-            page1.id)
+        spec = {'object_id': page1.id, 'level': 0}
         expected_qs_orm_analog = Comment.objects.filter(object_id=page1.id, content_type_id=10, level=0)
-        comments = get_comments(query)
+        comments = get_comments(spec)
 
         self.assertIsInstance(comments, list, comments)
         self.assertEqual(len(comments), 11)
-        self.assertListEqual(comments, CommentSerializer(Comment.objects.raw(query), many=True).data, comments)
+        self.assertListEqual(comments, CommentSerializer(get_comment_queryset(spec), many=True).data, comments)
         self.assertListEqual(comments, CommentSerializer(expected_qs_orm_analog, many=True).data, comments)
-        self.assertQuerysetEqual(Comment.objects.raw(query), [o.__repr__() for o in expected_qs_orm_analog[:]])
+        self.assertQuerysetEqual(get_comment_queryset(spec), [o.__repr__() for o in expected_qs_orm_analog[:]])
 
     def test_with_valid_query_with_ancestors(self):
         page = PageFactory()
@@ -80,14 +82,21 @@ class GetCommentsTaskTestCase(TestCase):
         children2 = PageCommentFactory.create_batch(10, parent=root2)
         children22 = PageCommentFactory.create_batch(5, parent=choice(children2))
 
-        query = 'SELECT "backend_comment"."id", "backend_comment"."user_id", "backend_comment"."created", "backend_comment"."content_type_id", "backend_comment"."object_id", "backend_comment"."parent_id", "backend_comment"."level", "backend_comment"."ancestors", "backend_comment"."text" FROM "backend_comment" WHERE ("backend_comment"."object_id" = {0} AND "backend_comment"."content_type_id" = 10 AND "backend_comment"."ancestors" @> ARRAY[{1}]::integer[]) ORDER BY "backend_comment"."level" ASC, "backend_comment"."created" DESC'.format(
-            page.id, root1.id)
+        spec = {'parent': root1.id}
         expected_qs_orm_analog = Comment.objects.filter(object_id=page.id, content_type_id=10,
                                                         ancestors__contains=[root1.id])
-        comments = get_comments(query)
+        comments = get_comments(spec)
 
         self.assertIsInstance(comments, list, comments)
         self.assertEqual(len(comments), 30)
-        self.assertListEqual(comments, CommentSerializer(Comment.objects.raw(query), many=True).data, comments)
+        self.assertListEqual(comments, CommentSerializer(get_comment_queryset(spec), many=True).data, comments)
         self.assertListEqual(comments, CommentSerializer(expected_qs_orm_analog, many=True).data, comments)
-        self.assertQuerysetEqual(Comment.objects.raw(query), [o.__repr__() for o in expected_qs_orm_analog[:]])
+        self.assertQuerysetEqual(get_comment_queryset(spec), [o.__repr__() for o in expected_qs_orm_analog[:]])
+
+    def test_rows_render_like_serializer(self):
+        root = PageCommentFactory(text='<b>Root & "quoted"</b>')
+        PageCommentFactory.create_batch(3, parent=root, text='Ünïcödé')
+        qs = Comment.objects.all()
+
+        self.assertEqual(JSONRenderer().render(serialize_comment_rows(qs)),
+                         JSONRenderer().render(CommentSerializer(qs, many=True).data))
@@ -0,0 +1,99 @@
+from datetime import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import now, utc
+
+from backend.factories import PageCommentFactory
+from backend.models import Comment
+from backend.partitions import create_history_partitions, drop_history_partitions, \
+    get_history_partitions, history_partition_name, history_table, maintain_history_partitions, \
+    month_start
+
+
+def history_row_table(history_id):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT tableoid::regclass::text FROM {0} WHERE history_id = %s'.format(
+            history_table()), [history_id])
+        return cursor.fetchone()[0]
+
+
+def table_exists(name):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        return cursor.fetchone()[0]
+
+
+class HistoryPartitionsTestCase(TestCase):
+    def test_history_table_is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s', [history_table()])
+            self.assertEqual(cursor.fetchone()[0], 'p')
+
+        months = [month for month, _ in get_history_partitions()]
+        self.assertIn(month_start(now()), months)
+        self.assertIn(month_start(now(), 3), months)
+
+    def test_history_is_written_to_its_month(self):
+        comment = PageCommentFactory()
+        record = comment.history.get()
+
+        self.assertEqual(history_row_table(record.history_id), history_partition_name(record.history_date))
+
+    def test_old_history_moves_out_of_the_default_partition(self):
+        old = datetime(2015, 3, 10, tzinfo=utc)
+        comment = PageCommentFactory()
+        record = comment.history.get()
+        Comment.history.filter(history_id=record.history_id).update(history_date=old)
+        self.assertEqual(history_row_table(record.history_id), '{0}_default'.format(history_table()))
+
+        created = create_history_partitions(old, datetime(2015, 4, 1, tzinfo=utc))
+
+        self.assertEqual(created, ['{0}_201503'.format(history_table()),
+                                   '{0}_201504'.format(history_table())])
+        self.assertEqual(history_row_table(record.history_id), '{0}_201503'.format(history_table()))
+        self.assertEqual(create_history_partitions(old, old), [])
+
+    def test_date_range_reads_one_partition(self):
+        month = month_start(now())
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN SELECT * FROM {0} WHERE history_date >= %s AND history_date < %s'
+                           .format(history_table()), [month, month_start(month, 1)])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+        self.assertIn(history_partition_name(month), plan)
+        self.assertNotIn(history_partition_name(month_start(month, 1)), plan)
+        self.assertNotIn('_default', plan)
+
+    def test_drop_and_detach_old_partitions(self):
+        create_history_partitions(datetime(2015, 1, 1, tzinfo=utc), datetime(2015, 2, 1, tzinfo=utc))
+
+        detached = drop_history_partitions(datetime(2015, 2, 10, tzinfo=utc), detach_only=True)
+        self.assertEqual(detached, ['{0}_201501'.format(history_table())])
+        self.assertTrue(table_exists(detached[0]))
+
+        dropped = drop_history_partitions(datetime(2015, 3, 1, tzinfo=utc))
+        self.assertEqual(dropped, ['{0}_201502'.format(history_table())])
+        self.assertFalse(table_exists(dropped[0]))
+        self.assertEqual(get_history_partitions()[0][0], month_start(now()))
+
+    def test_maintenance_keeps_partitions_ahead(self):
+        last = get_history_partitions()[-1][1]
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {0}'.format(connection.ops.quote_name(last)))
+
+        with self.settings(COMMENT_HISTORY_PARTITIONS_AHEAD=4):
+            result = maintain_history_partitions()
+
+        self.assertEqual(result, {'created': [last, history_partition_name(month_start(now(), 4))],
+                                  'removed': []})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('history_partitions', since='2015-06-20', list=True, stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Created {0}_201506.'.format(history_table()), output)
+        self.assertIn('2015-06 {0}_201506'.format(history_table()), output)
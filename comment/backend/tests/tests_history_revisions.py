@@ -0,0 +1,117 @@
+from datetime import datetime
+
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+
+from backend.factories import PageCommentFactory
+from backend.models import Comment
+from backend.revisions import apply_delta, compact_history, make_delta, restore_texts
+
+LONG_TEXT = ' '.join('word{0}'.format(i) for i in range(200))
+
+
+def edit_comment(comment, count):
+    texts = [comment.text]
+    for i in range(count):
+        comment.text = '{0} edit{1}'.format(comment.text.replace('word{0} '.format(i), ''), i)
+        comment.save()
+        texts.append(comment.text)
+    return texts
+
+
+class DeltaTestCase(TestCase):
+    def test_round_trip(self):
+        for base, text in [('', 'new text'), ('old text', ''), ('a  b\n c ', 'a b\n\n c d '),
+                           (LONG_TEXT, LONG_TEXT.replace('word5 ', 'wörd ') + ' end'),
+                           ('same', 'same')]:
+            delta = make_delta(7, base, text)
+            self.assertEqual(apply_delta(base, delta), text, (base, text))
+
+    def test_delta_is_compact(self):
+        delta = make_delta(7, LONG_TEXT, LONG_TEXT.replace('word100', 'changed'))
+
+        start = LONG_TEXT.index('word100')
+        self.assertEqual(delta, '[7,[0,{0}],"changed ",[{1},{2}]]'.format(
+            start, start + len('word100 '), len(LONG_TEXT)))
+
+
+@override_settings(COMMENT_HISTORY_SNAPSHOT_INTERVAL=10)
+class CompactHistoryTestCase(TestCase):
+    def revisions(self, comment):
+        return list(comment.history.order_by('history_date', 'history_id'))
+
+    def test_snapshots_and_deltas(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        texts = edit_comment(comment, 24)
+
+        self.assertEqual(compact_history(Comment.history.model), 22)
+
+        revisions = self.revisions(comment)
+        self.assertEqual([i for i, r in enumerate(revisions) if r.history_delta is None], [0, 10, 20])
+        self.assertTrue(all(r.text == '' for r in revisions if r.history_delta))
+        self.assertEqual([r.text for r in restore_texts(revisions)], texts)
+        self.assertEqual(compact_history(Comment.history.model), 0)
+
+    def test_restore_loads_one_interval(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        texts = edit_comment(comment, 34)
+        compact_history(Comment.history.model)
+        page = list(comment.history.order_by('-history_date', '-history_id')[3:8])
+
+        with self.assertNumQueries(1):
+            restore_texts(page)
+
+        self.assertEqual([r.text for r in page], texts[::-1][3:8])
+
+    def test_restore_follows_longer_chains(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        texts = edit_comment(comment, 12)
+        compact_history(Comment.history.model)
+        page = list(comment.history.order_by('-history_date', '-history_id')[:1])
+
+        with override_settings(COMMENT_HISTORY_SNAPSHOT_INTERVAL=1):
+            restore_texts(page)
+
+        self.assertEqual(page[0].text, texts[-1])
+
+    def test_expand(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        texts = edit_comment(comment, 5)
+        compact_history(Comment.history.model)
+
+        self.assertEqual(compact_history(Comment.history.model, interval=1), 5)
+        self.assertEqual([(r.text, r.history_delta) for r in self.revisions(comment)],
+                         [(text, None) for text in texts])
+
+    def test_snapshot_at_month_start(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        edit_comment(comment, 3)
+        revisions = self.revisions(comment)
+        Comment.history.filter(history_id=revisions[2].history_id) \
+            .update(history_date=datetime(2099, 1, 1, tzinfo=revisions[2].history_date.tzinfo))
+
+        compact_history(Comment.history.model, [comment.id])
+
+        self.assertEqual([r.history_delta is None for r in self.revisions(comment)],
+                         [True, False, False, True])
+
+    def test_short_texts_stay_full(self):
+        comment = PageCommentFactory(text='short')
+        comment.text = 'other'
+        comment.save()
+
+        self.assertEqual(compact_history(Comment.history.model), 0)
+
+    def test_api_restores_text(self):
+        comment = PageCommentFactory(text=LONG_TEXT)
+        texts = edit_comment(comment, 12)
+        compact_history(Comment.history.model)
+
+        res = self.client.get(reverse('historicalcomment-list'), {'id': comment.id})
+        self.assertEqual(res.data['count'], 13)
+        page = res.data['results']
+        self.assertEqual([r['text'] for r in page], texts[::-1][:len(page)])
+
+        latest = comment.history.first()
+        res = self.client.get(reverse('historicalcomment-detail', args=[latest.history_id]))
+        self.assertEqual(res.data['text'], texts[-1])
@@ -0,0 +1,192 @@
+import json
+import os
+from collections import defaultdict
+from time import perf_counter, time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from redis.exceptions import ConnectionError
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.factories import PageCommentFactory
+from backend.metrics import COUNTERS, HISTOGRAMS, Histogram, TaskTimer, clear_task_stats, \
+    flush_metrics, render_metrics
+from backend.tasks import create_import_file
+
+
+class FakeRedis(object):
+    """
+    The hash commands of a Redis server shared by every "process" of a test.
+    """
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+        self.results = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __len__(self):
+        return len(self.results)
+
+    def hincrby(self, key, field, amount):
+        field = field.encode()
+        self.hashes[key][field] = str(int(self.hashes[key].get(field, 0)) + amount).encode()
+        self.results.append(None)
+
+    def hincrbyfloat(self, key, field, amount):
+        field = field.encode()
+        self.hashes[key][field] = str(float(self.hashes[key].get(field, 0)) + amount).encode()
+        self.results.append(None)
+
+    def hgetall(self, key):
+        self.results.append(dict(self.hashes[key]))
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+class HistogramTestCase(TestCase):
+    def test_render_is_cumulative(self):
+        redis = FakeRedis()
+        histogram = Histogram('test_seconds', 'Test.', [0.1, 1.0])
+        histogram.observe('v', 0.05)
+        histogram.observe('v', 0.5)
+        histogram.flush(redis)
+        histogram.observe('v', 5)
+        histogram.flush(redis)
+
+        lines = histogram.render(redis.hashes[histogram.key])
+
+        self.assertIn('test_seconds_bucket{view="v",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="v",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="v",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{view="v"} 3', lines)
+        self.assertIn('test_seconds_sum{view="v"} 5.55', lines)
+        self.assertEqual(histogram.series, {})
+
+
+@override_settings(COMMENT_METRICS_ENABLED=True)
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        super(RequestMetricsTestCase, self).setUp()
+        for metric in list(HISTOGRAMS.values()) + list(COUNTERS.values()):
+            metric.clear()
+        self.redis = FakeRedis()
+        patcher = mock.patch('backend.metrics.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.comment = PageCommentFactory()
+
+    def test_server_timing_header(self):
+        res = self.client.get(reverse('comment-list'), {'level': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', res['Server-Timing'])
+        self.assertRegex(res['Server-Timing'], r'desc="[1-9]\d* queries"')
+        self.assertIn('serializer;dur=', res['Server-Timing'])
+
+    def test_histograms_per_action(self):
+        self.client.get(reverse('comment-list'), {'level': 0})
+        self.client.get(reverse('comment-detail', args=(self.comment.id,)))
+
+        res = self.client.get(reverse('metrics'))
+
+        body = res.content.decode()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('comment_request_duration_seconds_count{view="CommentViewSet.list"} 1', body)
+        self.assertIn('comment_request_db_queries_count{view="CommentViewSet.retrieve"} 1', body)
+
+    def test_summed_over_processes(self):
+        # Another worker flushed to the same Redis before this one.
+        HISTOGRAMS['comment_request_db_queries'].observe('CommentViewSet.list', 2)
+        COUNTERS['comment_thread_cache_lookups_total'].inc('hit')
+        flush_metrics()
+
+        self.client.get(reverse('comment-list'), {'level': 0})
+        COUNTERS['comment_thread_cache_lookups_total'].inc('hit')
+        body = render_metrics()
+
+        self.assertIn('comment_request_db_queries_count{view="CommentViewSet.list"} 2', body)
+        self.assertIn('comment_thread_cache_lookups_total{result="hit"} 2', body)
+
+    def test_flush_failure_is_logged(self):
+        self.redis.execute = mock.Mock(side_effect=ConnectionError)
+
+        with self.assertLogs('backend.metrics', 'WARNING'):
+            res = self.client.get(reverse('comment-list'), {'level': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(COMMENT_METRICS_ENABLED=False)
+    def test_disabled(self):
+        res = self.client.get(reverse('comment-list'), {'level': 0})
+
+        self.assertFalse(res.has_header('Server-Timing'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(COMMENT_METRICS_ENABLED=True, CELERY_TASK_ALWAYS_EAGER=True,
+                   COMMENT_SYNC_LIST_THRESHOLD=0, COMMENT_THREAD_CACHE_TTL=0)
+@mock.patch('backend.metrics.get_redis', mock.MagicMock())
+class TaskMetricsTestCase(TestCase):
+    def setUp(self):
+        super(TaskMetricsTestCase, self).setUp()
+        clear_task_stats()
+        self.comment = PageCommentFactory()
+        PageCommentFactory(parent=self.comment)
+
+    def test_list_result_timings(self):
+        res = self.client.get(reverse('comment-list'), {'object_id': self.comment.object_id})
+
+        self.assertEqual(res.data['status'], 'SUCCESS')
+        self.assertEqual(list(res.data['timings']), ['sql', 'serialization', 'rows'])
+        self.assertEqual(res.data['timings']['rows'], 2)
+
+    def test_export_timings(self):
+        task = create_import_file.delay({'object_id': self.comment.object_id}, 'json')
+        self.addCleanup(os.remove, '/tmp/{0}'.format(task.result['filename']))
+
+        timings = task.result['timings']
+        self.assertEqual(list(timings), ['sql', 'serialization', 'rendering', 'file_write',
+                                         'rows', 'result_size'])
+        self.assertEqual(timings['rows'], 2)
+        self.assertEqual(timings['result_size'], os.path.getsize('/tmp/{0}'.format(task.result['filename'])))
+
+    def test_aggregated_stats(self):
+        for i in range(2):
+            self.client.get(reverse('comment-list'), {'object_id': self.comment.object_id})
+
+        stats = json.loads(self.client.get(reverse('task-stats')).content.decode())
+
+        self.assertEqual(stats['get_comments']['sql']['count'], 2)
+        self.assertEqual(stats['get_comments']['rows']['total'], 4)
+        self.assertEqual(stats['get_comments']['result_store']['count'], 2)
+        self.assertEqual(stats['create_import_file'], {})
+
+    def test_queue_wait(self):
+        task = SimpleNamespace(request=SimpleNamespace(id='x', comment_published_at=time() - 2))
+
+        timer = TaskTimer.start(task, 'get_comments')
+
+        self.assertGreaterEqual(timer.as_dict()['queue_wait'], 2000)
+        self.assertIs(task.request.comment_task_timer, timer)
+
+    def test_result_store_excludes_bookkeeping(self):
+        timer = TaskTimer('get_comments', 'x')
+        recorded = []
+        with mock.patch('backend.metrics.record_task_stats',
+                        side_effect=lambda *args: recorded.append(perf_counter())):
+            timer.finish()
+
+        self.assertGreater(timer.finished, recorded[0])
+
+    @override_settings(COMMENT_METRICS_ENABLED=False)
+    def test_disabled(self):
+        res = self.client.get(reverse('comment-list'), {'object_id': self.comment.object_id})
+
+        self.assertNotIn('timings', res.data)
+        self.assertEqual(self.client.get(reverse('task-stats')).status_code, status.HTTP_404_NOT_FOUND)
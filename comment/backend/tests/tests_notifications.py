@@ -0,0 +1,145 @@
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from redis.exceptions import ConnectionError
+
+from backend.constants import COMMENT_CREATED_REASON, COMMENT_DELETED_REASON, COMMENT_UPDATED_REASON
+from backend.factories import PageCommentFactory, UserFactory
+from backend.models import Comment
+from backend.websockets import NOTIFICATION_QUEUE_KEY, coalesce_notifications, \
+    enqueue_notifications, publish_notifications
+
+
+def run_on_commit(func):
+    func()
+
+
+class CoalesceNotificationsTestCase(TestCase):
+    def test_net_change_per_thread(self):
+        threads = coalesce_notifications([
+            (1, 5, 10, COMMENT_CREATED_REASON),
+            (1, 5, 10, COMMENT_UPDATED_REASON),
+            (1, 5, 11, COMMENT_CREATED_REASON),
+            (1, 5, 11, COMMENT_DELETED_REASON),
+            (1, 5, 9, COMMENT_UPDATED_REASON),
+            (1, 5, 9, COMMENT_UPDATED_REASON),
+            (2, 5, 8, COMMENT_UPDATED_REASON),
+            (2, 5, 8, COMMENT_DELETED_REASON),
+        ])
+
+        self.assertEqual(list(threads), [(1, 5), (2, 5)])
+        self.assertEqual(dict(threads[(1, 5)]), {10: COMMENT_CREATED_REASON, 9: COMMENT_UPDATED_REASON})
+        self.assertEqual(dict(threads[(2, 5)]), {8: COMMENT_DELETED_REASON})
+
+
+class PublishNotificationsTestCase(TestCase):
+    def test_one_message_per_thread(self):
+        root = PageCommentFactory()
+        reply = PageCommentFactory(parent=root)
+        thread = (root.content_type_id, root.object_id)
+        connection = mock.MagicMock()
+        pipeline = connection.pipeline.return_value
+
+        published = publish_notifications(connection, [
+            thread + (root.id, COMMENT_UPDATED_REASON),
+            thread + (reply.id, COMMENT_CREATED_REASON),
+            thread + (reply.id, COMMENT_UPDATED_REASON),
+            thread + (0, COMMENT_DELETED_REASON),
+            # Created and deleted again before the publisher ran.
+            (root.content_type_id, 0, 1, COMMENT_CREATED_REASON),
+        ])
+
+        self.assertEqual(published, 1)
+        channel, message = pipeline.publish.call_args[0]
+        self.assertEqual(channel, 'broadcast:notification-{0}-{1}'.format(*thread))
+        diff = json.loads(message.decode())
+        self.assertEqual([c['id'] for c in diff[COMMENT_CREATED_REASON]], [reply.id])
+        self.assertEqual([c['id'] for c in diff[COMMENT_UPDATED_REASON]], [root.id])
+        self.assertEqual(diff[COMMENT_DELETED_REASON], [0])
+        pipeline.execute.assert_called_once_with()
+
+    @mock.patch('backend.management.commands.publish_notifications.get_redis')
+    def test_command_once(self, get_redis):
+        comment = PageCommentFactory()
+        event = json.dumps([comment.content_type_id, comment.object_id, comment.id,
+                            COMMENT_CREATED_REASON]).encode()
+        pipeline = get_redis.return_value.pipeline.return_value
+        pipeline.execute.return_value = [[event], True]
+
+        call_command('publish_notifications', once=True)
+
+        pipeline.lrange.assert_called_once_with(NOTIFICATION_QUEUE_KEY, 0, 9999)
+        self.assertEqual(pipeline.publish.call_count, 1)
+
+    @mock.patch('backend.management.commands.publish_notifications.sleep')
+    @mock.patch('backend.management.commands.publish_notifications.get_redis')
+    def test_command_survives_redis_errors(self, get_redis, sleep):
+        comment = PageCommentFactory()
+        event = json.dumps([comment.content_type_id, comment.object_id, comment.id,
+                            COMMENT_CREATED_REASON]).encode()
+        connection = get_redis.return_value
+        connection.blpop.side_effect = [ConnectionError, ConnectionError, (NOTIFICATION_QUEUE_KEY, event),
+                                        KeyboardInterrupt]
+        pipeline = connection.pipeline.return_value
+        pipeline.execute.side_effect = [[[], True], ConnectionError('publish')]
+
+        with self.assertLogs('backend.management.commands.publish_notifications') as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('publish_notifications')
+
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual([call[0][0] for call in sleep.call_args_list[:2]], [1, 2])
+        self.assertEqual(connection.blpop.call_count, 4)
+
+
+class EnqueueNotificationsTestCase(TestCase):
+    @mock.patch('backend.websockets.get_redis')
+    def test_enqueue(self, get_redis):
+        pipeline = get_redis.return_value.pipeline.return_value
+
+        enqueue_notifications([(1, 2, 3, COMMENT_CREATED_REASON)])
+
+        pipeline.rpush.assert_called_once_with(NOTIFICATION_QUEUE_KEY, '[1, 2, 3, "created"]')
+        pipeline.ltrim.assert_called_once_with(NOTIFICATION_QUEUE_KEY, -100000, -1)
+
+    @mock.patch('backend.websockets.get_redis')
+    def test_redis_errors_are_ignored(self, get_redis):
+        get_redis.return_value.pipeline.return_value.execute.side_effect = ConnectionError
+
+        enqueue_notifications([(1, 2, 3, COMMENT_CREATED_REASON)])
+
+    @override_settings(COMMENT_NOTIFICATIONS_ENABLED=False)
+    @mock.patch('backend.websockets.get_redis')
+    def test_disabled(self, get_redis):
+        enqueue_notifications([(1, 2, 3, COMMENT_CREATED_REASON)])
+
+        get_redis.assert_not_called()
+
+
+@mock.patch('backend.websockets.enqueue_notifications')
+@mock.patch('backend.websockets.transaction.on_commit', side_effect=run_on_commit)
+class CommentNotificationsTestCase(TestCase):
+    def test_writes_queue_events(self, on_commit, enqueue):
+        comment = PageCommentFactory()
+        comment_id = comment.id
+        comment.text = 'changed'
+        comment.save()
+        comment.delete()
+
+        thread = (comment.content_type_id, comment.object_id)
+        self.assertEqual([c[0][0] for c in enqueue.call_args_list], [
+            [thread + (comment_id, COMMENT_CREATED_REASON)],
+            [thread + (comment_id, COMMENT_UPDATED_REASON)],
+            [thread + (comment_id, COMMENT_DELETED_REASON)],
+        ])
+
+    def test_bulk_create_queues_one_batch(self, on_commit, enqueue):
+        root = PageCommentFactory()
+        enqueue.reset_mock()
+        replies = Comment.objects.bulk_create_tree(
+            [Comment(user=UserFactory(), parent_id=root.id, text=str(i)) for i in range(3)])
+
+        enqueue.assert_called_once_with([(root.content_type_id, root.object_id, c.id, COMMENT_CREATED_REASON)
+                                         for c in replies])
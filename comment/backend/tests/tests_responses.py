@@ -0,0 +1,129 @@
+import gzip
+import os
+import tempfile
+
+from django.test import RequestFactory, TestCase, override_settings
+
+from backend.responses import accepts_gzip, export_file_response, parse_range
+
+
+class ParseRangeTestCase(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=95-200', 100), (95, 99))
+
+    def test_ignored_ranges(self):
+        self.assertIsNone(parse_range('bytes=-', 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+
+    def test_unsatisfiable_ranges(self):
+        with self.assertRaises(ValueError):
+            parse_range('bytes=100-', 100)
+        with self.assertRaises(ValueError):
+            parse_range('bytes=10-5', 100)
+
+
+class AcceptsGzipTestCase(TestCase):
+    def accepts(self, header):
+        return accepts_gzip(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=header))
+
+    def test_accepted(self):
+        for header in ('gzip', 'deflate, GZIP;q=0.5', 'x-gzip', '*', 'br;q=1.0, *;q=0.1'):
+            self.assertTrue(self.accepts(header), header)
+
+    def test_refused(self):
+        for header in ('', 'identity', 'gzip;q=0', 'gzip;q=0.000, *', '*;q=0', 'br, *;q=0',
+                       'gzip;q=high', 'xgzip'):
+            self.assertFalse(self.accepts(header), header)
+
+
+@override_settings(COMMENT_EXPORT_SENDFILE=None)
+class ExportFileResponseTestCase(TestCase):
+    def setUp(self):
+        super(ExportFileResponseTestCase, self).setUp()
+        self.content = b'<root>' + b'<list-item>comment</list-item>' * 1000 + b'</root>'
+        f = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+        f.write(self.content)
+        f.close()
+        self.path = f.name
+        self.filename = os.path.basename(self.path)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        os.remove(self.path)
+        super(ExportFileResponseTestCase, self).tearDown()
+
+    def get(self, **headers):
+        request = self.factory.get('/comments/download/', **headers)
+        return export_file_response(request, self.path, self.filename, 'application/xml')
+
+    def test_full_file(self):
+        res = self.get()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+        self.assertEqual(res['Content-Length'], str(len(self.content)))
+        self.assertEqual(res['Content-Type'], 'application/xml')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertEqual(res['Content-Disposition'], 'attachment; filename=%s' % self.filename)
+        self.assertTrue(res['ETag'].startswith('"'))
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+
+        res = self.get(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_range(self):
+        res = self.get(HTTP_RANGE='bytes=6-16')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), self.content[6:17])
+        self.assertEqual(res['Content-Range'], 'bytes 6-16/{0}'.format(len(self.content)))
+        self.assertEqual(res['Content-Length'], '11')
+
+    def test_range_with_stale_if_range(self):
+        res = self.get(HTTP_RANGE='bytes=6-16', HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_unsatisfiable_range(self):
+        res = self.get(HTTP_RANGE='bytes={0}-'.format(len(self.content)))
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], 'bytes */{0}'.format(len(self.content)))
+
+    def test_gzip(self):
+        res = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertFalse(res.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(res.streaming_content)), self.content)
+        self.assertNotEqual(res['ETag'], self.get()['ETag'])
+
+    def test_gzip_refused(self):
+        res = self.get(HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+
+    @override_settings(COMMENT_EXPORT_SENDFILE='X-Accel-Redirect')
+    def test_x_accel_redirect(self):
+        res = self.get(HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'], '/protected-exports/' + self.filename)
+        self.assertEqual(res.content, b'')
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    @override_settings(COMMENT_EXPORT_SENDFILE='X-Sendfile')
+    def test_x_sendfile(self):
+        res = self.get()
+
+        self.assertEqual(res['X-Sendfile'], self.path)
+        self.assertEqual(res.content, b'')
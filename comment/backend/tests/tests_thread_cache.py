@@ -0,0 +1,128 @@
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from backend.cache import ThreadCache, invalidate_thread, thread_cache
+from backend.factories import PageCommentFactory, PageFactory, UserFactory
+from backend.metrics import COUNTERS
+from backend.models import Comment
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class APIThreadCacheTestCase(TestCase):
+    def setUp(self):
+        super(APIThreadCacheTestCase, self).setUp()
+        thread_cache.clear_local()
+        self.counter = COUNTERS['comment_thread_cache_lookups_total']
+        self.counter.clear()
+        self.page = PageFactory()
+        self.root = PageCommentFactory(root=self.page)
+        self.reply = PageCommentFactory(parent=self.root)
+
+    def list(self, **params):
+        return self.client.get(reverse('comment-list'), params)
+
+    def test_object_thread_is_cached(self):
+        first = self.list(object_id=self.page.id)
+        with self.assertNumQueries(0):
+            second = self.list(object_id=self.page.id)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual([c['id'] for c in second.data['result']], [self.root.id, self.reply.id])
+        self.assertEqual(self.counter.values, {'miss': 1, 'local_hit': 1})
+
+    def test_shared_cache_hit(self):
+        self.list(object_id=self.page.id)
+        thread_cache.clear_local()
+
+        res = self.list(object_id=self.page.id)
+
+        self.assertEqual(len(res.data['result']), 2)
+        self.assertEqual(self.counter.values['hit'], 1)
+
+    def test_writes_invalidate(self):
+        self.list(object_id=self.page.id)
+        self.list(parent=self.root.id)
+
+        nested = PageCommentFactory(parent=self.reply)
+        self.assertEqual(len(self.list(object_id=self.page.id).data['result']), 3)
+        self.assertEqual(len(self.list(parent=self.root.id).data['result']), 2)
+
+        nested.delete()
+        self.assertEqual(len(self.list(object_id=self.page.id).data['result']), 2)
+
+    def test_bulk_create_invalidates_tree(self):
+        self.client.get(reverse('comment-tree'), {'object_id': self.page.id})
+
+        Comment.objects.bulk_create_tree([Comment(user=UserFactory(), parent_id=self.root.id, text='x')])
+        res = self.client.get(reverse('comment-tree'), {'object_id': self.page.id})
+
+        self.assertEqual(len(res.data['results'][0]['children']), 2)
+        self.assertEqual(self.counter.values, {'miss': 2})
+
+    @override_settings(COMMENT_SYNC_LIST_THRESHOLD=0)
+    def test_task_result_is_cached(self):
+        first = self.list(object_id=self.page.id)
+        second = self.list(object_id=self.page.id)
+
+        self.assertIsNotNone(first.data['task_id'])
+        self.assertIsNone(second.data['task_id'])
+        self.assertEqual(second.data['result'], first.data['result'])
+
+    def test_filtered_listing_is_not_cached(self):
+        self.list(object_id=self.page.id, user=self.root.user_id)
+
+        self.assertEqual(self.counter.values, {})
+
+    @override_settings(COMMENT_THREAD_CACHE_TTL=0)
+    def test_disabled(self):
+        self.list(object_id=self.page.id)
+        self.list(object_id=self.page.id)
+
+        self.assertEqual(self.counter.values, {})
+
+
+class ThreadCacheTestCase(TestCase):
+    @override_settings(COMMENT_THREAD_CACHE_LOCAL_BYTES=100)
+    def test_local_entries_are_evicted_by_size(self):
+        cache = ThreadCache()
+        for key in 'abcde':
+            cache.set_local(key, b'x' * 25)
+        cache.set_local('large', b'x' * 26)
+
+        self.assertEqual(list(cache.local), ['b', 'c', 'd', 'e'])
+        self.assertEqual(cache.local_bytes, 100)
+
+
+class SharedThreadCacheTestCase(TestCase):
+    """
+    Two ThreadCache instances stand in for two API processes: each has its
+    own in-memory LRU, and both share the default cache.
+    """
+
+    def setUp(self):
+        super(SharedThreadCacheTestCase, self).setUp()
+        self.api = ThreadCache()
+        self.other = ThreadCache()
+        self.threads = [(1, 2)]
+
+    def test_payloads_are_shared(self):
+        key = self.api.get_key({'object_id': 2}, self.threads)
+        # As get_comments writes them from a worker.
+        self.other.set(key, b'[1]', local=False)
+
+        self.assertEqual(self.other.get_key({'object_id': 2}, self.threads), key)
+        self.assertEqual(self.api.get(key), b'[1]')
+
+    def test_invalidation_reaches_other_instances(self):
+        key = self.api.get_key({'object_id': 2}, self.threads)
+        self.api.set(key, b'[1]')
+        self.assertEqual(self.other.get(key), b'[1]')
+
+        invalidate_thread(1, 2)
+
+        new_key = self.other.get_key({'object_id': 2}, self.threads)
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(self.other.get(new_key))
+        self.assertEqual(self.api.get_key({'object_id': 2}, self.threads), new_key)
@@ -0,0 +1,34 @@
+def build_comment_tree(rows, base_level=0, max_depth=None, max_children=None):
+    """
+    Nest serialized comments into `children` lists in a single pass. `rows`
+    must be ordered so that every parent precedes its children, as sorting
+    by path guarantees. Nodes more than `max_depth` levels below
+    `base_level` and children past the first `max_children` of a node are
+    left out and counted in their parent's `more_replies` instead.
+
+    Rows that carry `children_count` take `more_replies` from it, so the
+    rows below `max_depth` need not be fetched at all.
+
+    Returns the top of the tree: a dict with the `base_level` comments in
+    `children` and its own `more_replies` count.
+    """
+    top = {'children': [], 'more_replies': 0}
+    nodes = {}
+    for row in rows:
+        depth = row['level'] - base_level
+        parent = top if depth == 0 else nodes.get(row['parent'])
+        if parent is None:
+            # An ancestor was left out, so its subtree is already counted.
+            continue
+        if (max_depth is not None and depth > max_depth) or \
+                (max_children is not None and len(parent['children']) >= max_children):
+            parent['more_replies'] += 1
+            continue
+        row['children'] = []
+        row['more_replies'] = 0
+        parent['children'].append(row)
+        nodes[row['id']] = row
+    for node in nodes.values():
+        if 'children_count' in node:
+            node['more_replies'] = node['children_count'] - len(node['children'])
+    return top
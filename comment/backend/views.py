@@ -1,33 +1,58 @@
-from celery.result import AsyncResult
-from django.http import HttpResponse
+import os
+from collections import OrderedDict
+
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult, EagerResult
+from celery.utils import uuid
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from redis.exceptions import RedisError
 from rest_framework import mixins
 from rest_framework import viewsets
-from rest_framework.decorators import list_route
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.status import HTTP_403_FORBIDDEN
+from rest_framework.status import HTTP_201_CREATED, HTTP_403_FORBIDDEN, HTTP_410_GONE
 from rest_framework.viewsets import GenericViewSet
 
+from backend.cache import get_export_cache_key, thread_cache
 from backend.permissions import IsOwnerOrReadOnly, IsLeafNodeOrNotDelete
 from backend.tasks import create_import_file, get_comments
-from comment.utils import get_sql
-from .filters import CommentFilter, CommentHistoryFilter
-from .models import BlogArticle, Page, Comment
+from .filters import CommentFilter, CommentHistoryFilter, \
+    build_comment_query_spec, filter_comment_tree, select_comment_tree
+from .history import get_history_backlog
+from .metrics import MetricsViewMixin, get_task_stats, get_task_timings, render_metrics
+from .models import BlogArticle, Page, Comment, CommentSummary
+from .pagination import CommentKeysetPagination, RevisionKeysetPagination
+from .responses import RenderedJSONResponse, export_file_response, spooled_result_response
 from .serializers import BlogArticleSerializer, PageSerializer, \
-    CommentSerializer, CommentHistorySerializer
+    CommentSerializer, CommentHistorySerializer, CommentBulkSerializer, \
+    COMMENT_ROW_FIELDS, render_comment_rows
+from .trees import build_comment_tree
+
+
+class CommentSummaryMixin(object):
+    def get_queryset(self):
+        queryset = super(CommentSummaryMixin, self).get_queryset()
+        return CommentSummary.objects.annotate_objects(queryset)
 
 
-class BlogArticleViewSet(viewsets.ModelViewSet):
+class BlogArticleViewSet(MetricsViewMixin, CommentSummaryMixin, viewsets.ModelViewSet):
     queryset = BlogArticle.objects.all()
     serializer_class = BlogArticleSerializer
 
 
-class PageViewSet(viewsets.ModelViewSet):
+class PageViewSet(MetricsViewMixin, CommentSummaryMixin, viewsets.ModelViewSet):
     queryset = Page.objects.all()
     serializer_class = PageSerializer
 
 
-class CommentHistoryViewSet(mixins.RetrieveModelMixin,
+class CommentHistoryViewSet(MetricsViewMixin,
+                            mixins.RetrieveModelMixin,
                             mixins.ListModelMixin,
                             GenericViewSet):
     queryset = Comment.history.all()
@@ -36,7 +61,7 @@ class CommentHistoryViewSet(mixins.RetrieveModelMixin,
     filter_class = CommentHistoryFilter
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(MetricsViewMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     filter_backends = (DjangoFilterBackend,)
@@ -49,12 +74,11 @@ class CommentViewSet(viewsets.ModelViewSet):
         task_id = query_params.pop('task_id', [None])[0]
         task = None
         if task_id is None:
-            queryset = self.filter_queryset(self.get_queryset())
-            query = get_sql(queryset)
-            task = create_import_file.delay(query, kwargs.get('format', 'xml'))
+            spec = build_comment_query_spec(request.query_params)
+            task = self.wait_for_task(self.get_export_task(spec, kwargs.get('format', 'xml')))
             if not task.status == 'SUCCESS':
                 return Response({'task_id': task.id})
-        task = task or AsyncResult(task_id)
+        task = task or self.wait_for_task(AsyncResult(task_id))
         status = task.status
         result = task.result
         response = {
@@ -63,17 +87,186 @@ class CommentViewSet(viewsets.ModelViewSet):
         }
         if isinstance(result, Exception):
             response['error'] = str(result)
+        elif status == 'PROGRESS':
+            response['progress'] = result
         else:
             try:
-                file = open('/tmp/{0}'.format(result['filename']))
-            except:
+                path = os.path.join(settings.COMMENT_EXPORT_DIR, result['filename'])
+                return export_file_response(request, path, result['filename'],
+                                            result['media_type'])
+            except (TypeError, KeyError, OSError):
                 return Response(status=HTTP_403_FORBIDDEN)
-            else:
-                response = HttpResponse(file, content_type=result['media_type'])
-                response['Content-Disposition'] = 'attachment; filename=%s' % result['filename']
-                return response
         return Response(response)
 
+    def wait_for_task(self, task):
+        """
+        Block for up to `wait` seconds until `task` is finished. The Redis
+        result backend waits on the task's pub/sub channel, not a polling
+        loop, and keeps the result so reading it afterwards is free.
+        """
+        value = self.request.query_params.get('wait')
+        if value is None:
+            return task
+        try:
+            wait = float(value)
+            if not 0 <= wait < float('inf'):
+                raise ValueError(value)
+        except ValueError:
+            raise ValidationError({'wait': 'A non-negative number of seconds is required.'})
+        wait = min(wait, settings.COMMENT_TASK_MAX_WAIT)
+        if wait and not task.ready():
+            try:
+                task.get(timeout=wait, propagate=False)
+            except TimeoutError:
+                pass
+        return task
+
+    def get_export_task(self, spec, format_suffix):
+        # Identical exports join one task and reuse its file until a comment
+        # write moves the export generation on.
+        cache_key = get_export_cache_key(spec, format_suffix)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            result = cached.get('result')
+            if result is None:
+                return AsyncResult(cached['task_id'])
+            path = os.path.join(settings.COMMENT_EXPORT_DIR, result['filename'])
+            if os.path.isfile(path):
+                return EagerResult(cached['task_id'], result, 'SUCCESS')
+            cache.delete(cache_key)
+        task_id = uuid()
+        if not cache.add(cache_key, {'task_id': task_id}, settings.COMMENT_EXPORT_PENDING_TTL):
+            return self.get_export_task(spec, format_suffix)
+        return create_import_file.apply_async((spec, format_suffix, cache_key),
+                                              task_id=task_id)
+
+    @list_route(methods=['post'])
+    def bulk(self, request, **kwargs):
+        if isinstance(request.data, list) and len(request.data) > settings.COMMENT_BULK_MAX_SIZE:
+            raise ValidationError({'detail': 'At most {0} comments may be created at once.'.format(
+                settings.COMMENT_BULK_MAX_SIZE)})
+        serializer = CommentBulkSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        comments = []
+        refs = {}
+        for item in serializer.validated_data:
+            comment = Comment(user_id=item['user_id'], parent_id=item.get('parent'),
+                              content_type_id=item.get('content_type'),
+                              object_id=item.get('object_id'), text=item['text'])
+            if 'parent_ref' in item:
+                if item['parent_ref'] not in refs:
+                    raise ValidationError({'parent_ref': 'Unknown reference {0}.'.format(item['parent_ref'])})
+                comment.parent = refs[item['parent_ref']]
+            if 'ref' in item:
+                refs[item['ref']] = comment
+            comments.append(comment)
+        try:
+            Comment.objects.bulk_create_tree(comments)
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(CommentSerializer(comments, many=True).data,
+                        status=HTTP_201_CREATED)
+
+    @detail_route()
+    def revisions(self, request, pk=None):
+        """
+        Revisions of a comment, deleted or not, newest first. Pages through
+        them with a cursor, or returns only the `latest` K.
+        """
+        try:
+            comment_id = int(pk)
+        except ValueError:
+            raise Http404
+        queryset = Comment.history.filter(id=comment_id)
+        latest = request.query_params.get('latest')
+        if latest is not None:
+            try:
+                latest = int(latest)
+                if not 0 < latest <= settings.COMMENT_REVISIONS_MAX_LATEST:
+                    raise ValueError(latest)
+            except ValueError:
+                raise ValidationError({'latest': 'A number of revisions from 1 to {0} is required.'.format(
+                    settings.COMMENT_REVISIONS_MAX_LATEST)})
+            revisions = list(queryset.order_by(*RevisionKeysetPagination.ordering)[:latest])
+            if not revisions:
+                raise Http404
+            return Response({'results': CommentHistorySerializer(revisions, many=True).data})
+        paginator = RevisionKeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if not page and 'cursor' not in request.query_params:
+            raise Http404
+        return paginator.get_paginated_response(CommentHistorySerializer(page, many=True).data)
+
+    @list_route()
+    def tree(self, request, **kwargs):
+        params = {key: request.query_params[key] for key in ('parent', 'object_id')
+                  if key in request.query_params}
+        if not params:
+            raise ValidationError({'detail': 'Either parent or object_id is required.'})
+        max_depth = self.get_tree_limit('max_depth', settings.COMMENT_TREE_MAX_DEPTH)
+        max_children = self.get_tree_limit('max_children_per_node',
+                                           settings.COMMENT_TREE_MAX_CHILDREN)
+        threads, parent_level = self.get_threads(params)
+        cache_key = thread_cache.get_key(['tree', params, max_depth, max_children],
+                                         threads) if threads else None
+        payload = thread_cache.get(cache_key) if cache_key else None
+        if payload is None:
+            # An unknown parent leaves the queryset empty, so 0 is harmless.
+            base_level = 0 if parent_level is None else parent_level + 1
+            if max_children is None:
+                queryset = filter_comment_tree(Comment.objects.all(), params)
+                if max_depth is not None:
+                    # Replies below the limit are reported from children_count.
+                    queryset = queryset.filter(level__lte=base_level + max_depth)
+                # Legacy rows without a path sort first, parents ahead of children.
+                rows = queryset.order_by('path', 'level', 'id').values_list(*COMMENT_ROW_FIELDS)
+                more_replies = 0
+            else:
+                rows, more_replies = select_comment_tree(params, base_level, max_depth,
+                                                         max_children, COMMENT_ROW_FIELDS)
+            top = build_comment_tree(render_comment_rows(rows), base_level,
+                                     max_depth, max_children)
+            top['more_replies'] += more_replies
+            payload = JSONRenderer().render(OrderedDict((
+                ('more_replies', top['more_replies']),
+                ('results', top['children']),
+            )))
+            if cache_key:
+                thread_cache.set(cache_key, payload)
+        return RenderedJSONResponse(payload)
+
+    def get_threads(self, params):
+        """
+        Return the `(content_type_id, object_id)` threads a listing by
+        `parent` or `object_id` reads from, and the level of the parent.
+        Listings of unknown parents or malformed ids read from none.
+        """
+        if 'parent' in params:
+            if not params['parent'].isdigit():
+                return [], None
+            row = Comment.objects.filter(id=params['parent']) \
+                .values_list('content_type_id', 'object_id', 'level').first()
+            if row is None:
+                return [], None
+            return [row[:2]], row[2]
+        if not params['object_id'].isdigit():
+            return [], None
+        # Listings by object_id span the objects of every content type.
+        return [(content_type.id, int(params['object_id']))
+                for content_type in ContentType.objects.get_for_models(Page, BlogArticle).values()], None
+
+    def get_tree_limit(self, name, limit):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return limit
+        try:
+            value = int(value)
+            if value < 0:
+                raise ValueError(value)
+        except ValueError:
+            raise ValidationError({name: 'A non-negative integer is required.'})
+        return value if limit is None else min(value, limit)
+
     def list(self, request, *args, **kwargs):
         if 'level' in request.query_params:
             queryset = self.filter_queryset(self.get_queryset())
@@ -86,35 +279,101 @@ class CommentViewSet(viewsets.ModelViewSet):
         task_id = query_params.pop('task_id', [None])[0]
         task = None
         if task_id is None:
+            spec = build_comment_query_spec(request.query_params)
+            cache_key = self.get_list_cache_key(spec)
+            payload = thread_cache.get(cache_key) if cache_key else None
+            if payload is not None:
+                return self.get_result_response(payload)
             queryset = self.filter_queryset(self.get_queryset())
-            query = get_sql(queryset)
-            task = get_comments.delay(query)
+            comments = self.get_small_result(queryset)
+            if comments is not None:
+                payload = JSONRenderer().render(self.get_serializer(comments, many=True).data)
+                if cache_key:
+                    thread_cache.set(cache_key, payload)
+                return self.get_result_response(payload)
+            task = self.wait_for_task(get_comments.delay(spec, cache_key))
             if not task.status == 'SUCCESS':
                 return Response({'task_id': task.id})
-        task = task or AsyncResult(task_id)
+        task = task or self.wait_for_task(AsyncResult(task_id))
         status = task.status
         result = task.result
         response = {
-            'task_id': task_id,
+            'task_id': task.id,
             'status': status
         }
         if isinstance(result, Exception):
             response['error'] = str(result)
+        elif isinstance(result, dict) and 'spooled' in result:
+            try:
+                return spooled_result_response(
+                    request, os.path.join(settings.COMMENT_EXPORT_DIR, result['spooled']))
+            except OSError:
+                response['error'] = 'The result has already been fetched or has expired.'
+                return Response(response, status=HTTP_410_GONE)
         else:
             response['result'] = result
+        if status == 'SUCCESS' and settings.COMMENT_METRICS_ENABLED:
+            response['timings'] = get_task_timings(task.id)
         return Response(response)
 
+    def get_list_cache_key(self, spec):
+        # Only whole threads and subtrees are cached, not filtered listings.
+        if not {'parent', 'object_id'} & set(spec) or set(spec) - {'parent', 'object_id', 'ordering'}:
+            return None
+        threads, _ = self.get_threads(spec)
+        return thread_cache.get_key(['list', spec], threads) if threads else None
+
+    def get_result_response(self, payload):
+        head = JSONRenderer().render(OrderedDict((('task_id', None), ('status', 'SUCCESS'))))
+        return RenderedJSONResponse(head[:-1] + b',"result":' + payload + b'}')
+
+    def get_small_result(self, queryset):
+        # Probing with LIMIT threshold + 1 costs no extra query for small
+        # threads and a bounded one for the large ones that go to Celery.
+        threshold = settings.COMMENT_SYNC_LIST_THRESHOLD
+        if not threshold:
+            return None
+        comments = list(queryset[:threshold + 1])
+        if len(comments) > threshold:
+            return None
+        return comments
+
     def get_queryset(self):
         qs = super(CommentViewSet, self).get_queryset()
-        if 'level' not in self.request.query_params:
-            if 'parent' in self.request.query_params:
-                parent = self.request.query_params.get('parent')
-                qs = qs.filter(ancestors__contains=[parent])
-            elif 'object_id' in self.request.query_params:
-                qs = qs.filter(object_id=self.request.query_params.get('object_id'))
-        return qs
+        return filter_comment_tree(qs, self.request.query_params)
 
     def paginate_queryset(self, queryset):
         if 'level' not in self.request.query_params:
             return None
         return super(CommentViewSet, self).paginate_queryset(queryset)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and \
+                self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = CommentKeysetPagination()
+        return super(CommentViewSet, self).paginator
+
+
+def metrics(request):
+    if not settings.COMMENT_METRICS_ENABLED:
+        raise Http404
+    gauges = []
+    if settings.COMMENT_DEFERRED_HISTORY:
+        try:
+            backlog, lag = get_history_backlog()
+        except RedisError:
+            pass
+        else:
+            gauges = [
+                ('comment_history_backlog', 'History records queued and not yet written.', backlog),
+                ('comment_history_lag_seconds',
+                 'Age of the oldest history record not yet written.', lag),
+            ]
+    return HttpResponse(render_metrics(gauges), content_type='text/plain; version=0.0.4')
+
+
+def task_stats(request):
+    if not settings.COMMENT_METRICS_ENABLED:
+        raise Http404
+    return JsonResponse(get_task_stats())
@@ -1,9 +1,122 @@
 import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from redis import ConnectionPool, StrictRedis
+from redis.exceptions import RedisError
+from ws4redis import settings as ws4redis_settings
 from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
+from ws4redis.redis_store import RedisMessage, RedisStore
+
+from .constants import COMMENT_CREATED_REASON, COMMENT_DELETED_REASON, COMMENT_UPDATED_REASON
+
+NOTIFICATION_QUEUE_KEY = 'comment-notifications'
+
+logger = logging.getLogger(__name__)
+connection_pool = ConnectionPool(**settings.WS4REDIS_CONNECTION)
+
+
+def get_redis():
+    return StrictRedis(connection_pool=connection_pool)
+
+
+def notification_facility(content_type_id, object_id):
+    return 'notification-{0}-{1}'.format(content_type_id, object_id)
+
+
+def enqueue_notifications(events):
+    """
+    Queue `(content_type_id, object_id, comment_id, reason)` events for the
+    `publish_notifications` command. The queue is capped, and failures are
+    only logged, as a missed notification must not fail the write behind it.
+    """
+    if not settings.COMMENT_NOTIFICATIONS_ENABLED or not events:
+        return
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        pipeline.rpush(NOTIFICATION_QUEUE_KEY, *[json.dumps(event) for event in events])
+        pipeline.ltrim(NOTIFICATION_QUEUE_KEY, -settings.COMMENT_NOTIFICATION_QUEUE_MAX, -1)
+        pipeline.execute()
+    except RedisError as e:
+        logger.warning('Could not queue %d comment notifications: %s', len(events), e)
+
+
+def notify_on_commit(events):
+    transaction.on_commit(lambda: enqueue_notifications(events))
+
+
+def decode_notification(event):
+    return json.loads(event.decode())
+
+
+def take_notifications(connection, limit):
+    if limit <= 0:
+        return []
+    pipeline = connection.pipeline()
+    pipeline.lrange(NOTIFICATION_QUEUE_KEY, 0, limit - 1)
+    pipeline.ltrim(NOTIFICATION_QUEUE_KEY, limit, -1)
+    return [decode_notification(event) for event in pipeline.execute()[0]]
+
+
+def coalesce_notifications(events):
+    """
+    Fold events into the net change per comment and thread: an update of a
+    comment created in the same batch stays a creation, and a comment
+    created and deleted in the same batch drops out.
+    """
+    threads = OrderedDict()
+    for content_type_id, object_id, comment_id, reason in events:
+        changes = threads.setdefault((content_type_id, object_id), OrderedDict())
+        previous = changes.get(comment_id)
+        if reason == COMMENT_DELETED_REASON and previous == COMMENT_CREATED_REASON:
+            del changes[comment_id]
+        elif reason != COMMENT_UPDATED_REASON or previous is None:
+            changes[comment_id] = reason
+    return threads
+
+
+def publish_notifications(connection, events):
+    """
+    Publish one message per thread on its `notification-<content_type>-
+    <object_id>` facility, listing the comments created and updated, as
+    serialized now, and the ids deleted. All threads go out in a single
+    pipeline. Returns the number of messages published.
+    """
+    from .models import Comment
+    from .serializers import serialize_comment_rows
+
+    threads = coalesce_notifications(events)
+    changed = {comment_id for changes in threads.values()
+               for comment_id, reason in changes.items() if reason != COMMENT_DELETED_REASON}
+    rows = {row['id']: row for row in serialize_comment_rows(Comment.objects.filter(id__in=changed))}
+    pipeline = connection.pipeline(transaction=False)
+    published = 0
+    for (content_type_id, object_id), changes in threads.items():
+        diff = OrderedDict((reason, []) for reason in (COMMENT_CREATED_REASON,
+                                                       COMMENT_UPDATED_REASON,
+                                                       COMMENT_DELETED_REASON))
+        for comment_id, reason in changes.items():
+            if reason == COMMENT_DELETED_REASON:
+                diff[reason].append(comment_id)
+            elif comment_id in rows:
+                # Comments missing here were deleted since; that event follows.
+                diff[reason].append(rows[comment_id])
+        if not any(diff.values()):
+            continue
+        channel = '{0}broadcast:{1}'.format(RedisStore.get_prefix(),
+                                            notification_facility(content_type_id, object_id))
+        message = RedisMessage(json.dumps(diff))
+        pipeline.publish(channel, message)
+        if ws4redis_settings.WS4REDIS_EXPIRE > 0:
+            pipeline.setex(channel, ws4redis_settings.WS4REDIS_EXPIRE, message)
+        published += 1
+    pipeline.execute()
+    return published
 
 
-def notification_comment(content_type, object_id, data):
-    redis_publisher = RedisPublisher(facility='notification-{0}-{1}'.format(content_type, object_id), broadcast=True)
-    message = RedisMessage(json.dumps(data))
+def notification_task(task_id, status):
+    redis_publisher = RedisPublisher(facility='task-{0}'.format(task_id), broadcast=True)
+    message = RedisMessage(json.dumps({'task_id': task_id, 'status': status}))
     redis_publisher.publish_message(message)
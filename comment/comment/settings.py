@@ -25,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -105,8 +106,144 @@ WS4REDIS_CONNECTION = {
     'db': 17
 }
 
+# Thread caches, export generations and task stats must be seen by every
+# API process and Celery worker, so the default cache lives in Redis. The
+# test suite runs without Redis with comment.test_settings.
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('COMMENT_CACHE_URL', 'redis://localhost:6379/1'),
+        'KEY_PREFIX': 'comment',
+    },
+}
+
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379')
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'sweep-comment-exports': {
+        'task': 'backend.tasks.sweep_export_files',
+        'schedule': 10 * 60,
+    },
+    'write-deferred-history': {
+        'task': 'backend.tasks.write_deferred_history',
+        'schedule': 5,
+    },
+    'compact-comment-history': {
+        'task': 'backend.tasks.compact_comment_history',
+        'schedule': 24 * 60 * 60,
+    },
+    'maintain-history-partitions': {
+        'task': 'backend.tasks.maintain_history_partitions',
+        'schedule': 24 * 60 * 60,
+    },
+}
+
+# Comment listings with at most this many rows are served inline instead of
+# through the `get_comments` task. 0 sends every listing through Celery.
+COMMENT_SYNC_LIST_THRESHOLD = 200
+
+# Rows fetched from the server-side cursor and serialized per step while
+# `create_import_file` streams an export to disk.
+COMMENT_EXPORT_CHUNK_SIZE = 2000
+
+# get_comments results with more rows than this are written gzip-compressed
+# to COMMENT_EXPORT_DIR instead of the result backend, which only keeps a
+# small manifest. The file is streamed by the next poll and then removed;
+# unfetched ones are swept like exports. 0 keeps every result in the backend.
+COMMENT_RESULT_SPOOL_THRESHOLD = 5000
+
+# Most revisions /comments/<id>/revisions/?latest= returns.
+COMMENT_REVISIONS_MAX_LATEST = 100
+
+# Longest `wait` in seconds a comment list or download poll may block for
+# its task to finish. Finished tasks are also announced on the websocket
+# channel `task-<task id>`.
+COMMENT_TASK_MAX_WAIT = 30
+
+# Directory finished exports are written to and served from.
+COMMENT_EXPORT_DIR = '/tmp'
+
+# Identical exports are deduplicated through the default cache, which has to
+# be shared by API processes and Celery workers (memcached, Redis) for
+# finished files to be reused across processes. Files are kept for
+# COMMENT_EXPORT_TTL seconds, and the sweeper also keeps the directory under
+# COMMENT_EXPORT_MAX_BYTES by removing the oldest exports first. An export
+# still being written is only joined for COMMENT_EXPORT_PENDING_TTL seconds
+# after its task last wrote a chunk, so one lost with its worker stops being
+# joined; the task itself is redelivered then.
+COMMENT_EXPORT_TTL = 60 * 60
+COMMENT_EXPORT_PENDING_TTL = 5 * 60
+COMMENT_EXPORT_MAX_BYTES = 5 * 1024 ** 3
+
+# Set to 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache, lighttpd) to let
+# the front proxy send export files. For X-Accel-Redirect the header value is
+# COMMENT_EXPORT_SENDFILE_ROOT + filename, which must map to an internal
+# location aliased to COMMENT_EXPORT_DIR.
+COMMENT_EXPORT_SENDFILE = None
+COMMENT_EXPORT_SENDFILE_ROOT = '/protected-exports/'
+
+# Upper bounds for /comments/tree/. Replies cut by either limit are reported
+# as `more_replies` counts on their parent; None disables a limit.
+COMMENT_TREE_MAX_DEPTH = 10
+COMMENT_TREE_MAX_CHILDREN = 100
+
+# Seconds rendered comment threads and subtrees, as listed by object_id or
+# parent and by /comments/tree/, are kept compressed in the default cache.
+# Comment writes retire them at once by moving a per-thread version on.
+# Each process also keeps up to COMMENT_THREAD_CACHE_LOCAL_BYTES of them in
+# memory. 0 disables the cache.
+COMMENT_THREAD_CACHE_TTL = 10 * 60
+COMMENT_THREAD_CACHE_LOCAL_BYTES = 32 * 1024 ** 2
+
+# Comment writes queue notifications in Redis once committed; the
+# `publish_notifications` command sends them to websocket subscribers as one
+# message per thread every COMMENT_NOTIFICATION_INTERVAL milliseconds, taking
+# at most COMMENT_NOTIFICATION_BATCH events at a time. The queue keeps the
+# newest COMMENT_NOTIFICATION_QUEUE_MAX events while no publisher runs.
+COMMENT_NOTIFICATIONS_ENABLED = True
+COMMENT_NOTIFICATION_INTERVAL = 250
+COMMENT_NOTIFICATION_BATCH = 10000
+COMMENT_NOTIFICATION_QUEUE_MAX = 100000
+
+# The comment history table is partitioned by month of history_date. The
+# daily `maintain_history_partitions` task keeps partitions for this many
+# months ahead, and with COMMENT_HISTORY_RETENTION_MONTHS set drops the
+# partitions of history older than that many months. Rows outside every
+# partition land in a default partition and are moved out when theirs is
+# created.
+COMMENT_HISTORY_PARTITIONS_AHEAD = 3
+COMMENT_HISTORY_RETENTION_MONTHS = None
+
+# With COMMENT_DEFERRED_HISTORY, comment writes keep their history records
+# in memory and queue them in Redis once committed instead of inserting
+# them inline. The `write_deferred_history` task writes the queue in
+# multi-row INSERTs of COMMENT_HISTORY_BATCH_SIZE records, run every five
+# seconds by `write-deferred-history` above. A batch stays in Redis until its rows
+# are committed, and a worker that dies mid-batch leaves it to the next
+# run; one worker drains at a time, holding a lock for at most
+# COMMENT_HISTORY_LOCK_TIMEOUT seconds. Records that cannot be written are
+# logged and moved to the `comment-history-failed` list in Redis. /metrics/
+# reports the backlog and the age of its oldest record.
+COMMENT_DEFERRED_HISTORY = False
+COMMENT_HISTORY_BATCH_SIZE = 1000
+COMMENT_HISTORY_LOCK_TIMEOUT = 60
+
+# The daily `compact_comment_history` task stores the text of edited
+# comments' history as a full snapshot every COMMENT_HISTORY_SNAPSHOT_INTERVAL
+# revisions and at the start of each month, with compact deltas between
+# them. /history/ reconstructs the text of delta revisions when reading.
+COMMENT_HISTORY_SNAPSHOT_INTERVAL = 10
+
+# Largest number of comments accepted by one POST /comments/bulk/ request.
+COMMENT_BULK_MAX_SIZE = 1000
+
+# Per-request query count and timings, reported in a Server-Timing header
+# and as Prometheus histograms at /metrics/. Histograms and counters are
+# summed over every worker in Redis hashes (WS4REDIS_CONNECTION), so any
+# worker can be scraped. Also keeps phase timings of the get_comments and
+# create_import_file tasks in the default cache, shown per task in list
+# results and summed up at /metrics/tasks/.
+COMMENT_METRICS_ENABLED = False
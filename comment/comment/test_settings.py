@@ -0,0 +1,8 @@
+from .settings import *  # noqa: F401,F403
+
+# Run the test suite without Redis: tests that need it mock get_redis().
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
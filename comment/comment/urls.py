@@ -12,4 +12,6 @@ router.register(r'history', backend_views.CommentHistoryViewSet)
 urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics/$', backend_views.metrics, name='metrics'),
+    url(r'^metrics/tasks/$', backend_views.task_stats, name='task-stats'),
 ]